@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Worker dedicado del monitor de alertas
+Escala por separado de la capa web; varios workers del mismo shard se
+coordinan con un lease en la base de datos (solo uno está activo)
+
+Uso:
+    python alert_worker.py                          # un único shard
+    python alert_worker.py --shard 0 --shards 4     # shard 0 de 4
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_database
+from utils.logging_config import configure_logging
+from services.alert_service import AlertService
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor de alertas de FungiCloud')
+    parser.add_argument('--shard', type=int, default=int(os.getenv('ALERT_SHARD_INDEX', 0)),
+                        help='Índice del shard de servidores a vigilar')
+    parser.add_argument('--shards', type=int, default=int(os.getenv('ALERT_SHARD_COUNT', 1)),
+                        help='Número total de shards')
+    args = parser.parse_args()
+    
+    configure_logging()
+    
+    init_database()
+    service = AlertService(shard_index=args.shard, shard_count=args.shards)
+    
+    def handle_signal(signum, frame):
+        logger.info("Señal recibida, deteniendo monitor de alertas...")
+        service.running = False
+        service.scheduler.wake()
+    
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    
+    service.run_forever()
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Error en worker de alertas: {e}")
+        sys.exit(1)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Archivo de sync_data antiguo en segmentos comprimidos
+Pensado para ejecutarse periódicamente (ej: cron diario); las muestras archivadas
+se siguen sirviendo en /api/sync/servers/<id>/history y /export
+
+Uso:
+    python archive_sync_data.py                   # muestras de más de ARCHIVE_AFTER_DAYS días
+    python archive_sync_data.py --days 180        # límite explícito
+    python archive_sync_data.py --server 42       # solo un servidor (id interno)
+"""
+import argparse
+import logging
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_database
+from utils.logging_config import configure_logging
+from services.archive_service import get_segment_archive, ARCHIVE_AFTER_DAYS
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivo de sync_data de FungiCloud')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='Archivar muestras con más de estos días')
+    parser.add_argument('--server', type=int, default=None,
+                        help='ID interno del servidor a archivar (por defecto todos)')
+    args = parser.parse_args()
+    
+    configure_logging()
+    
+    init_database()
+    result = get_segment_archive().run(args.days, args.server)
+    logger.info(f"Archivo completado: {result['samples']} muestras de {result['servers']} servidores "
+                f"(anteriores a {result['cutoff']})")
+    if result['failed']:
+        logger.error(f"Servidores con errores: {result['failed']}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Error en archivo de sync_data: {e}")
+        sys.exit(1)
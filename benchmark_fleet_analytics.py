@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la analítica de flota
+Genera columnas sintéticas con la forma de load_window (server_id, user_id, métricas
+float32 con huecos NaN y plan por muestra) y mide compute_fleet_stats sobre decenas de
+millones de filas; con --hours también mide la carga real de la ventana desde los shards
+
+Uso:
+    python benchmark_fleet_analytics.py                     # 20 millones de filas
+    python benchmark_fleet_analytics.py --rows 50000000 --servers 20000
+    python benchmark_fleet_analytics.py --rows 0 --hours 24  # solo la carga desde la base
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from services.analytics_service import ANALYTICS_METRICS, OPTIMAL_RANGES, PLAN_TYPES, compute_fleet_stats, load_window
+
+CHUNK_ROWS = 5_000_000
+
+def synthetic_window(rows: int, servers: int, users: int, missing: float, seed: int = 7) -> dict:
+    """Columnas como las de load_window, generadas por bloques para acotar los temporales"""
+    rng = np.random.default_rng(seed)
+    arrays = {
+        'server_id': np.empty(rows, dtype=np.int64),
+        'user_id': np.empty(rows, dtype=np.int64),
+        'plan': np.empty(rows, dtype=np.int8),
+        **{metric: np.empty(rows, dtype=np.float32) for metric in ANALYTICS_METRICS}
+    }
+    owner = rng.integers(1, users + 1, size=servers + 1)  # usuario de cada servidor
+    user_plan = rng.integers(0, len(PLAN_TYPES), size=users + 1).astype(np.int8)
+
+    for offset in range(0, rows, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, rows - offset)
+        chunk = slice(offset, offset + size)
+        server_ids = rng.integers(1, servers + 1, size=size)
+        arrays['server_id'][chunk] = server_ids
+        arrays['user_id'][chunk] = owner[server_ids]
+        arrays['plan'][chunk] = user_plan[owner[server_ids]]
+        for metric in ANALYTICS_METRICS:
+            low, high = OPTIMAL_RANGES[metric]
+            values = rng.normal((low + high) / 2, (high - low) / 3, size=size).astype(np.float32)
+            values[rng.random(size) < missing] = np.nan
+            arrays[metric][chunk] = values
+    return arrays
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la analítica de flota de FungiCloud')
+    parser.add_argument('--rows', type=int, default=20_000_000, help='Filas sintéticas (0 = omitir)')
+    parser.add_argument('--servers', type=int, default=10000, help='Servidores distintos')
+    parser.add_argument('--users', type=int, default=4000, help='Usuarios distintos')
+    parser.add_argument('--missing', type=float, default=0.02, help='Fracción de lecturas NULL')
+    parser.add_argument('--bins', type=int, default=20, help='Barras del histograma')
+    parser.add_argument('--runs', type=int, default=3, help='Repeticiones del cálculo')
+    parser.add_argument('--hours', type=int, help='Medir también load_window sobre las últimas N horas (DATABASE_URL)')
+    args = parser.parse_args()
+
+    if args.rows:
+        started = time.perf_counter()
+        arrays = synthetic_window(args.rows, args.servers, args.users, args.missing)
+        size_mb = sum(array.nbytes for array in arrays.values()) / 1e6
+        print(f"Generación:  {args.rows:,} filas en {time.perf_counter() - started:.1f} s ({size_mb:,.0f} MB en columnas)")
+
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            stats = compute_fleet_stats(arrays, args.bins)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        print(f"Cálculo:     mejor {best * 1000:,.0f} ms, peor {max(timings) * 1000:,.0f} ms "
+              f"({args.rows / best / 1e6:,.1f} M filas/s, {args.runs} repeticiones)")
+        print(f"Resultado:   {stats['servers']:,} servidores, {stats['users']:,} usuarios, "
+              f"{len(stats['by_plan'])} planes")
+
+    if args.hours:
+        end = datetime.now()
+        started = time.perf_counter()
+        window = load_window(end - timedelta(hours=args.hours), end)
+        loaded = time.perf_counter() - started
+        rows = window['server_id'].size
+        print(f"Carga:       {rows:,} filas de {args.hours} h en {loaded * 1000:,.0f} ms"
+              f"{f' ({rows / loaded / 1e6:,.2f} M filas/s)' if rows else ''}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de requests de la API
+Mide por endpoint la latencia, el CPU de Python, las conexiones tomadas del pool y los
+COMMIT enviados a la base de datos, con el cliente de pruebas de Flask (sin red ni servidor)
+
+Por defecto usa una base SQLite temporal; con --use-env-db usa DATABASE_URL
+(crea un usuario de benchmark en esa base).
+
+Uso:
+    python benchmark_requests.py                 # 200 requests por endpoint
+    python benchmark_requests.py --requests 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+PASSWORD = 'benchmark-password'
+
+# (método, ruta, cuerpo(email, server_id, i) o None)
+ENDPOINTS = (
+    ('GET', '/api/auth/verify', None),
+    ('GET', '/api/billing/status', None),
+    ('GET', '/api/sync/servers', None),
+    ('GET', '/api/alerts/servers/offline', None),
+    ('GET', '/api/alerts/rules', None),
+    ('POST', '/api/auth/login', lambda email, server_id, i: {'email': email, 'password': PASSWORD}),
+    ('POST', '/api/sync/register', lambda email, server_id, i: {'server_id': server_id}),
+    ('POST', '/api/sync/data', lambda email, server_id, i: {
+        'server_id': server_id, 'timestamp': 1767225600 + i * 60,
+        'avg_temperature': 22.5, 'avg_humidity': 85.0, 'readings_count': 60
+    })
+)
+
+class Counters:
+    """Cuenta checkouts del pool y commits de todos los motores de la app"""
+    def __init__(self):
+        self.checkouts = 0
+        self.commits = 0
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'commit', self._commit)
+
+    def _checkout(self, *args):
+        self.checkouts += 1
+
+    def _commit(self, *args):
+        self.commits += 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de requests de FungiCloud')
+    parser.add_argument('--requests', type=int, default=200, help='Requests por endpoint')
+    parser.add_argument('--use-env-db', action='store_true', help='Usar DATABASE_URL en vez de SQLite temporal')
+    args = parser.parse_args()
+
+    if not args.use_env_db:
+        os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+        os.environ.pop('DATABASE_REPLICA_URLS', None)
+    os.environ.setdefault('ALERT_MONITOR_EMBEDDED', 'false')
+    os.environ.setdefault('SYNC_DEVICE_RATE', str(args.requests * 10))
+    os.environ.setdefault('SYNC_DEVICE_BURST', str(args.requests * 10))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+    from database import init_database, get_engine, get_primary_read_engine, get_replica_engines
+    init_database()
+
+    counters = Counters()
+    for engine in {get_engine(), get_primary_read_engine(), *get_replica_engines()}:
+        counters.attach(engine)
+
+    client = app.test_client()
+    email = f"bench-{uuid.uuid4().hex[:8]}@fungicloud.local"
+    server_id = f"bench-{email}"
+    response = client.post('/api/auth/register', json={'email': email, 'password': PASSWORD})
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    client.post('/api/sync/register', json={'server_id': server_id}, headers=headers)
+
+    print(f"{'endpoint':<34} {'mediana':>9} {'p95':>9} {'CPU':>9} {'conexiones':>11} {'commits':>8}")
+    for method, path, body in ENDPOINTS:
+        timings = []
+        counters.checkouts = counters.commits = 0
+        cpu_start = time.process_time()
+        for i in range(args.requests):
+            start = time.perf_counter()
+            response = client.open(path, method=method, headers=headers,
+                                   json=body(email, server_id, i) if body else None)
+            timings.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise SystemExit(f"{method} {path}: HTTP {response.status_code}")
+        cpu = (time.process_time() - cpu_start) / args.requests
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{method + ' ' + path:<34} {statistics.median(timings) * 1000:8.2f}ms {p95 * 1000:8.2f}ms "
+              f"{cpu * 1000:7.2f}ms {counters.checkouts / args.requests:11.2f} {counters.commits / args.requests:8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la validación de payloads de sincronización
+Mide cuánto cuesta validar y convertir una muestra con los schemas compilados
+(SYNC_PAYLOAD_SCHEMA para /sync/data, BACKFILL_SAMPLE_SCHEMA para /sync/backfill)
+
+Uso:
+    python benchmark_schema.py                 # 100000 muestras por caso
+    python benchmark_schema.py --samples 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from models.sync_data import SYNC_PAYLOAD_SCHEMA, BACKFILL_SAMPLE_SCHEMA
+
+SAMPLE = {
+    'server_id': 'rasp-001',
+    'timestamp': '2026-01-15T10:30:00Z',
+    'avg_temperature': 22.5, 'min_temperature': 21.0, 'max_temperature': 24.1,
+    'avg_humidity': 85.2, 'min_humidity': 82.0, 'max_humidity': 88.4,
+    'avg_light_intensity': 310.0, 'avg_pressure': 1013.2,
+    'clients_total': 4, 'clients_online': 3, 'readings_count': 60,
+    'version': '1.4.2', 'ip_address': '192.168.1.20'
+}
+
+CASES = (
+    ('sync/data completo', SYNC_PAYLOAD_SCHEMA, SAMPLE),
+    ('sync/data epoch, sin sensores', SYNC_PAYLOAD_SCHEMA, {'server_id': 'rasp-001', 'timestamp': 1768473000}),
+    ('sync/data inválido', SYNC_PAYLOAD_SCHEMA, {**SAMPLE, 'avg_humidity': 'n/a', 'clients_total': -1}),
+    ('backfill muestra', BACKFILL_SAMPLE_SCHEMA, SAMPLE)
+)
+
+def measure(schema, payload, samples: int) -> float:
+    """µs por muestra validada"""
+    check = schema.check
+    start = time.perf_counter()
+    for _ in range(samples):
+        check(payload)
+    return (time.perf_counter() - start) / samples * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de validación de payloads de FungiCloud')
+    parser.add_argument('--samples', type=int, default=100000, help='Muestras validadas por caso')
+    args = parser.parse_args()
+
+    for name, schema, payload in CASES:
+        print(f"{name:<32} {measure(schema, payload, args.samples):6.2f} µs/muestra")
+
+if __name__ == '__main__':
+    main()
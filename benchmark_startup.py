@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark del arranque de un worker
+Mide en procesos nuevos cuánto tarda importar la app (lo que paga cada worker sin
+preload) y, con --importtime, los módulos más lentos de importar
+
+Uso:
+    python benchmark_startup.py                 # 10 arranques
+    python benchmark_startup.py --runs 20 --importtime
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TARGET = 'import app'
+
+def measure(code: str, runs: int) -> list:
+    """Segundos por arranque de un intérprete nuevo que ejecuta code"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def slowest_imports(limit: int = 15) -> list:
+    """(µs acumulados, módulo) de los imports más lentos según -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TARGET],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de arranque de FungiCloud')
+    parser.add_argument('--runs', type=int, default=10, help='Número de arranques a medir')
+    parser.add_argument('--importtime', action='store_true', help='Mostrar los imports más lentos')
+    args = parser.parse_args()
+
+    # Baseline: el intérprete vacío, para separar el costo propio de la app
+    baseline = statistics.median(measure('pass', args.runs))
+    timings = measure(TARGET, args.runs)
+    median = statistics.median(timings)
+    print(f"Intérprete vacío:  {baseline * 1000:.0f} ms")
+    print(f"Import de la app:  mediana {median * 1000:.0f} ms, "
+          f"mín {min(timings) * 1000:.0f} ms, máx {max(timings) * 1000:.0f} ms ({args.runs} arranques)")
+    print(f"Costo de la app:   {(median - baseline) * 1000:.0f} ms")
+
+    if args.importtime:
+        print("\nImports más lentos (acumulado):")
+        for micros, module in slowest_imports():
+            print(f"  {micros / 1000:8.1f} ms  {module}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración de gunicorn para FungiCloud
+
+    gunicorn -c gunicorn.conf.py
+
+Con preload_app el master importa la app una sola vez y los workers la heredan
+por fork (arrancan en milisegundos). Las dependencias pesadas que la app importa
+en su primer uso (stripe, numpy, bcrypt) también se cargan en el master, para que
+los workers las hereden ya importadas. La base de datos se inicializa una vez en
+el master; cada worker descarta el pool heredado (database.dispose_engines vía
+os.register_at_fork) y arranca sus propios hilos en post_worker_init. atexit no
+es fiable al salir un worker: worker_exit vacía la cola de logs.
+"""
+import os
+
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def on_starting(server):
+    """Master: precarga dependencias y crea tablas e índices antes de lanzar los workers"""
+    if preload_app:
+        # La app ya está importada (preload): importar aquí lo diferido evita hacerlo en cada worker
+        from utils.lazy_import import preload_modules
+        preload_modules('bcrypt')
+    if os.getenv('DATABASE_INIT_ON_START', 'true').lower() == 'true':
+        from database import init_database, dispose_engines
+        init_database()
+        # Sin conexiones abiertas en el master: nada que compartir con los hijos
+        dispose_engines()
+
+def post_worker_init(worker):
+    """Worker: hilos en segundo plano (no sobreviven al fork, se crean aquí)"""
+    from app import start_background_services
+    start_background_services()
+
+def worker_exit(server, worker):
+    """Worker: escribe los logs que quedan en cola antes de salir"""
+    from utils.logging_config import stop_logging
+    stop_logging()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Modelo de Regla de Alerta para FungiCloud
+Umbral sobre una métrica de sensores, para un servidor o para todos los del usuario
+(ej: "avg_humidity < 80 durante 30 minutos en Granja Norte")
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Float
+from sqlalchemy.sql import func
+from database import Base
+
+# Operadores de comparación permitidos
+RULE_OPERATORS = ('<', '<=', '>', '>=')
+
+class AlertRule(Base):
+    __tablename__ = 'alert_rules'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    server_id = Column(Integer, ForeignKey('local_servers.id'), index=True)  # NULL = todos los servidores del usuario
+    
+    # Condición
+    name = Column(String(255))
+    metric = Column(String(50), nullable=False)  # columna de SENSOR_METRICS
+    operator = Column(String(2), nullable=False)  # <, <=, >, >=
+    threshold = Column(Float, nullable=False)
+    duration_minutes = Column(Integer, default=0, nullable=False)  # tiempo sostenido antes de alertar
+    enabled = Column(Boolean, default=True, nullable=False)
+    
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'server_id': self.server_id,
+            'name': self.name,
+            'metric': self.metric,
+            'operator': self.operator,
+            'threshold': self.threshold,
+            'duration_minutes': self.duration_minutes,
+            'enabled': self.enabled,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class AlertRuleWindow(Base):
+    __tablename__ = 'alert_rule_windows'
+    
+    # Incumplimiento en curso de una regla en un servidor; lo guarda el líder del monitor de alertas
+    # para que el siguiente continúe el episodio (sin claves foráneas: puede llegar tras borrar la regla)
+    rule_id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, primary_key=True)
+    started_at = Column(Float, nullable=False)  # timestamp (epoch) de la primera muestra que cumplió la condición
+    alerted = Column(Boolean, default=False, nullable=False)  # una alerta por episodio
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Modelo de Segmento Archivado para FungiCloud
+Catálogo de los segmentos comprimidos (almacenamiento frío) con muestras antiguas de sync_data
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class ArchivedSegment(Base):
+    __tablename__ = 'archived_segments'
+    
+    # Tabla de un shard de series de tiempo (sin claves foráneas a la base central)
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    
+    # Rango de tiempo cubierto (primera y última muestra)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    
+    # Ubicación en el almacenamiento de segmentos
+    storage_key = Column(String(500), nullable=False, unique=True)
+    size_bytes = Column(Integer, nullable=False)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index('ix_archived_segments_server_start', 'server_id', 'start_time'),
+    )
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'id': self.id,
+            'server_id': self.server_id,
+            'user_id': self.user_id,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'sample_count': self.sample_count,
+            'storage_key': self.storage_key,
+            'size_bytes': self.size_bytes,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
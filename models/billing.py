@@ -2,7 +2,7 @@
 """
 Modelo de Billing para FungiCloud
 """
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Text, JSON, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -19,6 +19,7 @@ class UserBilling(Base):
     # Stripe
     stripe_customer_id = Column(String(255), unique=True, index=True)
     stripe_subscription_id = Column(String(255), unique=True, index=True)
+    customer_request_key = Column(String(64))  # "epoch-nonce" del alta de cliente en curso (idempotency key)
     
     # Período
     current_period_start = Column(DateTime(timezone=True))
@@ -47,11 +48,16 @@ class BillingEvent(Base):
     __tablename__ = 'billing_events'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     event_type = Column(String(100), nullable=False)  # subscription_created, plan_changed, payment_succeeded, etc.
     event_metadata = Column(JSON)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        # Eventos de un usuario por created_at desc
+        Index('ix_billing_events_user_created', 'user_id', 'created_at'),
+    )
+    
     def to_dict(self):
         """Convierte a diccionario"""
         return {
@@ -61,3 +67,61 @@ class BillingEvent(Base):
             'metadata': self.event_metadata,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class UserUsage(Base):
+    __tablename__ = 'user_usage'
+    
+    # Resumen de uso por usuario, mantenido de forma transaccional (evita COUNT(*) por request)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    servers_registered = Column(Integer, default=0, nullable=False)
+    servers_online = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'user_id': self.user_id,
+            'servers_registered': self.servers_registered,
+            'servers_online': self.servers_online,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class StripeWebhookEvent(Base):
+    __tablename__ = 'stripe_webhook_events'
+    
+    id = Column(Integer, primary_key=True)
+    stripe_event_id = Column(String(255), nullable=False, unique=True)  # Idempotencia: un registro por evento de Stripe
+    event_type = Column(String(100), nullable=False)
+    stripe_customer_id = Column(String(255))
+    payload = Column(JSON, nullable=False)  # Evento crudo tal como lo envió Stripe
+    
+    # Procesamiento
+    status = Column(String(50), default='pending', nullable=False, index=True)  # pending, processing, processed, ignored, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    claimed_at = Column(DateTime(timezone=True))  # Inicio del intento en curso (status = processing)
+    next_attempt_at = Column(DateTime(timezone=True))  # Reintento diferido tras un fallo
+    
+    # Timestamps
+    stripe_created_at = Column(DateTime(timezone=True))  # Campo "created" del evento (orden por cliente)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index('ix_stripe_webhook_events_customer_created', 'stripe_customer_id', 'stripe_created_at'),
+    )
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'id': self.id,
+            'stripe_event_id': self.stripe_event_id,
+            'event_type': self.event_type,
+            'stripe_customer_id': self.stripe_customer_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'stripe_created_at': self.stripe_created_at.isoformat() if self.stripe_created_at else None,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
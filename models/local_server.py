@@ -20,7 +20,7 @@ class LocalServer(Base):
     
     # Estado
     status = Column(String(50), default='offline', nullable=False)  # online, offline, error
-    last_seen = Column(DateTime(timezone=True))  # Última sincronización
+    last_seen = Column(DateTime(timezone=True), index=True)  # Última sincronización
     last_sync_at = Column(DateTime(timezone=True))  # Última sync exitosa
     
     # Información del servidor
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Modelo de Lease para coordinar procesos en segundo plano
+Una fila por rol (ej: monitor de alertas de un shard); solo el holder vigente trabaja
+"""
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.sql import func
+from database import Base
+
+class MonitorLease(Base):
+    __tablename__ = 'monitor_leases'
+    
+    name = Column(String(100), primary_key=True)  # Rol coordinado (ej: "alert-monitor-0-of-1")
+    holder = Column(String(255), nullable=False)  # host:pid:token del proceso líder
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    
+    # Timestamps
+    acquired_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'acquired_at': self.acquired_at.isoformat() if self.acquired_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Consultas frecuentes precompiladas para FungiCloud
+Cada sentencia se construye una sola vez, con parámetros enlazados (bindparam): SQLAlchemy
+memoiza su clave de caché y reutiliza el SQL compilado en cada request, en lugar de
+reconstruir y recompilar un session.query(...).filter_by(...) por llamada.
+"""
+from sqlalchemy import select, update, bindparam, func
+from models.user import User
+from models.billing import UserBilling, UserUsage
+from models.local_server import LocalServer
+
+# Servidores locales
+SERVER_BY_DEVICE = select(LocalServer).where(LocalServer.server_id == bindparam('server_id')).limit(1)
+OWNED_SERVER_BY_DEVICE = select(LocalServer).where(
+    LocalServer.server_id == bindparam('server_id'),
+    LocalServer.user_id == bindparam('user_id')
+).limit(1)
+OWNED_SERVER_PK_BY_DEVICE = select(LocalServer.id).where(
+    LocalServer.server_id == bindparam('server_id'),
+    LocalServer.user_id == bindparam('user_id')
+).limit(1)
+OWNED_SERVER = select(LocalServer).where(
+    LocalServer.id == bindparam('server_pk'),
+    LocalServer.user_id == bindparam('user_id')
+).limit(1)
+OWNED_SERVER_PK = select(LocalServer.id).where(
+    LocalServer.id == bindparam('server_pk'),
+    LocalServer.user_id == bindparam('user_id')
+).limit(1)
+# Marca de frescura del buffer de muestras recientes (fila, no escalar: last_sync_at puede ser NULL)
+OWNED_SERVER_LAST_SYNC = select(LocalServer.id, LocalServer.last_sync_at).where(
+    LocalServer.id == bindparam('server_pk'),
+    LocalServer.user_id == bindparam('user_id')
+).limit(1)
+# Candidatos a offline del monitor de alertas (deadline vencido y todavía no marcados)
+OFFLINE_CANDIDATES = select(LocalServer).where(
+    LocalServer.id.in_(bindparam('server_pks', expanding=True)),
+    LocalServer.status != 'offline'
+)
+# Destinatarios de alertas de sensores y reglas: (id, nombre, alert_email, email del dueño)
+ALERT_RECIPIENTS = select(LocalServer.id, LocalServer.name, LocalServer.alert_email, User.email).join(
+    User, User.id == LocalServer.user_id
+).where(
+    LocalServer.id.in_(bindparam('server_pks', expanding=True)),
+    LocalServer.alerts_enabled.is_(True),
+    User.is_active.is_(True)
+)
+
+# Usuarios y billing
+USER_BY_EMAIL = select(User).where(User.email == bindparam('email')).limit(1)
+BILLING_BY_USER = select(UserBilling).where(UserBilling.user_id == bindparam('user_id')).limit(1)
+
+# Versión de las reglas de alerta de cada usuario (el monitor recompila las que cambiaron)
+RULES_VERSIONS = select(User.id, User.alert_rules_version).where(User.id.in_(bindparam('user_ids', expanding=True)))
+BUMP_RULES_VERSION = update(User).where(User.id == bindparam('rules_user_id')).values(
+    alert_rules_version=func.coalesce(User.alert_rules_version, 0) + 1
+).execution_options(synchronize_session=False)
+
+# Deltas de los contadores de uso (los nombres no pueden coincidir con columnas del SET)
+ADJUST_USAGE = update(UserUsage).where(UserUsage.user_id == bindparam('usage_user_id')).values(
+    servers_registered=UserUsage.servers_registered + bindparam('registered_delta'),
+    servers_online=UserUsage.servers_online + bindparam('online_delta')
+).execution_options(synchronize_session=False)
+
+def first(session, statement, **params):
+    """Primera entidad (o valor) de una sentencia precompilada, o None"""
+    return session.execute(statement, params).scalars().first()
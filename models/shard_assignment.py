@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Modelo de Asignación de Shard para FungiCloud
+Directorio (en la base central) del shard que guarda las series de tiempo de cada usuario
+"""
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from database import Base
+
+class ShardAssignment(Base):
+    __tablename__ = 'shard_assignments'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    shard = Column(Integer, nullable=False, index=True)  # índice en SYNC_SHARD_URLS
+    
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'user_id': self.user_id,
+            'shard': self.shard,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
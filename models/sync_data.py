@@ -3,19 +3,63 @@
 Modelo de Datos de Sincronización
 Almacena datos agregados que los servidores locales envían al cloud
 """
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Float, Text
+import uuid
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Float, Text, Index
 from sqlalchemy.sql import func
 from database import Base
+from utils import schema
+
+# Columnas de sensores (agregados de 15 min) que envían los servidores locales
+SENSOR_METRICS = (
+    'avg_temperature', 'min_temperature', 'max_temperature',
+    'avg_humidity', 'min_humidity', 'max_humidity',
+    'avg_light_intensity', 'avg_pressure'
+)
+# Todas las columnas de valores de una muestra (sensores y contadores)
+SAMPLE_COLUMNS = SENSOR_METRICS + ('clients_total', 'clients_online', 'readings_count')
+
+# Validación de una muestra enviada por un dispositivo: lo ausente queda NULL (nunca 0)
+SAMPLE_SCHEMA = schema.Schema({
+    'timestamp': schema.Timestamp(),
+    'avg_temperature': schema.Float(-60, 100),
+    'min_temperature': schema.Float(-60, 100),
+    'max_temperature': schema.Float(-60, 100),
+    'avg_humidity': schema.Float(0, 100),
+    'min_humidity': schema.Float(0, 100),
+    'max_humidity': schema.Float(0, 100),
+    'avg_light_intensity': schema.Float(min=0),
+    'avg_pressure': schema.Float(min=0),
+    'clients_total': schema.Integer(min=0),
+    'clients_online': schema.Integer(min=0),
+    'readings_count': schema.Integer(min=0)
+})
+# POST /sync/data: la muestra más el estado del servidor
+SYNC_PAYLOAD_SCHEMA = SAMPLE_SCHEMA.extend({
+    'server_id': schema.String(required=True),
+    'version': schema.String(50),
+    'ip_address': schema.String(45)
+})
+# Cada muestra de /sync/backfill (el timestamp es obligatorio)
+BACKFILL_SAMPLE_SCHEMA = SAMPLE_SCHEMA.extend({'timestamp': schema.Timestamp(required=True)})
+
+# Columnas de la clave natural de sync_data y sync_events (ON CONFLICT)
+SYNC_DATA_KEY = ('server_id', 'data_timestamp')
+SYNC_EVENT_KEY = ('server_id', 'event_key')
+
+def new_event_key() -> str:
+    return uuid.uuid4().hex
 
 class SyncData(Base):
     __tablename__ = 'sync_data'
     
+    # Tabla de un shard de series de tiempo: server_id/user_id apuntan a la base
+    # central, sin clave foránea (pueden estar en otra base de datos)
     id = Column(Integer, primary_key=True)
-    server_id = Column(Integer, ForeignKey('local_servers.id'), nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    server_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     
     # Timestamp de los datos
-    data_timestamp = Column(DateTime(timezone=True), nullable=False, index=True)
+    data_timestamp = Column(DateTime(timezone=True), nullable=False)
     
     # Datos de sensores (agregados de últimos 15 min)
     avg_temperature = Column(Float)
@@ -35,7 +79,15 @@ class SyncData(Base):
     readings_count = Column(Integer, default=0)  # Lecturas de sensores en ventana
     
     # Timestamp de recepción
-    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    received_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    
+    __table_args__ = (
+        # Clave natural de una muestra (los reintentos no la duplican) y acceso
+        # "servidor X entre t1 y t2" / últimas N muestras de un servidor
+        Index('uq_sync_data_server_timestamp', 'server_id', 'data_timestamp', unique=True),
+        # Rangos de tiempo de toda la flota: BRIN es diminuto en una tabla solo de inserciones
+        Index('ix_sync_data_timestamp_brin', 'data_timestamp', postgresql_using='brin'),
+    )
     
     def to_dict(self):
         """Convierte a diccionario"""
@@ -62,11 +114,18 @@ class SyncEvent(Base):
     __tablename__ = 'sync_events'
     
     id = Column(Integer, primary_key=True)
-    server_id = Column(Integer, ForeignKey('local_servers.id'), nullable=False, index=True)
+    server_id = Column(Integer, nullable=False)  # sin clave foránea (tabla de shard)
     event_type = Column(String(100), nullable=False)  # sync_success, sync_failed, server_online, server_offline
     message = Column(Text)
     event_metadata = Column(JSON)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # Identidad del evento: se copia con la fila al mover de shard (la copia repetida no lo duplica)
+    event_key = Column(String(32), nullable=False, default=new_event_key)
+    
+    __table_args__ = (
+        Index('ix_sync_events_server_created', 'server_id', 'created_at'),
+        Index('uq_sync_events_server_key', 'server_id', 'event_key', unique=True),
+    )
     
     def to_dict(self):
         """Convierte a diccionario"""
@@ -78,3 +137,27 @@ class SyncEvent(Base):
             'metadata': self.event_metadata,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class MetricBaseline(Base):
+    __tablename__ = 'metric_baselines'
+    
+    # Checkpoint del detector de anomalías (EWMA por servidor y métrica)
+    server_id = Column(Integer, ForeignKey('local_servers.id'), primary_key=True)
+    metric = Column(String(50), primary_key=True)
+    mean = Column(Float, nullable=False)
+    variance = Column(Float, nullable=False)
+    samples = Column(Integer, default=0, nullable=False)
+    last_alert_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'server_id': self.server_id,
+            'metric': self.metric,
+            'mean': self.mean,
+            'variance': self.variance,
+            'samples': self.samples,
+            'last_alert_at': self.last_alert_at.isoformat() if self.last_alert_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -5,7 +5,6 @@ Modelo de Usuario para FungiCloud
 from sqlalchemy import Column, Integer, String, DateTime, Boolean
 from sqlalchemy.sql import func
 from database import Base
-import bcrypt
 
 class User(Base):
     __tablename__ = 'users'
@@ -15,15 +14,18 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
+    alert_rules_version = Column(Integer, default=0, nullable=False)  # sube con cada cambio de sus reglas de alerta
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     def set_password(self, password: str):
         """Hashea y establece la contraseña"""
+        import bcrypt
         self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
     def check_password(self, password: str) -> bool:
         """Verifica la contraseña"""
+        import bcrypt
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
     
     def to_dict(self):
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rebalanceo de los shards de series de tiempo (SYNC_SHARD_URLS)
+
+Uso:
+    python rebalance_shards.py --status                 # usuarios y muestras por shard
+    python rebalance_shards.py --user 42 --to 2         # mover un usuario al shard 2
+    python rebalance_shards.py --import-central         # mover a los shards los datos previos a SYNC_SHARD_URLS
+"""
+import argparse
+import logging
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_database, SHARD_URLS
+from utils.logging_config import configure_logging
+from services.rebalance_service import (
+    move_tenant, import_central, central_tenants, shard_stats, heaviest_tenants
+)
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebalanceo de shards de FungiCloud')
+    parser.add_argument('--status', action='store_true', help='Mostrar usuarios y muestras por shard')
+    parser.add_argument('--user', type=int, help='Usuario a mover')
+    parser.add_argument('--to', type=int, help='Shard de destino')
+    parser.add_argument('--grace', type=float, default=None,
+                        help='Segundos de espera tras reasignar (por defecto el TTL de la caché de asignaciones; no menos)')
+    parser.add_argument('--import-central', action='store_true',
+                        help='Mover a su shard los datos que siguen en la base central')
+    args = parser.parse_args()
+    
+    configure_logging()
+    
+    if not SHARD_URLS:
+        logger.error("SYNC_SHARD_URLS no configurado: todas las series de tiempo están en la base central")
+        sys.exit(1)
+    init_database()
+    
+    if args.import_central:
+        for user_id in central_tenants():
+            import_central(user_id)
+    
+    if args.user is not None:
+        if args.to is None:
+            parser.error('--user requiere --to')
+        result = move_tenant(args.user, args.to, args.grace)
+        logger.info(f"Usuario {result['user_id']}: shard {result['source']} -> {result['target']} {result['moved']}")
+    
+    if args.status or (args.user is None and not args.import_central):
+        for stats in shard_stats():
+            heaviest = ', '.join(f"{user_id} ({samples})" for user_id, samples in heaviest_tenants(stats['shard'], 5))
+            print(f"Shard {stats['shard']}: {stats['users']} usuarios, {stats['samples']} muestras"
+                  f"{f' - mayores: {heaviest}' if heaviest else ''}")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Error en rebalanceo de shards: {e}")
+        sys.exit(1)
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, request, jsonify
 from routes.auth_routes import verify_token
-from database import get_db_session
+from database import fan_out, mark_write
 from models.user import User
 from models.billing import UserBilling
 from models.local_server import LocalServer
 from models.sync_data import SyncData
-from sqlalchemy import func, desc
+from services.analytics_service import get_fleet_stats, NUMPY_AVAILABLE, ANALYTICS_MAX_DAYS
+from utils.pagination import paginate, page_args, CursorError
+from utils.request_session import request_session
+from utils.json_stream import wants_stream, iter_rows, stream_json_array
+from sqlalchemy import func, desc, select, case, and_
 from datetime import datetime, timedelta
 import logging
 
@@ -23,12 +27,27 @@ def require_admin():
         return None, (jsonify({"success": False, "error": "Acceso denegado"}), 403)
     return payload, None
 
+def _recent_syncs(session) -> list:
+    """(received_at, dict) de las últimas sincronizaciones de un shard"""
+    rows = session.query(SyncData).order_by(desc(SyncData.received_at)).limit(10).all()
+    return [(row.received_at, row.to_dict()) for row in rows]
+
+def _user_summary(row) -> dict:
+    """Usuario con su billing y conteo de servidores (fila de /admin/users)"""
+    user, billing, servers_count, servers_online = row
+    return {
+        **user.to_dict(),
+        'billing': billing.to_dict() if billing else None,
+        'servers_count': servers_count or 0,
+        'servers_online': int(servers_online or 0)
+    }
+
 @admin_bp.route('/admin/dashboard', methods=['GET'])
 def get_dashboard():
     user_data, error = require_admin()
     if error: return error
     
-    with get_db_session() as session:
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
         total_users = session.query(User).filter_by(is_active=True).count()
         users_by_plan = session.query(
             UserBilling.plan_type,
@@ -51,8 +70,12 @@ def get_dashboard():
             plan_prices = {'free': 0, 'starter': 5.00, 'advance': 17.50, 'expert': 29.50}
             mrr += count * plan_prices.get(plan, 0)
         
-        # Últimas sincronizaciones
-        recent_syncs = session.query(SyncData).order_by(desc(SyncData.received_at)).limit(10).all()
+        # Últimas sincronizaciones (las 10 más recientes de cada shard, combinadas)
+        recent_syncs = sorted(
+            (sync for shard_syncs in fan_out(_recent_syncs) for sync in shard_syncs),
+            key=lambda sync: sync[0],
+            reverse=True
+        )[:10]
         
         # Servidores con problemas (offline > 30 min)
         threshold = datetime.now() - timedelta(minutes=30)
@@ -83,7 +106,7 @@ def get_dashboard():
                 'mrr': round(mrr, 2),
                 'currency': 'USD'
             },
-            'recent_syncs': [sync.to_dict() for sync in recent_syncs],
+            'recent_syncs': [sync for _, sync in recent_syncs],
             'offline_servers': [server.to_dict() for server in offline_servers]
         }
         
@@ -95,22 +118,52 @@ def list_all_users():
     user_data, error = require_admin()
     if error: return error
     
-    with get_db_session() as session:
-        users = session.query(User).all()
-        users_data = []
-        
-        for user in users:
-            billing = session.query(UserBilling).filter_by(user_id=user.id).first()
-            servers = session.query(LocalServer).filter_by(user_id=user.id).all()
-            
-            users_data.append({
-                **user.to_dict(),
-                'billing': billing.to_dict() if billing else None,
-                'servers_count': len(servers),
-                'servers_online': sum(1 for s in servers if s.is_online())
-            })
-        
-        return jsonify({"success": True, "users": users_data, "count": len(users_data)})
+    # Conteos de servidores agregados en una subconsulta (sin N+1 por usuario)
+    online_since = datetime.now() - timedelta(minutes=10)
+    server_counts = select(
+        LocalServer.user_id,
+        func.count(LocalServer.id).label('servers_count'),
+        func.sum(case(
+            (and_(LocalServer.status == 'online', LocalServer.last_seen >= online_since), 1),
+            else_=0
+        )).label('servers_online')
+    ).group_by(LocalServer.user_id).subquery()
+    
+    try:
+        after, limit = page_args(request.args, 1)
+    except CursorError:
+        return jsonify({"success": False, "error": "Cursor inválido"}), 400
+    
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        query = session.query(
+            User,
+            UserBilling,
+            server_counts.c.servers_count,
+            server_counts.c.servers_online
+        ).outerjoin(
+            UserBilling, UserBilling.user_id == User.id
+        ).outerjoin(
+            server_counts, server_counts.c.user_id == User.id
+        )
+        if wants_stream(request.args):
+            return stream_json_array('users', iter_rows(query, [User.id], after), _user_summary)
+        
+        rows, next_cursor = paginate(
+            query,
+            [User.id],
+            after,
+            limit,
+            key_of=lambda row: [row[0].id]
+        )
+        
+        users_data = [_user_summary(row) for row in rows]
+        
+        return jsonify({
+            "success": True,
+            "users": users_data,
+            "count": len(users_data),
+            "next_cursor": next_cursor
+        })
 
 @admin_bp.route('/admin/users/<int:user_id>', methods=['GET'])
 def get_user_details(user_id):
@@ -118,7 +171,7 @@ def get_user_details(user_id):
     admin_data, error = require_admin()
     if error: return error
     
-    with get_db_session() as session:
+    with request_session(readonly=True, consistency_key=admin_data['user_id']) as session:
         user = session.query(User).filter_by(id=user_id).first()
         if not user:
             return jsonify({"success": False, "error": "Usuario no encontrado"}), 404
@@ -139,13 +192,13 @@ def suspend_user(user_id):
     admin_data, error = require_admin()
     if error: return error
     
-    with get_db_session() as session:
+    with request_session(consistency_key=admin_data['user_id']) as session:
         user = session.query(User).filter_by(id=user_id).first()
         if not user:
             return jsonify({"success": False, "error": "Usuario no encontrado"}), 404
         
         user.is_active = False
-        session.commit()
+        mark_write(user_id)  # las lecturas del propio usuario ven la suspensión
         
         logger.warning(f"Usuario {user.email} suspendido por admin {admin_data['email']}")
         return jsonify({"success": True, "message": "Usuario suspendido"})
@@ -156,10 +209,63 @@ def list_all_servers():
     admin_data, error = require_admin()
     if error: return error
     
-    with get_db_session() as session:
-        servers = session.query(LocalServer).all()
+    try:
+        after, limit = page_args(request.args, 1)
+    except CursorError:
+        return jsonify({"success": False, "error": "Cursor inválido"}), 400
+    
+    with request_session(readonly=True, consistency_key=admin_data['user_id']) as session:
+        if wants_stream(request.args):
+            # Listado completo (desde el cursor) sin cargarlo en memoria
+            rows = iter_rows(session.query(LocalServer), [LocalServer.id], after)
+            return stream_json_array('servers', rows, LocalServer.to_dict)
+        
+        servers, next_cursor = paginate(
+            session.query(LocalServer),
+            [LocalServer.id],
+            after,
+            limit
+        )
         return jsonify({
             "success": True,
             "servers": [server.to_dict() for server in servers],
-            "count": len(servers)
+            "count": len(servers),
+            "next_cursor": next_cursor
         })
+
+@admin_bp.route('/admin/analytics/fleet', methods=['GET'])
+def get_fleet_analytics():
+    """Estadísticas de temperatura/humedad de toda la flota (percentiles, histogramas, por plan)"""
+    admin_data, error = require_admin()
+    if error: return error
+    
+    if not NUMPY_AVAILABLE:
+        return jsonify({"success": False, "error": "Analítica no disponible (NumPy no instalado)"}), 503
+    
+    try:
+        if request.args.get('start'):
+            start = datetime.fromisoformat(request.args['start'])
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.now()
+        else:
+            # Fin alineado al próximo bloque de 15 min para que requests consecutivos compartan caché
+            hours = request.args.get('hours', 24, type=int)
+            now = datetime.now()
+            end = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0) + timedelta(minutes=15)
+            start = end - timedelta(hours=hours)
+    except ValueError:
+        return jsonify({"success": False, "error": "Fechas inválidas (usar ISO 8601)"}), 400
+    
+    # Comparar siempre en hora local sin zona (como data_timestamp)
+    if start.tzinfo:
+        start = start.astimezone().replace(tzinfo=None)
+    if end.tzinfo:
+        end = end.astimezone().replace(tzinfo=None)
+    
+    bins = min(max(request.args.get('bins', 20, type=int), 1), 200)
+    if start >= end:
+        return jsonify({"success": False, "error": "start debe ser anterior a end"}), 400
+    if end - start > timedelta(days=ANALYTICS_MAX_DAYS):
+        return jsonify({"success": False, "error": f"Ventana máxima de {ANALYTICS_MAX_DAYS} días"}), 400
+    
+    stats = get_fleet_stats(start, end, bins)
+    return jsonify({"success": True, "analytics": stats})
@@ -4,14 +4,23 @@ Rutas de Alertas para FungiCloud
 """
 from flask import Blueprint, request, jsonify
 from routes.auth_routes import verify_token
-from database import get_db_session
+from utils.request_session import request_session
 from models.local_server import LocalServer
+from models import queries
+from models.queries import first
+from models.alert_rule import AlertRule, AlertRuleWindow, RULE_OPERATORS
+from models.sync_data import SENSOR_METRICS
+from utils.pagination import paginate, page_args, CursorError
 from datetime import datetime, timedelta
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 alert_bp = Blueprint('alert', __name__)
 
+ALERT_RULES_MAX_PER_USER = int(os.getenv('ALERT_RULES_MAX_PER_USER', 50))
+RULE_MAX_DURATION_MINUTES = 7 * 24 * 60
+
 def require_auth():
     auth_header = request.headers.get('Authorization', '')
     if not auth_header.startswith('Bearer '):
@@ -31,17 +40,29 @@ def get_offline_servers():
     threshold_minutes = int(request.args.get('threshold', 30))
     threshold = datetime.now() - timedelta(minutes=threshold_minutes)
     
-    with get_db_session() as session:
-        offline_servers = session.query(LocalServer).filter(
+    try:
+        after, limit = page_args(request.args, 2)
+    except CursorError:
+        return jsonify({"success": False, "error": "Cursor inválido"}), 400
+    
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        query = session.query(LocalServer).filter(
             LocalServer.user_id == user_data['user_id'],
             LocalServer.last_seen < threshold
-        ).all()
+        )
+        offline_servers, next_cursor = paginate(
+            query,
+            [LocalServer.last_seen, LocalServer.id],
+            after,
+            limit
+        )
         
         return jsonify({
             "success": True,
             "offline_servers": [server.to_dict() for server in offline_servers],
             "count": len(offline_servers),
-            "threshold_minutes": threshold_minutes
+            "threshold_minutes": threshold_minutes,
+            "next_cursor": next_cursor
         })
 
 @alert_bp.route('/alerts/servers/<int:server_id>/settings', methods=['PUT'])
@@ -52,11 +73,8 @@ def update_alert_settings(server_id):
     
     data = request.get_json()
     
-    with get_db_session() as session:
-        server = session.query(LocalServer).filter_by(
-            id=server_id,
-            user_id=user_data['user_id']
-        ).first()
+    with request_session(consistency_key=user_data['user_id']) as session:
+        server = first(session, queries.OWNED_SERVER, server_pk=server_id, user_id=user_data['user_id'])
         
         if not server:
             return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
@@ -66,5 +84,128 @@ def update_alert_settings(server_id):
         if 'alert_email' in data:
             server.alert_email = data['alert_email']
         
-        session.commit()
+        session.flush()
         return jsonify({"success": True, "server": server.to_dict()})
+
+def _rule_fields(data: dict, partial: bool = False):
+    """Valida los campos de una regla; devuelve (campos, mensaje de error)"""
+    fields = {}
+    if not partial or 'metric' in data:
+        if data.get('metric') not in SENSOR_METRICS:
+            return None, f"metric debe ser una de: {', '.join(SENSOR_METRICS)}"
+        fields['metric'] = data['metric']
+    if not partial or 'operator' in data:
+        if data.get('operator') not in RULE_OPERATORS:
+            return None, f"operator debe ser uno de: {' '.join(RULE_OPERATORS)}"
+        fields['operator'] = data['operator']
+    if not partial or 'threshold' in data:
+        threshold = data.get('threshold')
+        if not isinstance(threshold, (int, float)) or isinstance(threshold, bool):
+            return None, "threshold numérico requerido"
+        fields['threshold'] = float(threshold)
+    if 'duration_minutes' in data:
+        duration = data['duration_minutes']
+        if not isinstance(duration, int) or isinstance(duration, bool) or not 0 <= duration <= RULE_MAX_DURATION_MINUTES:
+            return None, f"duration_minutes debe estar entre 0 y {RULE_MAX_DURATION_MINUTES}"
+        fields['duration_minutes'] = duration
+    if 'name' in data:
+        if data['name'] is not None and (not isinstance(data['name'], str) or len(data['name']) > 255):
+            return None, "name inválido"
+        fields['name'] = data['name']
+    if 'enabled' in data:
+        fields['enabled'] = bool(data['enabled'])
+    if 'server_id' in data:
+        if data['server_id'] is not None and (not isinstance(data['server_id'], int) or isinstance(data['server_id'], bool)):
+            return None, "server_id inválido"
+        fields['server_id'] = data['server_id']
+    return fields, None
+
+def _bump_rules_version(session, user_id: int):
+    """El monitor de alertas recompila las reglas del usuario en su próxima lectura de muestras"""
+    session.execute(queries.BUMP_RULES_VERSION, {'rules_user_id': user_id})
+
+def _owns_server(session, server_pk: int, user_id: int) -> bool:
+    return first(session, queries.OWNED_SERVER_PK, server_pk=server_pk, user_id=user_id) is not None
+
+@alert_bp.route('/alerts/rules', methods=['GET'])
+def list_alert_rules():
+    """Lista las reglas de alerta del usuario (opcionalmente de un servidor)"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        query = session.query(AlertRule).filter_by(user_id=user_data['user_id'])
+        server_id = request.args.get('server_id', type=int)
+        if server_id is not None:
+            query = query.filter(AlertRule.server_id == server_id)
+        rules = query.order_by(AlertRule.id).all()
+        return jsonify({
+            "success": True,
+            "rules": [rule.to_dict() for rule in rules],
+            "count": len(rules)
+        })
+
+@alert_bp.route('/alerts/rules', methods=['POST'])
+def create_alert_rule():
+    """Crea una regla de umbral (server_id nulo = todos los servidores del usuario)"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    data = request.get_json(silent=True) or {}
+    fields, message = _rule_fields(data)
+    if message:
+        return jsonify({"success": False, "error": message}), 400
+    
+    with request_session(consistency_key=user_data['user_id']) as session:
+        if fields.get('server_id') is not None and not _owns_server(session, fields['server_id'], user_data['user_id']):
+            return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
+        if session.query(AlertRule).filter_by(user_id=user_data['user_id']).count() >= ALERT_RULES_MAX_PER_USER:
+            return jsonify({"success": False, "error": f"Máximo {ALERT_RULES_MAX_PER_USER} reglas por usuario"}), 400
+        
+        rule = AlertRule(user_id=user_data['user_id'], **fields)
+        session.add(rule)
+        _bump_rules_version(session, user_data['user_id'])
+        session.commit()
+        return jsonify({"success": True, "rule": rule.to_dict()}), 201
+
+@alert_bp.route('/alerts/rules/<int:rule_id>', methods=['PUT'])
+def update_alert_rule(rule_id):
+    """Actualiza una regla de alerta"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    data = request.get_json(silent=True) or {}
+    fields, message = _rule_fields(data, partial=True)
+    if message:
+        return jsonify({"success": False, "error": message}), 400
+    
+    with request_session(consistency_key=user_data['user_id']) as session:
+        rule = session.query(AlertRule).filter_by(id=rule_id, user_id=user_data['user_id']).first()
+        if not rule:
+            return jsonify({"success": False, "error": "Regla no encontrada"}), 404
+        if fields.get('server_id') is not None and not _owns_server(session, fields['server_id'], user_data['user_id']):
+            return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
+        
+        for key, value in fields.items():
+            setattr(rule, key, value)
+        # La condición pudo cambiar: los episodios en curso empiezan de nuevo
+        session.query(AlertRuleWindow).filter_by(rule_id=rule.id).delete(synchronize_session=False)
+        _bump_rules_version(session, user_data['user_id'])
+        session.commit()
+        return jsonify({"success": True, "rule": rule.to_dict()})
+
+@alert_bp.route('/alerts/rules/<int:rule_id>', methods=['DELETE'])
+def delete_alert_rule(rule_id):
+    """Elimina una regla de alerta"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    with request_session(consistency_key=user_data['user_id']) as session:
+        rule = session.query(AlertRule).filter_by(id=rule_id, user_id=user_data['user_id']).first()
+        if not rule:
+            return jsonify({"success": False, "error": "Regla no encontrada"}), 404
+        session.query(AlertRuleWindow).filter_by(rule_id=rule.id).delete(synchronize_session=False)
+        session.delete(rule)
+        _bump_rules_version(session, user_data['user_id'])
+        session.commit()
+        return jsonify({"success": True})
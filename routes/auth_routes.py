@@ -7,9 +7,12 @@ import jwt
 import os
 import logging
 from datetime import datetime, timedelta
-from database import get_db_session
+from utils.request_session import request_session, current_user
 from models.user import User
 from models.billing import UserBilling
+from models import queries
+from models.queries import first
+from utils.http_cache import make_etag, is_not_modified, not_modified, with_etag
 
 logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
@@ -53,9 +56,9 @@ def register():
         if len(password) < 8:
             return jsonify({"success": False, "error": "La contraseña debe tener al menos 8 caracteres"}), 400
         
-        with get_db_session() as session:
+        with request_session() as session:
             # Verificar si el usuario ya existe
-            existing_user = session.query(User).filter_by(email=email).first()
+            existing_user = first(session, queries.USER_BY_EMAIL, email=email)
             if existing_user:
                 return jsonify({"success": False, "error": "El email ya está registrado"}), 400
             
@@ -72,7 +75,6 @@ def register():
                 plan_status='active'
             )
             session.add(billing)
-            session.commit()
             
             # Crear token
             token = create_token(user.id, user.email, user.is_admin)
@@ -102,8 +104,8 @@ def login():
         email = data['email'].lower().strip()
         password = data['password']
         
-        with get_db_session() as session:
-            user = session.query(User).filter_by(email=email).first()
+        with request_session() as session:
+            user = first(session, queries.USER_BY_EMAIL, email=email)
             
             if not user or not user.check_password(password):
                 return jsonify({"success": False, "error": "Credenciales inválidas"}), 401
@@ -114,7 +116,7 @@ def login():
             # Crear token
             token = create_token(user.id, user.email, user.is_admin)
             
-            logger.info(f"Login exitoso: {email}")
+            logger.info("Login exitoso: %s", email)
             
             return jsonify({
                 "success": True,
@@ -140,16 +142,18 @@ def verify():
         if not payload:
             return jsonify({"success": False, "error": "Token inválido o expirado"}), 401
         
-        with get_db_session() as session:
-            user = session.query(User).filter_by(id=payload['user_id']).first()
-            
-            if not user or not user.is_active:
-                return jsonify({"success": False, "error": "Usuario no encontrado o inactivo"}), 404
-            
-            return jsonify({
-                "success": True,
-                "user": user.to_dict()
-            })
+        user = current_user(payload['user_id'])
+        if not user or not user.is_active:
+            return jsonify({"success": False, "error": "Usuario no encontrado o inactivo"}), 404
+        
+        etag = make_etag(user.id, user.updated_at or user.created_at)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        
+        return with_etag(jsonify({
+            "success": True,
+            "user": user.to_dict()
+        }), etag)
             
     except Exception as e:
         logger.error(f"Error en verificación: {e}")
@@ -2,23 +2,44 @@
 """
 Rutas de Billing para FungiCloud
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from routes.auth_routes import verify_token
 from database import get_db_session
+from utils.request_session import request_session
 from models.user import User
-from models.billing import UserBilling, BillingEvent
-from models.local_server import LocalServer
+from models.billing import UserBilling, BillingEvent, UserUsage
+from models import queries
+from models.queries import first
 from services.stripe_service import StripeService
+from services.webhook_service import get_webhook_processor
+from services.usage_service import get_cached_status, cache_status, recompute_usage, mark_billing_changed
+from utils.pagination import paginate, page_args, CursorError
+from utils.http_cache import make_etag, is_not_modified, not_modified, with_etag, precomputed_json
 import logging
 import os
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 billing_bp = Blueprint('billing', __name__)
 
+# Stripe guarda las idempotency keys 24 h: una clave más vieja se rota antes de reusarla
+CUSTOMER_KEY_MAX_AGE = 23 * 3600  # segundos
+
 PLAN_LIMITS = {'free': 1, 'starter': 3, 'advance': 10, 'expert': -1}
 PLAN_PRICES = {'free': 0, 'starter': 5.00, 'advance': 17.50, 'expert': 29.50}
 PLAN_DISPLAY_NAMES = {'free': 'Gratis', 'starter': 'Starter', 'advance': 'Advance', 'expert': 'Expert'}
 
+# Respuesta estática de /billing/plans: se serializa una sola vez al importar
+PLANS = [
+    {'type': 'free', 'display_name': 'Gratis', 'price': 0, 'limits': {'clients': 1}, 'features': ['1 cultivo']},
+    {'type': 'starter', 'display_name': 'Starter', 'price': 5.00, 'limits': {'clients': 3}, 'features': ['3 cultivos', 'Automatización básica']},
+    {'type': 'advance', 'display_name': 'Advance', 'price': 17.50, 'limits': {'clients': 10}, 'features': ['10 cultivos', 'Automatización avanzada']},
+    {'type': 'expert', 'display_name': 'Expert', 'price': 29.50, 'limits': {'clients': -1}, 'features': ['Ilimitado', 'API access']}
+]
+PLANS_BODY, PLANS_ETAG = precomputed_json({"success": True, "plans": PLANS})
+PLANS_CACHE_CONTROL = 'public, max-age=300'
+
 def require_auth():
     auth_header = request.headers.get('Authorization', '')
     if not auth_header.startswith('Bearer '):
@@ -34,13 +55,34 @@ def get_billing_status():
     user_data, error = require_auth()
     if error: return error
     
-    with get_db_session() as session:
-        billing = session.query(UserBilling).filter_by(user_id=user_data['user_id']).first()
-        if not billing:
+    cached = get_cached_status(user_data['user_id'])
+    if cached is not None:
+        billing_data, etag = cached
+        if is_not_modified(etag):
+            return not_modified(etag)
+        return with_etag(jsonify({"success": True, "billing": billing_data}), etag)
+    
+    with request_session() as session:
+        row = session.query(UserBilling, UserUsage).outerjoin(
+            UserUsage, UserUsage.user_id == UserBilling.user_id
+        ).filter(UserBilling.user_id == user_data['user_id']).first()
+        if not row:
             return jsonify({"success": False, "error": "Billing no encontrado"}), 404
         
-        # Contar servidores locales (clientes) del usuario
-        clients_count = session.query(LocalServer).filter_by(user_id=user_data['user_id']).count()
+        billing, usage = row
+        if usage is None:
+            usage = recompute_usage(session, user_data['user_id'])
+        
+        # Versión: updated_at de billing y uso (más los contadores, por si coinciden en el mismo segundo)
+        etag = make_etag(
+            billing.updated_at or billing.created_at,
+            usage.updated_at,
+            usage.servers_registered,
+            usage.servers_online
+        )
+        
+        # Servidores locales (clientes) del usuario, desde el resumen de uso
+        clients_count = usage.servers_registered
         
         # Obtener límite según el plan
         plan_limit = PLAN_LIMITS.get(billing.plan_type, 1)
@@ -52,22 +94,44 @@ def get_billing_status():
         billing_data['limits'] = {
             'clients': {
                 'current': clients_count,
+                'online': usage.servers_online,
                 'limit': plan_limit,
                 'can_create': can_create
             }
         }
         
-        return jsonify({"success": True, "billing": billing_data})
+    cache_status(user_data['user_id'], billing_data, etag)
+    if is_not_modified(etag):
+        return not_modified(etag)
+    return with_etag(jsonify({"success": True, "billing": billing_data}), etag)
 
 @billing_bp.route('/billing/plans', methods=['GET'])
 def get_plans():
-    plans = [
-        {'type': 'free', 'display_name': 'Gratis', 'price': 0, 'limits': {'clients': 1}, 'features': ['1 cultivo']},
-        {'type': 'starter', 'display_name': 'Starter', 'price': 5.00, 'limits': {'clients': 3}, 'features': ['3 cultivos', 'Automatización básica']},
-        {'type': 'advance', 'display_name': 'Advance', 'price': 17.50, 'limits': {'clients': 10}, 'features': ['10 cultivos', 'Automatización avanzada']},
-        {'type': 'expert', 'display_name': 'Expert', 'price': 29.50, 'limits': {'clients': -1}, 'features': ['Ilimitado', 'API access']}
-    ]
-    return jsonify({"success": True, "plans": plans})
+    if is_not_modified(PLANS_ETAG):
+        return not_modified(PLANS_ETAG, PLANS_CACHE_CONTROL)
+    response = Response(PLANS_BODY, mimetype='application/json')
+    return with_etag(response, PLANS_ETAG, PLANS_CACHE_CONTROL)
+
+def _customer_request_key(user_id: int) -> str:
+    """Clave del alta de cliente en curso; se crea (o rota si venció en Stripe) en una escritura corta"""
+    with get_db_session() as session:
+        key = session.query(UserBilling.customer_request_key).filter_by(user_id=user_id).scalar()
+        if key and time.time() - int(key.split('-', 1)[0]) < CUSTOMER_KEY_MAX_AGE:
+            return key
+        # Condicional: dos requests concurrentes terminan usando la misma clave
+        session.query(UserBilling).filter(
+            UserBilling.user_id == user_id,
+            UserBilling.customer_request_key.is_(None) if key is None else UserBilling.customer_request_key == key
+        ).update({UserBilling.customer_request_key: f"{int(time.time())}-{uuid.uuid4().hex}"},
+                 synchronize_session=False)
+        session.flush()
+        return session.query(UserBilling.customer_request_key).filter_by(user_id=user_id).scalar()
+
+def _clear_customer_request_key(user_id: int, key: str):
+    """Stripe rechazó la clave (reusada con otros parámetros): el próximo intento usa una nueva"""
+    with get_db_session() as session:
+        session.query(UserBilling).filter_by(user_id=user_id, customer_request_key=key).update(
+            {UserBilling.customer_request_key: None}, synchronize_session=False)
 
 @billing_bp.route('/billing/checkout/create', methods=['POST'])
 def create_checkout():
@@ -83,33 +147,59 @@ def create_checkout():
     stripe_service = StripeService()
     base_url = os.getenv('FRONTEND_BASE_URL', 'http://localhost:4200')
     
+    # Lectura corta: no se retiene la conexión durante las llamadas a Stripe
     with get_db_session() as session:
-        user = session.query(User).filter_by(id=user_data['user_id']).first()
-        billing = session.query(UserBilling).filter_by(user_id=user.id).first()
-        
-        customer_id = billing.stripe_customer_id
-        if not customer_id:
-            result = stripe_service.create_customer(user.email, user.id)
-            if not result['success']:
-                return jsonify({"success": False, "error": "Error creando cliente"}), 500
-            customer_id = result['customer_id']
-            billing.stripe_customer_id = customer_id
-            session.commit()
-        
-        result = stripe_service.create_checkout_session(
-            customer_id, plan_type, user.id,
-            f"{base_url}/billing/checkout/success",
-            f"{base_url}/billing/checkout/cancel"
-        )
+        user = session.get(User, user_data['user_id'])
+        billing = first(session, queries.BILLING_BY_USER, user_id=user_data['user_id'])
+        if not user or not billing:
+            return jsonify({"success": False, "error": "Billing no encontrado"}), 404
+        user_id, email, customer_id = user.id, user.email, billing.stripe_customer_id
+    
+    if not customer_id:
+        request_key = _customer_request_key(user_id)
+        result = stripe_service.create_customer(email, user_id, request_key)
+        if not result['success']:
+            if result.get('rotate_key'):
+                _clear_customer_request_key(user_id, request_key)
+            return jsonify({"success": False, "error": "Error creando cliente"}), 503 if result.get('unavailable') else 500
+        customer_id = result['customer_id']
         
-        if result['success']:
-            return jsonify({"success": True, "checkout_url": result['checkout_url']})
-        return jsonify({"success": False, "error": result['message']}), 500
+        # Escritura corta: otra request concurrente pudo guardar el cliente primero
+        with get_db_session(consistency_key=user_id) as session:
+            billing = first(session, queries.BILLING_BY_USER, user_id=user_id)
+            if billing.stripe_customer_id:
+                customer_id = billing.stripe_customer_id
+            else:
+                billing.stripe_customer_id = customer_id
+                billing.customer_request_key = None
+                mark_billing_changed(session, user_id)
+    
+    result = stripe_service.create_checkout_session(
+        customer_id, plan_type, user_id,
+        f"{base_url}/billing/checkout/success",
+        f"{base_url}/billing/checkout/cancel"
+    )
+    
+    if result['success']:
+        return jsonify({"success": True, "checkout_url": result['checkout_url']})
+    return jsonify({"success": False, "error": result['message']}), 503 if result.get('unavailable') else 500
 
 @billing_bp.route('/billing/webhooks/stripe', methods=['POST'])
 def stripe_webhook():
-    # Implementar lógica de webhook de Stripe
-    return jsonify({"success": True})
+    """Recibe webhooks de Stripe: verifica, persiste y responde sin esperar al procesamiento"""
+    payload = request.get_data()
+    sig_header = request.headers.get('Stripe-Signature', '')
+    
+    result = StripeService().verify_webhook(payload, sig_header)
+    if not result['success']:
+        return jsonify({"success": False, "error": "Firma de webhook inválida"}), 400
+    
+    event = result['event']
+    if not event.get('id'):
+        return jsonify({"success": False, "error": "Evento inválido"}), 400
+    
+    queued = get_webhook_processor().ingest(event)
+    return jsonify({"success": True, "duplicate": not queued})
 
 @billing_bp.route('/billing/subscription/cancel', methods=['POST'])
 def cancel_subscription():
@@ -121,37 +211,46 @@ def cancel_subscription():
     immediately = data.get('immediately', False)
     
     with get_db_session() as session:
-        billing = session.query(UserBilling).filter_by(user_id=user_data['user_id']).first()
+        billing = first(session, queries.BILLING_BY_USER, user_id=user_data['user_id'])
         
         if not billing or not billing.stripe_subscription_id:
             return jsonify({"success": False, "error": "No hay suscripción activa"}), 404
+        subscription_id = billing.stripe_subscription_id
+    
+    # Llamada a Stripe sin conexión de base de datos retenida
+    stripe_service = StripeService()
+    result = stripe_service.cancel_subscription(subscription_id, immediately)
+    
+    if not result['success']:
+        return jsonify({"success": False, "error": result.get('message', 'Error desconocido')}), 503 if result.get('unavailable') else 500
+    
+    with get_db_session(consistency_key=user_data['user_id']) as session:
+        billing = first(session, queries.BILLING_BY_USER, user_id=user_data['user_id'])
+        if billing.stripe_subscription_id != subscription_id:
+            # La suscripción cambió durante la llamada (webhook o checkout nuevo): no pisar su estado
+            logger.warning(f"Suscripción de usuario {user_data['user_id']} cambió durante la cancelación de {subscription_id}")
+            return jsonify({"success": False, "error": "La suscripción cambió, vuelve a intentarlo"}), 409
         
-        stripe_service = StripeService()
-        result = stripe_service.cancel_subscription(billing.stripe_subscription_id, immediately)
-        
-        if result['success']:
-            if immediately:
-                billing.plan_type = 'free'
-                billing.plan_status = 'cancelled'
-                billing.stripe_subscription_id = None
-            else:
-                billing.plan_status = 'cancelling'
-            
-            # Registrar evento
-            event = BillingEvent(
-                user_id=user_data['user_id'],
-                event_type='subscription_cancelled',
-                event_metadata={'immediately': immediately}
-            )
-            session.add(event)
-            session.commit()
-            
-            return jsonify({
-                "success": True,
-                "message": "Suscripción cancelada" if immediately else "Suscripción se cancelará al final del período"
-            })
+        if immediately:
+            billing.plan_type = 'free'
+            billing.plan_status = 'cancelled'
+            billing.stripe_subscription_id = None
+        else:
+            billing.plan_status = 'cancelling'
+        mark_billing_changed(session, user_data['user_id'])
         
-        return jsonify({"success": False, "error": result.get('message', 'Error desconocido')}), 500
+        # Registrar evento
+        event = BillingEvent(
+            user_id=user_data['user_id'],
+            event_type='subscription_cancelled',
+            event_metadata={'immediately': immediately, 'subscription_id': subscription_id}
+        )
+        session.add(event)
+    
+    return jsonify({
+        "success": True,
+        "message": "Suscripción cancelada" if immediately else "Suscripción se cancelará al final del período"
+    })
 
 @billing_bp.route('/billing/events', methods=['GET'])
 def get_billing_events():
@@ -159,20 +258,31 @@ def get_billing_events():
     user_data, error = require_auth()
     if error: return error
     
-    limit = request.args.get('limit', 50, type=int)
     event_type = request.args.get('event_type', None)
     
-    with get_db_session() as session:
+    try:
+        after, limit = page_args(request.args, 2)
+    except CursorError:
+        return jsonify({"success": False, "error": "Cursor inválido"}), 400
+    
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
         query = session.query(BillingEvent).filter_by(user_id=user_data['user_id'])
         
         if event_type:
             query = query.filter_by(event_type=event_type)
         
-        events = query.order_by(BillingEvent.created_at.desc()).limit(limit).all()
+        events, next_cursor = paginate(
+            query,
+            [BillingEvent.created_at, BillingEvent.id],
+            after,
+            limit,
+            descending=True
+        )
         
         return jsonify({
             "success": True,
             "events": [e.to_dict() for e in events],
-            "count": len(events)
+            "count": len(events),
+            "next_cursor": next_cursor
         })
 
@@ -1,25 +1,98 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, Response
 from routes.auth_routes import verify_token
-from database import get_db_session
+from database import get_db_session, get_shard_session, shard_for_user, insert_ignore
 from models.local_server import LocalServer
-from models.sync_data import SyncData, SyncEvent
-from datetime import datetime
+from models import queries
+from models.queries import first
+from models.sync_data import SyncData, SyncEvent, SAMPLE_COLUMNS, SYNC_DATA_KEY, SYNC_PAYLOAD_SCHEMA
+from services.alert_service import get_alert_service
+from services.usage_service import adjust_usage
+from services.admission_service import get_admission_controller, retry_hint, retry_after_header, SYNC_SLOT_WAIT
+from services.archive_service import get_segment_archive
+from services.backfill_service import Backfill, iter_ndjson, MAX_CLOCK_SKEW
+from utils.pagination import paginate, page_args, encode_cursor, decode_cursor, CursorError
+from utils.request_session import request_session
+from utils.json_stream import wants_stream, iter_rows, stream_json_array
+from utils.http_cache import make_etag, is_not_modified, not_modified, with_etag
+from services.recent_samples import (get_recent_buffer, BUFFER_METRICS, RECENT_BUFFER_SLOTS,
+                                     RECENT_BUFFER_SETTLE_SECONDS, NUMPY_AVAILABLE)
+from sqlalchemy import func, update
+from datetime import datetime, timedelta
+import csv
+import io
+import math
+import os
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 sync_bp = Blueprint('sync', __name__)
 
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+HISTORY_MAX_DAYS = int(os.getenv('HISTORY_MAX_DAYS', 366))
+SYNC_WINDOW_MINUTES = 15  # los servidores locales envían un agregado cada 15 min
+
+def sync_window_start(moment: datetime) -> datetime:
+    """Inicio de la ventana de sync que contiene moment"""
+    return moment.replace(minute=moment.minute - moment.minute % SYNC_WINDOW_MINUTES, second=0, microsecond=0)
+
+def _token_payload():
+    """Payload del JWT del request, o None (se verifica una vez: admisión y handler lo comparten)"""
+    if 'token_payload' not in g:
+        auth_header = request.headers.get('Authorization', '')
+        g.token_payload = verify_token(auth_header.replace('Bearer ', '')) if auth_header.startswith('Bearer ') else None
+    return g.token_payload
+
 def require_auth():
     auth_header = request.headers.get('Authorization', '')
     if not auth_header.startswith('Bearer '):
         return None, (jsonify({"success": False, "error": "Token requerido"}), 401)
-    token = auth_header.replace('Bearer ', '')
-    payload = verify_token(token)
+    payload = _token_payload()
     if not payload:
         return None, (jsonify({"success": False, "error": "Token inválido"}), 401)
     return payload, None
 
+@sync_bp.before_request
+def admit_ingest():
+    """Admisión de la ingesta (POST): límite por dispositivo, global y de conexiones"""
+    if request.method != 'POST':
+        return None
+    
+    controller = get_admission_controller()
+    body = request.get_json(silent=True) or {}
+    g.server_id = request.args.get('server_id') or body.get('server_id')  # para los logs de la request
+    
+    # El bucket es del usuario autenticado (y su dispositivo): un server_id ajeno en el cuerpo no
+    # agota el de otro. Sin token válido se limita por IP (el handler responde 401)
+    payload = _token_payload()
+    if payload:
+        device_key = f"user:{payload['user_id']}:{g.server_id or ''}"
+    else:
+        device_key = f"ip:{request.remote_addr}"
+    wait = controller.admit(device_key)
+    if not wait:
+        if controller.acquire_slot():
+            g.ingest_slot = True
+            return None
+        controller.refund(device_key)
+        wait = SYNC_SLOT_WAIT
+    
+    hint = retry_hint(wait)
+    response = jsonify({
+        "success": False,
+        "error": "Demasiadas sincronizaciones, reintentar más tarde",
+        "retry_after": round(hint, 2)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(hint)
+    return response
+
+@sync_bp.teardown_request
+def release_ingest_slot(exc):
+    if g.pop('ingest_slot', False):
+        get_admission_controller().release_slot()
+
 @sync_bp.route('/sync/register', methods=['POST'])
 def register_server():
     """Registra un nuevo servidor local"""
@@ -33,11 +106,14 @@ def register_server():
     if not server_id:
         return jsonify({"success": False, "error": "server_id requerido"}), 400
     
-    with get_db_session() as session:
-        server = session.query(LocalServer).filter_by(server_id=server_id).first()
+    with request_session(consistency_key=user_data['user_id']) as session:
+        server = first(session, queries.SERVER_BY_DEVICE, server_id=server_id)
+        now = datetime.now()
         
         if server:
-            server.last_seen = datetime.now()
+            if server.status != 'online':
+                adjust_usage(session, server.user_id, online=1)
+            server.last_seen = now
             server.status = 'online'
         else:
             server = LocalServer(
@@ -45,12 +121,14 @@ def register_server():
                 server_id=server_id,
                 name=name,
                 status='online',
-                last_seen=datetime.now()
+                last_seen=now
             )
             session.add(server)
+            adjust_usage(session, user_data['user_id'], registered=1, online=1)
         
-        session.commit()
-        logger.info(f"Servidor registrado: {server_id} para usuario {user_data['user_id']}")
+        session.flush()
+        get_alert_service().notify_heartbeat(server.id, now)
+        logger.info("Servidor registrado: %s para usuario %s", server_id, user_data['user_id'])
         return jsonify({"success": True, "server": server.to_dict()})
 
 @sync_bp.route('/sync/data', methods=['POST'])
@@ -59,60 +137,141 @@ def sync_data():
     user_data, error = require_auth()
     if error: return error
     
-    data = request.get_json()
-    server_id = data.get('server_id')
+    data, errors = SYNC_PAYLOAD_SCHEMA.check(request.get_json(silent=True))
+    if errors:
+        return jsonify({"success": False, "error": "Payload inválido", "fields": errors}), 400
+    server_id = data['server_id']
     
-    if not server_id:
-        return jsonify({"success": False, "error": "server_id requerido"}), 400
+    # Hora de medición del dispositivo (opcional). Sin ella, el inicio de la ventana de sync
+    # de la recepción: un reintento en la misma ventana no duplica la muestra
+    now = datetime.now()
+    sample_time = data['timestamp'] or sync_window_start(now)
+    if sample_time > now + MAX_CLOCK_SKEW:
+        sample_time = now
     
-    with get_db_session() as session:
-        server = session.query(LocalServer).filter_by(
-            server_id=server_id,
-            user_id=user_data['user_id']
-        ).first()
+    with request_session(consistency_key=user_data['user_id']) as session:
+        server = first(session, queries.OWNED_SERVER_BY_DEVICE, server_id=server_id, user_id=user_data['user_id'])
         
         if not server:
             return jsonify({"success": False, "error": "Servidor no registrado"}), 404
         
         # Actualizar estado del servidor
-        server.last_seen = datetime.now()
-        server.last_sync_at = datetime.now()
+        server.last_seen = now
+        server.last_sync_at = now
+        if server.status != 'online':
+            adjust_usage(session, server.user_id, online=1)
         server.status = 'online'
-        server.clients_count = data.get('clients_total', 0)
-        server.clients_online = data.get('clients_online', 0)
-        server.version = data.get('version', '1.0.0')
-        server.ip_address = data.get('ip_address', request.remote_addr)
-        
-        # Guardar datos sincronizados
-        sync_data_obj = SyncData(
-            server_id=server.id,
-            user_id=user_data['user_id'],
-            data_timestamp=datetime.now(),
-            avg_temperature=data.get('avg_temperature', 0),
-            min_temperature=data.get('min_temperature', 0),
-            max_temperature=data.get('max_temperature', 0),
-            avg_humidity=data.get('avg_humidity', 0),
-            min_humidity=data.get('min_humidity', 0),
-            max_humidity=data.get('max_humidity', 0),
-            avg_light_intensity=data.get('avg_light_intensity', 0),
-            avg_pressure=data.get('avg_pressure', 0),
-            clients_total=data.get('clients_total', 0),
-            clients_online=data.get('clients_online', 0),
-            readings_count=data.get('readings_count', 0)
-        )
-        session.add(sync_data_obj)
-        
-        # Registrar evento de sync exitoso
-        event = SyncEvent(
-            server_id=server.id,
-            event_type='sync_success',
-            message=f'Sincronización exitosa - {data.get("readings_count", 0)} lecturas'
-        )
-        session.add(event)
+        server.clients_count = data['clients_total'] or 0
+        server.clients_online = data['clients_online'] or 0
+        server.version = data['version'] or '1.0.0'
+        server.ip_address = data['ip_address'] or request.remote_addr
         
+        server_pk = server.id
         session.commit()
-        logger.info(f"Datos sincronizados de servidor {server_id}")
-        return jsonify({"success": True, "message": "Datos sincronizados"})
+    get_alert_service().notify_heartbeat(server_pk, now)
+    
+    # Guardar datos sincronizados en el shard del usuario: un reintento con el mismo timestamp no inserta nada.
+    # No es atómico con el commit anterior (otra base): si el shard falla, el servidor queda online con
+    # last_sync_at nuevo pero sin la muestra; el dispositivo recibe 500 y reintenta con el mismo
+    # timestamp (o en la misma ventana), y la muestra se inserta una sola vez
+    row = {
+        'server_id': server_pk,
+        'user_id': user_data['user_id'],
+        'data_timestamp': sample_time,
+        **{column: data[column] for column in SAMPLE_COLUMNS}
+    }
+    shard = shard_for_user(user_data['user_id'])
+    with get_shard_session(shard, consistency_key=user_data['user_id']) as shard_session:
+        inserted = insert_ignore(shard_session, SyncData, SYNC_DATA_KEY, row) > 0
+        
+        if inserted:
+            # Registrar evento de sync exitoso
+            event = SyncEvent(
+                server_id=server_pk,
+                event_type='sync_success',
+                message=f'Sincronización exitosa - {data["readings_count"] or 0} lecturas'
+            )
+            shard_session.add(event)
+        shard_session.commit()
+    
+    if not inserted:
+        logger.info("Sync duplicado de servidor %s (%s)", server_id, sample_time)
+        return jsonify({"success": True, "message": "Datos ya sincronizados", "duplicate": True})
+    
+    if NUMPY_AVAILABLE:
+        get_recent_buffer().append(server_pk, sample_time.timestamp(), {metric: row[metric] for metric in BUFFER_METRICS},
+                                   now.timestamp())
+    
+    # Las anomalías y las reglas de umbral las evalúa el líder del monitor de alertas (services/sample_feed.py)
+    logger.info("Datos sincronizados de servidor %s", server_id)
+    return jsonify({"success": True, "message": "Datos sincronizados", "duplicate": False})
+
+@sync_bp.route('/sync/backfill', methods=['POST'])
+def backfill_data():
+    """Recibe muestras históricas (NDJSON o lote JSON) con sus timestamps originales"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    ndjson = request.mimetype in NDJSON_MIMETYPES
+    body = {} if ndjson else (request.get_json(silent=True) or {})
+    server_id = request.args.get('server_id') or body.get('server_id')
+    resume_token = request.args.get('resume_token') or body.get('resume_token')
+    
+    if not server_id:
+        return jsonify({"success": False, "error": "server_id requerido"}), 400
+    if not ndjson and not isinstance(body.get('samples'), list):
+        return jsonify({"success": False, "error": "samples (lista) requerido o enviar application/x-ndjson"}), 400
+    
+    with get_db_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        server_pk = first(session, queries.OWNED_SERVER_PK_BY_DEVICE, server_id=server_id, user_id=user_data['user_id'])
+    if server_pk is None:
+        return jsonify({"success": False, "error": "Servidor no registrado"}), 404
+    
+    resume_after = None
+    if resume_token:
+        try:
+            token_server, resume_after = decode_cursor(resume_token, 2)
+        except CursorError:
+            token_server = None
+        if token_server != server_pk or not isinstance(resume_after, datetime):
+            return jsonify({"success": False, "error": "resume_token inválido"}), 400
+    
+    # NDJSON se procesa en streaming (en orden de llegada); un lote JSON se ordena por timestamp
+    backfill = Backfill(server_pk, user_data['user_id'], resume_after)
+    if ndjson:
+        backfill.run(iter_ndjson(request.stream))
+    else:
+        backfill.run(body['samples'], ordered=False)
+    
+    # El buffer se recalienta (en los demás workers, al ver el nuevo last_sync_at); el detector
+    # de anomalías y las reglas descartan las muestras anteriores a la última que procesaron de cada servidor
+    if backfill.inserted:
+        with get_db_session(consistency_key=user_data['user_id']) as session:
+            session.execute(
+                update(LocalServer).where(LocalServer.id == server_pk).values(last_sync_at=datetime.now())
+            )
+        if NUMPY_AVAILABLE:
+            get_recent_buffer().invalidate(server_pk)
+    
+    result = {
+        "success": True,
+        "complete": backfill.complete,
+        "inserted": backfill.inserted,
+        "rejected": backfill.rejected,
+        "errors": backfill.errors,
+        "skipped": backfill.skipped,
+        "duplicates": backfill.duplicates,
+        "resume_token": encode_cursor([server_pk, backfill.last_timestamp]) if backfill.last_timestamp else None
+    }
+    logger.info("Backfill de servidor %s: %s muestras (completo: %s)", server_id, backfill.inserted, backfill.complete)
+    if backfill.complete:
+        return jsonify(result)
+    
+    # Ritmo agotado: el cliente reanuda con resume_token después de Retry-After
+    response = jsonify(result)
+    response.status_code = 202 if backfill.inserted else 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(min(backfill.retry_after, 3600))))
+    return response
 
 @sync_bp.route('/sync/servers', methods=['GET'])
 def list_servers():
@@ -120,9 +279,150 @@ def list_servers():
     user_data, error = require_auth()
     if error: return error
     
-    with get_db_session() as session:
-        servers = session.query(LocalServer).filter_by(user_id=user_data['user_id']).all()
-        return jsonify({
+    try:
+        after, limit = page_args(request.args, 1)
+    except CursorError:
+        return jsonify({"success": False, "error": "Cursor inválido"}), 400
+    
+    with request_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        # Versión del listado: número de servidores y última modificación (una agregación por índice)
+        count, last_change = session.query(
+            func.count(LocalServer.id),
+            func.max(func.coalesce(LocalServer.updated_at, LocalServer.registered_at))
+        ).filter(LocalServer.user_id == user_data['user_id']).one()
+        stream = wants_stream(request.args)
+        etag = make_etag(count, last_change, request.args.get('cursor'), 'stream' if stream else limit)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        
+        query = session.query(LocalServer).filter_by(user_id=user_data['user_id'])
+        if stream:
+            rows = iter_rows(query, [LocalServer.id], after)
+            return with_etag(stream_json_array('servers', rows, LocalServer.to_dict), etag)
+        
+        servers, next_cursor = paginate(query, [LocalServer.id], after, limit)
+        return with_etag(jsonify({
             "success": True,
-            "servers": [server.to_dict() for server in servers]
-        })
+            "servers": [server.to_dict() for server in servers],
+            "next_cursor": next_cursor
+        }), etag)
+
+@sync_bp.route('/sync/servers/<int:server_id>/recent', methods=['GET'])
+def get_recent_samples(server_id):
+    """Historial reciente de un servidor (últimas 24 h), servido desde memoria"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24)
+    since = time.time() - hours * 3600
+    
+    # Propiedad y last_sync_at: el buffer de este worker solo sirve si ya incorpora ese sync
+    with get_db_session(readonly=True, consistency_key=user_data['user_id']) as session:
+        server = session.execute(queries.OWNED_SERVER_LAST_SYNC,
+                                 {'server_pk': server_id, 'user_id': user_data['user_id']}).first()
+    if server is None:
+        return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
+    last_sync = server.last_sync_at.timestamp() if server.last_sync_at else 0.0
+    
+    if NUMPY_AVAILABLE:
+        cached = get_recent_buffer().get(server_id, since, last_sync)
+        if cached is not None:
+            _, samples = cached
+            return jsonify({"success": True, "server_id": server_id, "samples": samples, "source": "memory"})
+    
+    # Fallo de caché: calentar desde el shard del usuario. last_sync_at se escribe antes que la
+    # muestra llegue al shard: un sync muy reciente puede faltar, y esa fila se revalida luego
+    synced_at = last_sync if time.time() - last_sync > RECENT_BUFFER_SETTLE_SECONDS else 0.0
+    shard = shard_for_user(user_data['user_id'])
+    with get_shard_session(shard, readonly=True, consistency_key=user_data['user_id']) as session:
+        rows = session.query(SyncData).filter_by(server_id=server_id).order_by(
+            SyncData.data_timestamp.desc()
+        ).limit(RECENT_BUFFER_SLOTS).all()
+        warm_samples = [
+            (row.data_timestamp.timestamp(), {metric: getattr(row, metric) for metric in BUFFER_METRICS})
+            for row in reversed(rows)
+        ]
+    
+    if NUMPY_AVAILABLE:
+        buffer = get_recent_buffer()
+        buffer.warm(server_id, user_data['user_id'], warm_samples, synced_at)
+        _, samples = buffer.get(server_id, since, synced_at) or (None, [])
+    else:
+        samples = [
+            {'data_timestamp': datetime.fromtimestamp(timestamp).isoformat(), **values}
+            for timestamp, values in warm_samples if timestamp >= since
+        ]
+    return jsonify({"success": True, "server_id": server_id, "samples": samples, "source": "database"})
+
+def _history_range():
+    """(start, end) de ?start=&end= (ISO 8601), por defecto los últimos 7 días"""
+    end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.now()
+    start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=7)
+    if start.tzinfo:
+        start = start.astimezone().replace(tzinfo=None)
+    if end.tzinfo:
+        end = end.astimezone().replace(tzinfo=None)
+    if start >= end or end - start > timedelta(days=HISTORY_MAX_DAYS):
+        raise ValueError("Rango inválido")
+    return start, end
+
+def _owned_server(server_id: int, user_id: int) -> bool:
+    with get_db_session(readonly=True, consistency_key=user_id) as session:
+        return first(session, queries.OWNED_SERVER_PK, server_pk=server_id, user_id=user_id) is not None
+
+@sync_bp.route('/sync/servers/<int:server_id>/history', methods=['GET'])
+def get_history(server_id):
+    """Historial de un servidor en un rango, combinando datos recientes y archivados"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    try:
+        start, end = _history_range()
+    except ValueError:
+        return jsonify({"success": False, "error": f"Rango inválido (ISO 8601, máximo {HISTORY_MAX_DAYS} días)"}), 400
+    
+    if not _owned_server(server_id, user_data['user_id']):
+        return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
+    
+    samples, segments = get_segment_archive().read_history(server_id, start, end)
+    return jsonify({
+        "success": True,
+        "server_id": server_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "samples": samples,
+        "count": len(samples),
+        "archived_segments": segments
+    })
+
+@sync_bp.route('/sync/servers/<int:server_id>/export', methods=['GET'])
+def export_history(server_id):
+    """Exporta el historial de un servidor en CSV (datos recientes y archivados)"""
+    user_data, error = require_auth()
+    if error: return error
+    
+    try:
+        start, end = _history_range()
+    except ValueError:
+        return jsonify({"success": False, "error": f"Rango inválido (ISO 8601, máximo {HISTORY_MAX_DAYS} días)"}), 400
+    
+    if not _owned_server(server_id, user_data['user_id']):
+        return jsonify({"success": False, "error": "Servidor no encontrado"}), 404
+    
+    samples, _ = get_segment_archive().read_history(server_id, start, end)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('data_timestamp',) + SAMPLE_COLUMNS)
+        for sample in samples:
+            writer.writerow([sample['data_timestamp']] + [sample[column] for column in SAMPLE_COLUMNS])
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f"server_{server_id}_{start:%Y%m%d}_{end:%Y%m%d}.csv"
+    return Response(generate(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
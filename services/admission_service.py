@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Control de Admisión de Ingesta para FungiCloud
+Token buckets global y por dispositivo para /sync, y un semáforo que limita cuántas
+conexiones del pool primario puede ocupar la ingesta a la vez, para que auth, billing
+y admin conserven capacidad durante una avalancha de syncs
+"""
+import logging
+import math
+import os
+import random
+import threading
+from collections import OrderedDict
+from database import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SYNC_GLOBAL_RATE = float(os.getenv('SYNC_GLOBAL_RATE', 200))  # requests/s por proceso
+SYNC_GLOBAL_BURST = float(os.getenv('SYNC_GLOBAL_BURST', 400))
+SYNC_DEVICE_RATE = float(os.getenv('SYNC_DEVICE_RATE', 0.2))  # requests/s por dispositivo (1 cada 5 s)
+SYNC_DEVICE_BURST = float(os.getenv('SYNC_DEVICE_BURST', 5))
+SYNC_DEVICE_BUCKETS_MAX = int(os.getenv('SYNC_DEVICE_BUCKETS_MAX', 50000))
+SYNC_DB_SHARE = float(os.getenv('SYNC_DB_SHARE', 0.6))  # fracción del pool primario para ingesta
+SYNC_SLOT_WAIT = float(os.getenv('SYNC_SLOT_WAIT', 0.5))  # segundos esperando un hueco antes de rechazar
+SYNC_RETRY_JITTER = float(os.getenv('SYNC_RETRY_JITTER', 1.0))  # fracción aleatoria sumada al Retry-After
+
+class AdmissionController:
+    def __init__(self):
+        self.global_bucket = TokenBucket(SYNC_GLOBAL_RATE, SYNC_GLOBAL_BURST)
+        self.device_buckets = OrderedDict()  # clave de dispositivo -> TokenBucket, en orden LRU
+        self.db_slots = max(1, int((DB_POOL_SIZE + DB_MAX_OVERFLOW) * SYNC_DB_SHARE))
+        self._slots = threading.BoundedSemaphore(self.db_slots)
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.in_flight = 0  # huecos ocupados
+        self.waiting = 0  # requests esperando un hueco
+
+    def _device_bucket(self, device_key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self.device_buckets.get(device_key)
+            if bucket is None:
+                bucket = self.device_buckets[device_key] = TokenBucket(SYNC_DEVICE_RATE, SYNC_DEVICE_BURST)
+                if len(self.device_buckets) > SYNC_DEVICE_BUCKETS_MAX:
+                    self.device_buckets.popitem(last=False)
+            else:
+                self.device_buckets.move_to_end(device_key)
+            return bucket
+
+    def admit(self, device_key: str) -> float:
+        """0 si el request entra, o los segundos que el dispositivo debe esperar"""
+        device_bucket = self._device_bucket(device_key)
+        wait = device_bucket.acquire()
+        if not wait:
+            wait = self.global_bucket.acquire()
+            if wait:
+                device_bucket.refund()  # el rechazo global no cuenta contra el dispositivo
+        if wait:
+            self.rejected += 1
+        return wait
+
+    def refund(self, device_key: str):
+        """Devuelve las fichas de un request admitido que no consiguió hueco en el pool"""
+        with self._lock:
+            bucket = self.device_buckets.get(device_key)
+        if bucket is not None:
+            bucket.refund()
+        self.global_bucket.refund()
+
+    def acquire_slot(self) -> bool:
+        """Reserva un hueco de ingesta en el pool; False si está saturado"""
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=SYNC_SLOT_WAIT)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+        return acquired
+
+    def release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """Huecos de ingesta ocupados, requests en espera y rechazos acumulados"""
+        return {'slots': self.db_slots, 'in_flight': self.in_flight,
+                'waiting': self.waiting, 'rejected': self.rejected}
+
+def retry_hint(wait: float) -> float:
+    """Espera sugerida con jitter, para que los dispositivos rechazados no reintenten a la vez"""
+    return wait + random.uniform(0, max(wait, 1.0) * SYNC_RETRY_JITTER)
+
+def retry_after_header(hint: float) -> str:
+    return str(max(1, math.ceil(hint)))
+
+# Instancia global
+_admission_controller = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """Obtiene el control de admisión de la ingesta"""
+    global _admission_controller
+    with _controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController()
+    return _admission_controller
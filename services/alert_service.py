@@ -6,6 +6,8 @@ Monitorea servidores offline y envía notificaciones
 import logging
 import smtplib
 import os
+import heapq
+import queue
 import threading
 import time
 from email.mime.text import MIMEText
@@ -13,15 +15,123 @@ from email.mime.multipart import MIMEMultipart
 from database import get_db_session
 from models.local_server import LocalServer
 from models.user import User
+from models import queries
+from models.sync_data import SENSOR_METRICS
+from services.lease_service import Lease
+from services.anomaly_service import AnomalyDetector
+from services.rule_engine import RuleEngine
+from services.sample_feed import SampleFeed, SAMPLE_FEED_INTERVAL
+from services.usage_service import adjust_usage
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+OFFLINE_THRESHOLD_MINUTES = int(os.getenv('ALERT_OFFLINE_MINUTES', 15))
+ALERT_EMAIL_WORKERS = int(os.getenv('ALERT_EMAIL_WORKERS', 2))  # hilos de envío SMTP por proceso
+ALERT_EMAIL_QUEUE_SIZE = int(os.getenv('ALERT_EMAIL_QUEUE_SIZE', 1000))  # emails en espera antes de descartar
+
+def _to_epoch(value: datetime) -> float:
+    """Convierte un datetime (naive local o con zona) a segundos epoch"""
+    return value.timestamp()
+
+class HeartbeatScheduler:
+    """Min-heap de deadlines por servidor (último heartbeat + umbral offline)
+    
+    Cada heartbeat inserta una entrada nueva en O(log n); las entradas viejas
+    de un servidor se descartan de forma perezosa al llegar a la cima.
+    """
+    def __init__(self, timeout_seconds: float):
+        self.timeout = timeout_seconds
+        self._heap = []  # (deadline, server_pk)
+        self._deadlines = {}  # server_pk -> deadline vigente
+        self._cond = threading.Condition()
+    
+    def __len__(self):
+        return len(self._deadlines)
+    
+    def touch(self, server_pk: int, last_seen_ts: float):
+        """Registra un heartbeat y reprograma el deadline del servidor"""
+        deadline = last_seen_ts + self.timeout
+        with self._cond:
+            current = self._deadlines.get(server_pk)
+            if current is not None and current >= deadline:
+                return
+            self._deadlines[server_pk] = deadline
+            heapq.heappush(self._heap, (deadline, server_pk))
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._compact()
+            if self._heap[0] == (deadline, server_pk):
+                self._cond.notify()
+    
+    def remove(self, server_pk: int):
+        """Deja de vigilar un servidor"""
+        with self._cond:
+            self._deadlines.pop(server_pk, None)
+    
+    def clear(self):
+        with self._cond:
+            self._heap = []
+            self._deadlines = {}
+    
+    def pop_expired(self, now_ts: float) -> list:
+        """Extrae los servidores cuyo deadline vigente ya venció"""
+        expired = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now_ts:
+                deadline, server_pk = heapq.heappop(self._heap)
+                if self._deadlines.get(server_pk) == deadline:
+                    del self._deadlines[server_pk]
+                    expired.append(server_pk)
+        return expired
+    
+    def wait(self, max_wait: float):
+        """Espera hasta el próximo deadline, un heartbeat más urgente o max_wait"""
+        with self._cond:
+            timeout = max_wait
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            if timeout > 0:
+                self._cond.wait(timeout)
+    
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+    
+    def _compact(self):
+        """Reconstruye el heap sin entradas obsoletas"""
+        self._heap = [(deadline, pk) for pk, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
 class AlertService:
-    def __init__(self):
+    def __init__(self, shard_index: int = None, shard_count: int = None):
         self.running = False
         self.thread = None
-        self.check_interval = int(os.getenv('ALERT_CHECK_INTERVAL', 300))  # 5 min
+        self.check_interval = int(os.getenv('ALERT_CHECK_INTERVAL', 300))  # 5 min, resincronización con la DB
+        self.offline_threshold = timedelta(minutes=OFFLINE_THRESHOLD_MINUTES)
+        self.scheduler = HeartbeatScheduler(self.offline_threshold.total_seconds())
+        self._synced_until = None
+        
+        # Coordinación: un líder por shard (servidores con id % shard_count == shard_index)
+        self.shard_count = shard_count if shard_count is not None else int(os.getenv('ALERT_SHARD_COUNT', 1))
+        self.shard_index = shard_index if shard_index is not None else int(os.getenv('ALERT_SHARD_INDEX', 0))
+        if not 0 <= self.shard_index < self.shard_count:
+            raise ValueError(f"Shard inválido: {self.shard_index} de {self.shard_count}")
+        self.lease_ttl = int(os.getenv('ALERT_LEASE_TTL', 30))
+        self.lease = Lease(f"alert-monitor-{self.shard_index}-of-{self.shard_count}", self.lease_ttl)
+        self.is_leader = False
+        self._next_lease_check = 0.0
+        
+        # Estado en memoria de los servidores del shard (solo el líder lo mantiene)
+        self.detector = AnomalyDetector()
+        self.rules = RuleEngine()
+        self.feed = SampleFeed(SENSOR_METRICS, self.shard_index, self.shard_count)
+        self.last_loop_at = None  # instante monotónico de la última vuelta sin errores del loop
+        
+        # Emails de anomalías y reglas: cola acotada y pocos hilos de envío (se crean en el primer email)
+        self._outbox = queue.Queue(maxsize=ALERT_EMAIL_QUEUE_SIZE)
+        self._senders = []
+        self._senders_lock = threading.Lock()
+        self.emails_dropped = 0
     
     def start(self):
         """Inicia el monitor de alertas"""
@@ -34,75 +144,249 @@ class AlertService:
         self.thread.start()
         logger.info("Monitor de alertas iniciado")
     
+    def run_forever(self):
+        """Ejecuta el monitor en el hilo actual (worker dedicado)"""
+        self.running = True
+        logger.info(f"Monitor de alertas iniciado (shard {self.shard_index} de {self.shard_count})")
+        try:
+            self._monitor_loop()
+        finally:
+            self._step_down()
+    
     def stop(self):
         """Detiene el monitor de alertas"""
         self.running = False
+        self.scheduler.wake()
         if self.thread:
             self.thread.join(timeout=10)
+            self._step_down()
         logger.info("Monitor de alertas detenido")
     
+    def status(self) -> dict:
+        """Estado del loop para /ready: vivo, líder y segundos desde la última vuelta"""
+        alive = self.running and (self.thread is None or self.thread.is_alive())
+        return {
+            'alive': alive,
+            'leader': self.is_leader,
+            'scheduled': len(self.scheduler),
+            'last_scan_age': round(time.monotonic() - self.last_loop_at, 1) if self.last_loop_at is not None else None
+        }
+    
+    def owns(self, server_pk: int) -> bool:
+        """Indica si el servidor pertenece al shard de este monitor"""
+        return server_pk % self.shard_count == self.shard_index
+    
+    def notify_heartbeat(self, server_pk: int, seen_at: datetime):
+        """Refresca el deadline de un servidor desde la ingesta"""
+        if self.running and self.is_leader and self.owns(server_pk):
+            self.scheduler.touch(server_pk, _to_epoch(seen_at))
+    
+    def _ensure_leadership(self) -> bool:
+        """Adquiere o renueva el lease del shard; reconstruye los deadlines al ganarlo"""
+        now = time.monotonic()
+        if now < self._next_lease_check:
+            return self.is_leader
+        self._next_lease_check = now + max(1, self.lease_ttl // 3)
+        
+        try:
+            acquired = self.lease.acquire()
+        except Exception as e:
+            logger.error(f"Error renovando lease de alertas: {e}")
+            acquired = False
+        
+        if acquired and not self.is_leader:
+            logger.info(f"Líder del monitor de alertas: {self.lease.name}")
+            self.is_leader = True
+            self._rebuild_schedule()
+        elif not acquired and self.is_leader:
+            logger.warning(f"Lease de alertas perdido: {self.lease.name}")
+            self.is_leader = False
+            self.scheduler.clear()
+            # Otro proceso es ahora el dueño: sin checkpoint, el nuevo líder carga el último guardado
+            self._drop_owned_state()
+        return self.is_leader
+    
+    def _drop_owned_state(self):
+        self.detector.reset()
+        self.rules.reset()
+        self.feed.reset()
+    
+    def _step_down(self):
+        """Libera el liderazgo al detenerse"""
+        if self.is_leader:
+            self.is_leader = False
+            self.scheduler.clear()
+            self.detector.checkpoint()
+            self.rules.flush()
+            self._drop_owned_state()
+            self.lease.release()
+    
     def _monitor_loop(self):
         """Loop principal del monitor"""
+        next_resync = time.monotonic() + self.check_interval
+        next_scan = time.monotonic()
+        self.last_loop_at = time.monotonic()  # la edad del escaneo cuenta desde el arranque
+        
         while self.running:
             try:
-                self._check_offline_servers()
+                if self._ensure_leadership():
+                    expired = self.scheduler.pop_expired(time.time())
+                    if expired:
+                        self._check_offline_servers(expired)
+                    
+                    if time.monotonic() >= next_resync:
+                        self._resync_schedule()
+                        next_resync = time.monotonic() + self.check_interval
+                    
+                    if time.monotonic() >= next_scan:
+                        next_scan = time.monotonic() + SAMPLE_FEED_INTERVAL
+                        self._scan_samples()
+                self.last_loop_at = time.monotonic()
             except Exception as e:
                 logger.error(f"Error en monitor de alertas: {e}")
             
-            time.sleep(self.check_interval)
+            wake_at = min(next_resync, next_scan, self._next_lease_check)
+            self.scheduler.wait(max(0.0, wake_at - time.monotonic()))
     
-    def _check_offline_servers(self):
-        """Verifica servidores offline y envía alertas"""
-        threshold = datetime.now() - timedelta(minutes=15)
-        
+    def _load_heartbeats(self, since: datetime = None):
+        """Carga los últimos heartbeats de servidores no marcados offline"""
         with get_db_session() as session:
-            offline_servers = session.query(LocalServer).filter(
-                LocalServer.last_seen < threshold,
+            query = session.query(LocalServer.id, LocalServer.last_seen).filter(
                 LocalServer.status != 'offline',
-                LocalServer.alerts_enabled == True
-            ).all()
+                LocalServer.last_seen.isnot(None)
+            )
+            if self.shard_count > 1:
+                query = query.filter(LocalServer.id % self.shard_count == self.shard_index)
+            if since is not None:
+                query = query.filter(LocalServer.last_seen >= since)
+            for server_pk, last_seen in query:
+                self.scheduler.touch(server_pk, _to_epoch(last_seen))
+    
+    def _rebuild_schedule(self):
+        """Reconstruye el heap completo desde la base de datos (arranque)"""
+        started = datetime.now()
+        self.scheduler.clear()
+        try:
+            self._load_heartbeats()
+        except Exception as e:
+            logger.error(f"Error reconstruyendo deadlines de alertas: {e}")
+            return
+        self._synced_until = started
+        logger.info(f"Deadlines de alertas reconstruidos: {len(self.scheduler)} servidores")
+    
+    def _resync_schedule(self):
+        """Incorpora heartbeats recibidos por otros procesos desde la última sincronización"""
+        started = datetime.now()
+        since = self._synced_until - timedelta(seconds=self.check_interval) if self._synced_until else None
+        self._load_heartbeats(since)
+        self._synced_until = started
+    
+    def _check_offline_servers(self, server_pks: list):
+        """Marca offline los servidores con deadline vencido y envía alertas"""
+        now_ts = time.time()
+        alerts = []
+        
+        with get_db_session() as session:
+            servers = session.execute(queries.OFFLINE_CANDIDATES, {'server_pks': server_pks}).scalars().all()
             
-            for server in offline_servers:
+            for server in servers:
+                # Otro proceso pudo recibir un heartbeat más reciente
+                if server.last_seen and _to_epoch(server.last_seen) + self.scheduler.timeout > now_ts:
+                    self.scheduler.touch(server.id, _to_epoch(server.last_seen))
+                    continue
+                
                 # Actualizar estado
                 server.status = 'offline'
+                adjust_usage(session, server.user_id, online=-1)
+                
+                if not server.alerts_enabled:
+                    continue
                 
                 # Obtener usuario
-                user = session.query(User).filter_by(id=server.user_id).first()
+                user = session.get(User, server.user_id)
                 
                 if user and user.is_active:
-                    # Enviar alerta
-                    self._send_alert_email(
-                        user.email,
-                        server.name,
-                        server.last_seen
-                    )
-                    logger.warning(f"Alerta enviada: servidor {server.server_id} offline")
+                    alerts.append((user.email, server.name, server.last_seen, server.server_id))
             
             session.commit()
+        
+        # Enviar alertas fuera de la transacción
+        for to_email, server_name, last_seen, server_id in alerts:
+            self._send_alert_email(to_email, server_name, last_seen)
+            logger.warning(f"Alerta enviada: servidor {server_id} offline")
+    
+    def _scan_samples(self):
+        """Pasa las muestras nuevas del shard al detector de anomalías y a las reglas (estado en memoria)"""
+        samples = self.feed.poll()
+        anomalies = {}
+        triggered = {}
+        if samples:
+            server_pks = {sample.server_pk for sample in samples}
+            self.detector.warm(server_pks)
+            self.rules.refresh(sample.user_id for sample in samples)
+            self.rules.warm(server_pks)
+            for sample in samples:
+                found = self.detector.observe(sample.server_pk, sample.values)
+                if found:
+                    anomalies.setdefault(sample.server_pk, []).extend(found)
+                fired = self.rules.evaluate(sample.user_id, sample.server_pk, sample.timestamp, sample.values)
+                if fired:
+                    triggered.setdefault(sample.server_pk, []).extend(fired)
+            self.rules.flush()
+        if self.detector.checkpoint_due():
+            self.detector.checkpoint()
+        if anomalies or triggered:
+            self._send_sample_alerts(anomalies, triggered)
+    
+    def _send_sample_alerts(self, anomalies: dict, triggered: dict):
+        """server_pk -> anomalías / reglas disparadas; solo servidores con alertas activas y dueño activo"""
+        server_pks = list(set(anomalies) | set(triggered))
+        with get_db_session(readonly=True) as session:
+            recipients = session.execute(queries.ALERT_RECIPIENTS, {'server_pks': server_pks}).all()
+        for server_pk, server_name, alert_email, owner_email in recipients:
+            if server_pk in anomalies:
+                self.send_sensor_alert(alert_email or owner_email, server_name, anomalies[server_pk])
+            if server_pk in triggered:
+                self.send_rule_alert(alert_email or owner_email, server_name, triggered[server_pk])
+    
+    def send_sensor_alert(self, to_email: str, server_name: str, anomalies: list):
+        """Envía una alerta de sensores en segundo plano (no bloquea el monitor)"""
+        self._enqueue_email(self._send_sensor_alert_email, to_email, server_name, anomalies)
+    
+    def send_rule_alert(self, to_email: str, server_name: str, triggered: list):
+        """Envía una alerta de reglas de umbral en segundo plano (no bloquea el monitor)"""
+        self._enqueue_email(self._send_rule_alert_email, to_email, server_name, triggered)
+    
+    def _enqueue_email(self, send, *args):
+        """Encola un envío; si la cola está llena (SMTP caído o lento) lo descarta"""
+        with self._senders_lock:
+            while len(self._senders) < ALERT_EMAIL_WORKERS:
+                sender = threading.Thread(target=self._sender_loop, daemon=True)
+                sender.start()
+                self._senders.append(sender)
+        try:
+            self._outbox.put_nowait((send, args))
+        except queue.Full:
+            self.emails_dropped += 1
+            logger.error("Cola de emails llena (%s), alerta descartada para %s", ALERT_EMAIL_QUEUE_SIZE, args[0])
+    
+    def _sender_loop(self):
+        while True:
+            send, args = self._outbox.get()
+            try:
+                send(*args)
+            except Exception as e:
+                logger.error(f"Error enviando alerta: {e}")
+            finally:
+                self._outbox.task_done()
     
     def _send_alert_email(self, to_email: str, server_name: str, last_seen: datetime):
         """Envía email de alerta"""
-        try:
-            smtp_host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
-            smtp_port = int(os.getenv('SMTP_PORT', 587))
-            smtp_user = os.getenv('SMTP_USER')
-            smtp_password = os.getenv('SMTP_PASSWORD')
-            from_email = os.getenv('ALERT_EMAIL_FROM', 'alerts@fungicontrol.com')
-            
-            if not smtp_user or not smtp_password:
-                logger.warning("SMTP no configurado, no se pueden enviar emails")
-                return
-            
-            msg = MIMEMultipart()
-            msg['From'] = from_email
-            msg['To'] = to_email
-            msg['Subject'] = f'⚠️ Servidor Offline: {server_name}'
-            
-            body = f"""
+        body = f"""
             <html>
             <body>
                 <h2>⚠️ Alerta de Servidor Offline</h2>
-                <p>Tu servidor <strong>{server_name}</strong> no se ha conectado en más de 15 minutos.</p>
+                <p>Tu servidor <strong>{server_name}</strong> no se ha conectado en más de {OFFLINE_THRESHOLD_MINUTES} minutos.</p>
                 <p><strong>Última conexión:</strong> {last_seen.strftime('%Y-%m-%d %H:%M:%S')}</p>
                 <p>Por favor verifica:</p>
                 <ul>
@@ -114,7 +398,65 @@ class AlertService:
             </body>
             </html>
             """
+        self._send_email(to_email, f'⚠️ Servidor Offline: {server_name}', body)
+    
+    def _send_sensor_alert_email(self, to_email: str, server_name: str, anomalies: list):
+        """Envía email de alerta de sensores"""
+        rows = ''.join(
+            f"<li><strong>{anomaly['metric']}</strong>: {anomaly['value']} "
+            f"(esperado ~{anomaly['expected']})</li>"
+            for anomaly in anomalies
+        )
+        body = f"""
+            <html>
+            <body>
+                <h2>⚠️ Lecturas Anómalas</h2>
+                <p>Tu servidor <strong>{server_name}</strong> reportó valores fuera de lo habitual:</p>
+                <ul>{rows}</ul>
+                <p>Por favor verifica humidificadores, ventilación y sensores del cultivo.</p>
+            </body>
+            </html>
+            """
+        self._send_email(to_email, f'⚠️ Lecturas anómalas: {server_name}', body)
+        logger.warning("Alerta de sensores enviada: %s (%s métricas)", server_name, len(anomalies))
+    
+    def _send_rule_alert_email(self, to_email: str, server_name: str, triggered: list):
+        """Envía email de alerta de reglas de umbral"""
+        rows = ''
+        for rule in triggered:
+            duration = f" durante {rule['duration_minutes']} min" if rule['duration_minutes'] else ''
+            rows += (f"<li><strong>{rule['name'] or rule['metric']}</strong>: {rule['metric']} = {rule['value']} "
+                     f"({rule['operator']} {rule['threshold']}{duration})</li>")
+        body = f"""
+            <html>
+            <body>
+                <h2>⚠️ Reglas de Alerta Activadas</h2>
+                <p>Tu servidor <strong>{server_name}</strong> cumple las siguientes condiciones:</p>
+                <ul>{rows}</ul>
+                <p>Por favor verifica las condiciones del cultivo.</p>
+            </body>
+            </html>
+            """
+        self._send_email(to_email, f'⚠️ Reglas de alerta: {server_name}', body)
+        logger.warning("Alerta de reglas enviada: %s (%s reglas)", server_name, len(triggered))
+    
+    def _send_email(self, to_email: str, subject: str, body: str):
+        """Envía un email HTML por SMTP"""
+        try:
+            smtp_host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+            smtp_port = int(os.getenv('SMTP_PORT', 587))
+            smtp_user = os.getenv('SMTP_USER')
+            smtp_password = os.getenv('SMTP_PASSWORD')
+            from_email = os.getenv('ALERT_EMAIL_FROM', 'alerts@fungicontrol.com')
             
+            if not smtp_user or not smtp_password:
+                logger.warning("SMTP no configurado, no se pueden enviar emails")
+                return
+            
+            msg = MIMEMultipart()
+            msg['From'] = from_email
+            msg['To'] = to_email
+            msg['Subject'] = subject
             msg.attach(MIMEText(body, 'html'))
             
             with smtplib.SMTP(smtp_host, smtp_port) as server:
@@ -122,7 +464,7 @@ class AlertService:
                 server.login(smtp_user, smtp_password)
                 server.send_message(msg)
             
-            logger.info(f"Alerta enviada a {to_email}")
+            logger.info("Alerta enviada a %s", to_email)
             
         except Exception as e:
             logger.error(f"Error enviando alerta: {e}")
@@ -141,3 +483,10 @@ def start_alert_monitor():
     """Inicia el monitor de alertas"""
     service = get_alert_service()
     service.start()
+
+def alert_monitor_status():
+    """Estado del monitor embebido en este proceso, o None si aquí no corre"""
+    service = _alert_service
+    if service is None or (not service.running and service.thread is None):
+        return None
+    return service.status()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Analítica de Flota para FungiCloud
+Carga una ventana de sync_data en lotes columnares (arrays NumPy) y calcula
+percentiles, histogramas, tiempo fuera de rango y comparativas por plan
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import select
+from database import get_db_session, fan_out
+from models.billing import UserBilling
+from models.sync_data import SyncData
+from utils.lazy_import import LazyModule, module_available
+
+logger = logging.getLogger(__name__)
+
+NUMPY_AVAILABLE = module_available('numpy')
+if not NUMPY_AVAILABLE:
+    logger.warning("NumPy no instalado, analítica de flota deshabilitada")
+np = LazyModule('numpy')  # se importa en el primer cálculo
+
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', 50000))
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', 300))  # segundos
+ANALYTICS_CACHE_SIZE = 64
+ANALYTICS_MAX_DAYS = int(os.getenv('ANALYTICS_MAX_DAYS', 31))  # la ventana se carga entera en memoria
+
+def _parse_range(value: str, default: tuple) -> tuple:
+    try:
+        low, high = (float(part) for part in value.split(','))
+        return low, high
+    except (AttributeError, ValueError):
+        return default
+
+# Rangos óptimos de cultivo: fuera de ellos cuenta como "tiempo fuera de rango"
+OPTIMAL_RANGES = {
+    'avg_temperature': _parse_range(os.getenv('ANALYTICS_TEMPERATURE_RANGE'), (18.0, 26.0)),
+    'avg_humidity': _parse_range(os.getenv('ANALYTICS_HUMIDITY_RANGE'), (80.0, 95.0))
+}
+ANALYTICS_METRICS = tuple(OPTIMAL_RANGES)
+PLAN_TYPES = ('free', 'starter', 'advance', 'expert')
+PERCENTILES = (5, 25, 50, 75, 95)
+
+_cache = {}  # (start, end, bins) -> (expira_monotónico, resultado)
+_cache_lock = threading.Lock()
+
+def load_window(start: datetime, end: datetime) -> dict:
+    """Carga la ventana [start, end) como columnas NumPy (float32 para métricas)"""
+    columns = {'server_id': [], 'user_id': []}
+    columns.update({metric: [] for metric in ANALYTICS_METRICS})
+    stmt = select(
+        SyncData.server_id,
+        SyncData.user_id,
+        *(getattr(SyncData, metric) for metric in ANALYTICS_METRICS)
+    ).where(
+        SyncData.data_timestamp >= start,
+        SyncData.data_timestamp < end
+    ).execution_options(yield_per=ANALYTICS_BATCH_SIZE)
+
+    names = ('server_id', 'user_id') + ANALYTICS_METRICS
+
+    def load_shard(session) -> dict:
+        shard_columns = {name: [] for name in names}
+        result = session.execute(stmt)
+        for batch in result.partitions():
+            batch_columns = list(zip(*batch))
+            shard_columns['server_id'].append(np.asarray(batch_columns[0], dtype=np.int64))
+            shard_columns['user_id'].append(np.asarray(batch_columns[1], dtype=np.int64))
+            for name, values in zip(names[2:], batch_columns[2:]):
+                # None -> NaN al convertir a float
+                shard_columns[name].append(np.asarray(values, dtype=np.float32))
+        return shard_columns
+
+    # Una consulta por shard de series de tiempo, en paralelo
+    for shard_columns in fan_out(load_shard):
+        for name in names:
+            columns[name].extend(shard_columns[name])
+
+    with get_db_session(readonly=True) as session:
+        plans = dict(session.execute(select(UserBilling.user_id, UserBilling.plan_type)).all())
+
+    arrays = {
+        name: np.concatenate(chunks) if chunks else np.empty(0, dtype=np.float32 if name in ANALYTICS_METRICS else np.int64)
+        for name, chunks in columns.items()
+    }
+
+    # Plan por muestra con una tabla de lookup indexada por user_id
+    plan_codes = np.full(max(plans, default=0) + 1, -1, dtype=np.int8)
+    for user_id, plan_type in plans.items():
+        if plan_type in PLAN_TYPES:
+            plan_codes[user_id] = PLAN_TYPES.index(plan_type)
+    user_ids = arrays['user_id']
+    in_table = user_ids < plan_codes.size
+    arrays['plan'] = np.where(in_table, plan_codes[np.where(in_table, user_ids, 0)], -1).astype(np.int8)
+    return arrays
+
+def _metric_stats(values, low: float, high: float, bins: int) -> dict:
+    """Estadísticas vectorizadas de una métrica (ignora NaN)"""
+    valid = values[~np.isnan(values)]
+    if valid.size == 0:
+        return {'samples': 0}
+
+    percentiles = np.percentile(valid, PERCENTILES)
+    counts, edges = np.histogram(valid, bins=bins)
+    out_of_range = np.count_nonzero((valid < low) | (valid > high))
+    return {
+        'samples': int(valid.size),
+        'mean': round(float(valid.mean()), 3),
+        'std': round(float(valid.std()), 3),
+        'min': round(float(valid.min()), 3),
+        'max': round(float(valid.max()), 3),
+        'percentiles': {f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, percentiles)},
+        'histogram': {
+            'edges': [round(float(edge), 3) for edge in edges],
+            'counts': counts.tolist()
+        },
+        'optimal_range': [low, high],
+        'out_of_range_share': round(out_of_range / valid.size, 4)
+    }
+
+def _distinct_count(ids) -> int:
+    """Número de IDs distintos en O(n) (bincount en lugar de ordenar)"""
+    if ids.size == 0:
+        return 0
+    return int(np.count_nonzero(np.bincount(ids)))
+
+def compute_fleet_stats(arrays: dict, bins: int = 20) -> dict:
+    """Estadísticas de flota y comparativa por plan a partir de las columnas"""
+    stats = {
+        'samples': int(arrays['server_id'].size),
+        'servers': _distinct_count(arrays['server_id']),
+        'users': _distinct_count(arrays['user_id']),
+        'metrics': {},
+        'by_plan': {}
+    }
+    for metric in ANALYTICS_METRICS:
+        low, high = OPTIMAL_RANGES[metric]
+        stats['metrics'][metric] = _metric_stats(arrays[metric], low, high, bins)
+
+    for code, plan_type in enumerate(PLAN_TYPES):
+        mask = arrays['plan'] == code
+        if not mask.any():
+            continue
+        plan_stats = {
+            'samples': int(np.count_nonzero(mask)),
+            'servers': _distinct_count(arrays['server_id'][mask])
+        }
+        for metric in ANALYTICS_METRICS:
+            values = arrays[metric][mask]
+            valid = values[~np.isnan(values)]
+            low, high = OPTIMAL_RANGES[metric]
+            plan_stats[metric] = {
+                'mean': round(float(valid.mean()), 3) if valid.size else None,
+                'p50': round(float(np.median(valid)), 3) if valid.size else None,
+                'out_of_range_share': round(np.count_nonzero((valid < low) | (valid > high)) / valid.size, 4) if valid.size else None
+            }
+        stats['by_plan'][plan_type] = plan_stats
+    return stats
+
+def get_fleet_stats(start: datetime, end: datetime, bins: int = 20) -> dict:
+    """Estadísticas de flota para la ventana, cacheadas por ventana"""
+    key = (start.isoformat(), end.isoformat(), bins)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    started = time.perf_counter()
+    arrays = load_window(start, end)
+    loaded = time.perf_counter()
+    stats = compute_fleet_stats(arrays, bins)
+    stats['window'] = {'start': start.isoformat(), 'end': end.isoformat()}
+    stats['timing_ms'] = {
+        'load': round((loaded - started) * 1000, 1),
+        'compute': round((time.perf_counter() - loaded) * 1000, 1)
+    }
+
+    with _cache_lock:
+        if len(_cache) >= ANALYTICS_CACHE_SIZE:
+            for expired_key in [k for k, (expires, _) in _cache.items() if expires <= now] or [next(iter(_cache))]:
+                _cache.pop(expired_key, None)
+        _cache[key] = (now + ANALYTICS_CACHE_TTL, stats)
+    return stats
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Detección de Anomalías para FungiCloud
+Mantiene una media y varianza móviles (EWMA) por servidor y métrica, actualizadas
+en O(1) con cada SyncData, y alerta cuando una muestra se aleja demasiado (z-score).
+
+El estado de cada servidor vive en memoria de un solo proceso: el líder del monitor de
+alertas de su shard, que recibe las muestras nuevas de services.sample_feed. Se carga
+de metric_baselines la primera vez que llega un servidor y los modificados se guardan
+en lote cada ANOMALY_CHECKPOINT_INTERVAL segundos.
+"""
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from sqlalchemy import update
+from database import get_db_session, insert_ignore
+from models.sync_data import SENSOR_METRICS, MetricBaseline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS = 'avg_temperature,min_temperature,max_temperature,avg_humidity,min_humidity,max_humidity'
+ANOMALY_METRICS = tuple(
+    metric.strip() for metric in os.getenv('ANOMALY_METRICS', DEFAULT_METRICS).split(',')
+    if metric.strip() in SENSOR_METRICS
+)
+ANOMALY_ALPHA = float(os.getenv('ANOMALY_EWMA_ALPHA', 0.1))
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 4))
+ANOMALY_MIN_STD = float(os.getenv('ANOMALY_MIN_STD', 0.5))  # evita alertas con varianza casi nula
+ANOMALY_WARMUP_SAMPLES = int(os.getenv('ANOMALY_WARMUP_SAMPLES', 16))  # 4 h de syncs
+ANOMALY_COOLDOWN_MINUTES = int(os.getenv('ANOMALY_ALERT_COOLDOWN', 60))
+ANOMALY_CHECKPOINT_INTERVAL = int(os.getenv('ANOMALY_CHECKPOINT_INTERVAL', 300))  # segundos
+ANOMALY_WARM_BATCH = 500  # servidores por consulta al cargar baselines
+
+class MetricState:
+    """Media y varianza exponenciales de una métrica"""
+    __slots__ = ('mean', 'variance', 'samples', 'last_alert')
+
+    def __init__(self, mean: float = 0.0, variance: float = 0.0, samples: int = 0, last_alert: float = 0.0):
+        self.mean = mean
+        self.variance = variance
+        self.samples = samples
+        self.last_alert = last_alert
+
+    def update(self, value: float, alpha: float) -> float:
+        """Incorpora una muestra y devuelve su z-score respecto al estado previo"""
+        if self.samples == 0:
+            self.mean = value
+            self.samples = 1
+            return 0.0
+
+        diff = value - self.mean
+        std = max(math.sqrt(self.variance), ANOMALY_MIN_STD)
+        z_score = diff / std
+
+        increment = alpha * diff
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + diff * increment)
+        self.samples += 1
+        return z_score
+
+def epoch_seconds(value) -> float:
+    """datetime de la base a segundos epoch (None -> 0)"""
+    if value is None:
+        return 0.0
+    if value.tzinfo is None:  # SQLite devuelve fechas sin zona (guardadas en UTC)
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class AnomalyDetector:
+    """Estado EWMA de los servidores de un líder (lo usa solo el hilo del monitor)"""
+    def __init__(self, metrics=ANOMALY_METRICS):
+        self.metrics = metrics
+        self._states = {}  # server_pk -> {metric: MetricState}
+        self._dirty = set()
+        self.last_checkpoint = time.monotonic()
+
+    def __len__(self):
+        return len(self._states)
+
+    def warm(self, server_pks):
+        """Carga de metric_baselines el estado de los servidores que aún no están en memoria"""
+        missing = [server_pk for server_pk in set(server_pks) if server_pk not in self._states]
+        for start in range(0, len(missing), ANOMALY_WARM_BATCH):
+            chunk = missing[start:start + ANOMALY_WARM_BATCH]
+            loaded = {server_pk: {} for server_pk in chunk}
+            with get_db_session(readonly=True) as session:
+                for baseline in session.query(MetricBaseline).filter(MetricBaseline.server_id.in_(chunk)):
+                    loaded[baseline.server_id][baseline.metric] = MetricState(
+                        baseline.mean,
+                        baseline.variance,
+                        baseline.samples,
+                        epoch_seconds(baseline.last_alert_at)
+                    )
+            self._states.update(loaded)
+
+    def observe(self, server_pk: int, values: dict, now: float = None) -> list:
+        """Actualiza el estado del servidor con una muestra y devuelve las anomalías"""
+        states = self._states.get(server_pk)
+        if states is None:
+            self.warm([server_pk])
+            states = self._states[server_pk]
+        now = time.time() if now is None else now
+        anomalies = []
+
+        for metric in self.metrics:
+            value = values.get(metric)
+            if value is None:
+                continue
+            state = states.get(metric)
+            if state is None:
+                state = states[metric] = MetricState()
+
+            expected = state.mean
+            z_score = state.update(float(value), ANOMALY_ALPHA)
+            if (state.samples > ANOMALY_WARMUP_SAMPLES
+                    and abs(z_score) >= ANOMALY_Z_THRESHOLD
+                    and now - state.last_alert >= ANOMALY_COOLDOWN_MINUTES * 60):
+                state.last_alert = now
+                anomalies.append({
+                    'metric': metric,
+                    'value': float(value),
+                    'expected': round(expected, 2),
+                    'z_score': round(z_score, 2)
+                })
+        self._dirty.add(server_pk)
+        return anomalies
+
+    def checkpoint(self) -> int:
+        """Guarda en lote el estado de los servidores modificados desde el último checkpoint"""
+        self.last_checkpoint = time.monotonic()
+        rows = [
+            {
+                'server_id': server_pk,
+                'metric': metric,
+                'mean': state.mean,
+                'variance': state.variance,
+                'samples': state.samples,
+                'last_alert_at': datetime.fromtimestamp(state.last_alert, timezone.utc) if state.last_alert else None
+            }
+            for server_pk in self._dirty
+            for metric, state in self._states.get(server_pk, {}).items()
+        ]
+        if not rows:
+            self._dirty.clear()
+            return 0
+
+        try:
+            with get_db_session() as session:
+                # Las filas nuevas se insertan; todas se actualizan por clave primaria (executemany)
+                insert_ignore(session, MetricBaseline, ['server_id', 'metric'], rows)
+                session.execute(update(MetricBaseline), rows)
+        except Exception as e:
+            logger.error(f"Error en checkpoint de anomalías: {e}")
+            return 0
+        count = len(self._dirty)
+        self._dirty.clear()
+        logger.debug(f"Checkpoint de anomalías: {count} servidores")
+        return count
+
+    def checkpoint_due(self) -> bool:
+        return time.monotonic() - self.last_checkpoint >= ANOMALY_CHECKPOINT_INTERVAL
+
+    def reset(self):
+        """Descarta el estado en memoria (el liderazgo pasó a otro proceso)"""
+        self._states = {}
+        self._dirty = set()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Archivo de Sync Data para FungiCloud
+Mueve las muestras más antiguas que ARCHIVE_AFTER_DAYS a segmentos comprimidos por servidor
+(almacenamiento frío) y combina segmentos y tabla caliente al leer el historial
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete
+from database import get_shard_session, shard_for_server, fan_out
+from models.sync_data import SyncData, SAMPLE_COLUMNS
+from models.archived_segment import ArchivedSegment
+from utils.timeseries_codec import encode_segment, read_header, read_segment
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_SEGMENT_DAYS = int(os.getenv('ARCHIVE_SEGMENT_DAYS', 30))  # días por segmento
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_DELETE_BATCH = 1000
+HEADER_CACHE_SIZE = 256
+INTEGER_COLUMNS = ('clients_total', 'clients_online', 'readings_count')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _to_us(value: datetime) -> int:
+    """Microsegundos desde epoch (exacto: la clave única incluye data_timestamp)"""
+    return (value.astimezone(timezone.utc) - EPOCH) // timedelta(microseconds=1)
+
+def _from_us(value: int) -> datetime:
+    return (EPOCH + timedelta(microseconds=value)).astimezone().replace(tzinfo=None)
+
+class LocalSegmentStore:
+    """Segmentos como archivos en disco (sustituto local de un object store)"""
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class SegmentArchive:
+    def __init__(self, store=None):
+        self.store = store or LocalSegmentStore()
+        self._headers = OrderedDict()  # storage_key -> cabecera (los segmentos son inmutables)
+        self._lock = threading.Lock()
+
+    def _header(self, key: str):
+        with self._lock:
+            header = self._headers.get(key)
+            if header is not None:
+                self._headers.move_to_end(key)
+                return header
+        header = read_header(lambda offset, length: self.store.read_range(key, offset, length))
+        with self._lock:
+            self._headers[key] = header
+            if len(self._headers) > HEADER_CACHE_SIZE:
+                self._headers.popitem(last=False)
+        return header
+
+    def archive_server(self, server_pk: int, cutoff: datetime) -> int:
+        """Archiva las muestras del servidor anteriores a cutoff; devuelve cuántas movió"""
+        with get_shard_session(shard_for_server(server_pk)) as session:
+            rows = session.execute(
+                select(SyncData.id, SyncData.user_id, SyncData.data_timestamp,
+                       *(getattr(SyncData, column) for column in SAMPLE_COLUMNS))
+                .where(SyncData.server_id == server_pk, SyncData.data_timestamp < cutoff)
+                .order_by(SyncData.data_timestamp)
+            ).all()
+            if not rows:
+                return 0
+
+            # Un segmento por ventana de ARCHIVE_SEGMENT_DAYS
+            window_us = ARCHIVE_SEGMENT_DAYS * 86400 * 10**6
+            groups = OrderedDict()
+            for row in rows:
+                groups.setdefault(_to_us(row.data_timestamp) // window_us, []).append(row)
+
+            written = []
+            try:
+                for group in groups.values():
+                    timestamps = [_to_us(row.data_timestamp) for row in group]
+                    columns = {column: [getattr(row, column) for row in group] for column in SAMPLE_COLUMNS}
+                    data = encode_segment(timestamps, columns, {'server_id': server_pk})
+                    key = (f"server_{server_pk}/{group[0].data_timestamp:%Y%m%dT%H%M%S}-"
+                           f"{group[-1].data_timestamp:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.fcs")
+                    self.store.put(key, data)
+                    written.append(key)
+                    session.add(ArchivedSegment(
+                        server_id=server_pk,
+                        user_id=group[0].user_id,
+                        start_time=group[0].data_timestamp,
+                        end_time=group[-1].data_timestamp,
+                        sample_count=len(group),
+                        storage_key=key,
+                        size_bytes=len(data)
+                    ))
+
+                # Borrar exactamente las filas archivadas (no las que lleguen mientras tanto)
+                ids = [row.id for row in rows]
+                for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+                    session.execute(delete(SyncData).where(SyncData.id.in_(ids[start:start + ARCHIVE_DELETE_BATCH])))
+                session.commit()
+            except Exception:
+                for key in written:
+                    self.store.delete(key)
+                raise
+
+        logger.info(f"Servidor {server_pk}: {len(rows)} muestras archivadas en {len(groups)} segmentos")
+        return len(rows)
+
+    def run(self, older_than_days: int = ARCHIVE_AFTER_DAYS, server_pk: int = None) -> dict:
+        """Archiva todos los servidores (o uno) con muestras más antiguas que el límite"""
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        if server_pk is not None:
+            server_pks = [server_pk]
+        else:
+            query = select(SyncData.server_id).where(SyncData.data_timestamp < cutoff).distinct()
+            server_pks = [pk for pks in fan_out(lambda session: session.execute(query).scalars().all()) for pk in pks]
+
+        archived = 0
+        failed = []
+        for pk in server_pks:
+            try:
+                archived += self.archive_server(pk, cutoff)
+            except Exception as e:
+                logger.error(f"Error archivando servidor {pk}: {e}")
+                failed.append(pk)
+        return {'cutoff': cutoff.isoformat(), 'servers': len(server_pks), 'samples': archived, 'failed': failed}
+
+    def read_history(self, server_pk: int, start: datetime, end: datetime) -> tuple:
+        """(muestras en [start, end) combinando segmentos y tabla caliente, segmentos leídos)"""
+        with get_shard_session(shard_for_server(server_pk), readonly=True) as session:
+            segment_keys = session.execute(
+                select(ArchivedSegment.storage_key)
+                .where(
+                    ArchivedSegment.server_id == server_pk,
+                    ArchivedSegment.start_time < end,
+                    ArchivedSegment.end_time >= start
+                )
+                .order_by(ArchivedSegment.start_time)
+            ).scalars().all()
+            hot_rows = session.execute(
+                select(SyncData.data_timestamp, *(getattr(SyncData, column) for column in SAMPLE_COLUMNS))
+                .where(
+                    SyncData.server_id == server_pk,
+                    SyncData.data_timestamp >= start,
+                    SyncData.data_timestamp < end
+                )
+                .order_by(SyncData.data_timestamp)
+            ).all()
+
+        samples = {}  # timestamp en µs -> valores (la tabla caliente tiene prioridad)
+        start_us, end_us = _to_us(start), _to_us(end)
+        for key in segment_keys:
+            read_range = lambda offset, length, key=key: self.store.read_range(key, offset, length)
+            for timestamp, values in read_segment(read_range, start_us, end_us, header=self._header(key)):
+                samples[timestamp] = values
+        for row in hot_rows:
+            samples[_to_us(row.data_timestamp)] = {column: getattr(row, column) for column in SAMPLE_COLUMNS}
+
+        history = []
+        for timestamp in sorted(samples):
+            values = samples[timestamp]
+            sample = {'data_timestamp': _from_us(timestamp).isoformat()}
+            for column in SAMPLE_COLUMNS:
+                value = values.get(column)
+                sample[column] = int(value) if value is not None and column in INTEGER_COLUMNS else value
+            history.append(sample)
+        return history, len(segment_keys)
+
+# Instancia global
+_segment_archive = None
+_archive_lock = threading.Lock()
+
+def get_segment_archive() -> SegmentArchive:
+    """Obtiene el archivo de segmentos"""
+    global _segment_archive
+    with _archive_lock:
+        if _segment_archive is None:
+            _segment_archive = SegmentArchive()
+    return _segment_archive
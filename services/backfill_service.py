@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Backfill para FungiCloud
+Inserta en lotes las muestras históricas que un servidor local acumuló sin conexión,
+con sus timestamps originales y a un ritmo acotado (token bucket) para no saturar la base
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from database import get_shard_session, shard_for_user, insert_ignore
+from models.sync_data import SyncData, SyncEvent, SYNC_DATA_KEY, BACKFILL_SAMPLE_SCHEMA
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', 500))
+BACKFILL_ROWS_PER_SECOND = float(os.getenv('BACKFILL_ROWS_PER_SECOND', 2000))  # por proceso
+BACKFILL_MAX_REQUEST_SECONDS = float(os.getenv('BACKFILL_MAX_REQUEST_SECONDS', 20))
+BACKFILL_MAX_AGE_DAYS = int(os.getenv('BACKFILL_MAX_AGE_DAYS', 30))
+MAX_CLOCK_SKEW = timedelta(minutes=5)  # tolerancia para relojes de dispositivo adelantados
+BACKFILL_MAX_ERRORS = 10  # muestras rechazadas cuyo detalle se devuelve al cliente
+
+def iter_ndjson(stream):
+    """Muestras de un cuerpo NDJSON (una por línea); None para líneas inválidas"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            sample = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield sample if isinstance(sample, dict) else None
+
+def sample_row(sample, server_pk: int, user_id: int, now: datetime):
+    """(fila de sync_data, None) para una muestra histórica, o (None, {campo: error})"""
+    data, errors = BACKFILL_SAMPLE_SCHEMA.check(sample)
+    if errors:
+        return None, errors
+    timestamp = data.pop('timestamp')
+    if timestamp > now + MAX_CLOCK_SKEW or timestamp < now - timedelta(days=BACKFILL_MAX_AGE_DAYS):
+        return None, {'timestamp': f"fuera de rango (últimos {BACKFILL_MAX_AGE_DAYS} días)"}
+    return {'server_id': server_pk, 'user_id': user_id, 'data_timestamp': timestamp, **data}, None
+
+class Backfill:
+    """Una carga de backfill: agrupa las filas en lotes y los inserta al ritmo del bucket"""
+    def __init__(self, server_pk: int, user_id: int, resume_after: datetime = None):
+        self.server_pk = server_pk
+        self.user_id = user_id
+        self.shard = shard_for_user(user_id)
+        self.resume_after = resume_after
+        self.last_timestamp = resume_after
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []  # [{'index': posición, 'fields': {campo: error}}] de las primeras rechazadas
+        self.skipped = 0
+        self.duplicates = 0
+        self.retry_after = 0.0
+        self.complete = False
+        self._started = time.monotonic()
+
+    def _rows(self, samples):
+        now = datetime.now()
+        for index, sample in enumerate(samples):
+            row, errors = sample_row(sample, self.server_pk, self.user_id, now)
+            if row is None:
+                self.rejected += 1
+                if len(self.errors) < BACKFILL_MAX_ERRORS:
+                    self.errors.append({'index': index, 'fields': errors})
+            elif self.resume_after is not None and row['data_timestamp'] <= self.resume_after:
+                self.skipped += 1  # ya insertada en un intento anterior
+            else:
+                yield row
+
+    def run(self, samples, ordered: bool = True) -> 'Backfill':
+        """Procesa las muestras hasta terminar o agotar el tiempo del request
+
+        Con ordered=True (streaming) las muestras deben llegar en orden cronológico,
+        porque el resume_token es el último timestamp insertado.
+        """
+        rows = self._rows(samples)
+        if not ordered:
+            rows = sorted(rows, key=lambda row: row['data_timestamp'])
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                if not self._flush(batch):
+                    return self
+                batch = []
+
+        if batch and not self._flush(batch):
+            return self
+        self.complete = True
+        if self.inserted:
+            self._record_event()
+        return self
+
+    def _flush(self, batch: list) -> bool:
+        """Inserta un lote si el bucket lo permite; False si hay que reanudar más tarde
+
+        No espera: el request ocupa un hueco de ingesta, así que al agotarse el ritmo (o el
+        tiempo del request) se corta y el cliente reanuda con resume_token tras Retry-After.
+        """
+        if time.monotonic() - self._started > BACKFILL_MAX_REQUEST_SECONDS:
+            wait = 1.0
+        else:
+            wait = get_backfill_bucket().acquire(len(batch))
+        if wait:
+            self.retry_after = wait
+            if self.inserted:
+                self._record_event()
+            return False
+
+        with get_shard_session(self.shard, consistency_key=self.user_id) as session:
+            # Las muestras ya presentes (reintentos, solapes con /sync/data) se ignoran
+            inserted = insert_ignore(session, SyncData, SYNC_DATA_KEY, batch)
+            session.commit()
+        self.inserted += inserted
+        self.duplicates += len(batch) - inserted
+        self.last_timestamp = max(self.last_timestamp or batch[0]['data_timestamp'],
+                                  max(row['data_timestamp'] for row in batch))
+        return True
+
+    def _record_event(self):
+        with get_shard_session(self.shard, consistency_key=self.user_id) as session:
+            session.add(SyncEvent(
+                server_id=self.server_pk,
+                event_type='sync_backfill',
+                message=f'Backfill - {self.inserted} muestras históricas',
+                event_metadata={
+                    'inserted': self.inserted,
+                    'duplicates': self.duplicates,
+                    'rejected': self.rejected,
+                    'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp else None
+                }
+            ))
+            session.commit()
+
+# Instancia global (el ritmo se limita por proceso)
+_backfill_bucket = None
+_bucket_lock = threading.Lock()
+
+def get_backfill_bucket() -> TokenBucket:
+    """Obtiene el token bucket de filas de backfill"""
+    global _backfill_bucket
+    with _bucket_lock:
+        if _backfill_bucket is None:
+            _backfill_bucket = TokenBucket(BACKFILL_ROWS_PER_SECOND, max(BACKFILL_ROWS_PER_SECOND, BACKFILL_BATCH_SIZE))
+    return _backfill_bucket
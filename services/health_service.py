@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Salud para FungiCloud
+Chequeos de saturación para el balanceador: uso de los pools de conexiones, huecos de
+ingesta, cola de webhooks, edad del último escaneo del monitor de alertas y latencia
+de un ping a la base. /ready los evalúa contra umbrales configurables y responde 503
+al cruzar alguno, para que el balanceador saque al worker antes de que las requests
+empiecen a agotar su timeout; /health/deep agrega réplicas, shards y la cola de logs.
+"""
+import logging
+import os
+import threading
+import time
+from sqlalchemy import text
+from database import SHARD_URLS, get_database_url, get_health_engine, pool_usage
+from services.admission_service import get_admission_controller
+from services.alert_service import alert_monitor_status
+from services.webhook_service import webhook_backlog
+from utils.logging_config import logging_stats, LOG_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+READY_MAX_POOL_USAGE = float(os.getenv('READY_MAX_POOL_USAGE', 0.9))  # fracción de conexiones en uso
+READY_MAX_INGEST_WAITING = float(os.getenv('READY_MAX_INGEST_WAITING', 0.5))  # requests en espera / huecos
+READY_MAX_WEBHOOK_BACKLOG = int(os.getenv('READY_MAX_WEBHOOK_BACKLOG', 500))  # eventos en cola
+READY_MAX_ALERT_SCAN_AGE = float(os.getenv('READY_MAX_ALERT_SCAN_AGE', 120))  # segundos
+READY_MAX_DB_LATENCY = float(os.getenv('READY_MAX_DB_LATENCY', 0.5))  # segundos
+READY_MAX_LOG_QUEUE_USAGE = float(os.getenv('READY_MAX_LOG_QUEUE_USAGE', 0.9))  # fracción de LOG_QUEUE_SIZE
+
+_last_ready = True
+_state_lock = threading.Lock()
+
+def check_pools(include_replicas: bool = False) -> dict:
+    """Uso de cada pool; falla si alguno supera READY_MAX_POOL_USAGE"""
+    pools = pool_usage(include_replicas)
+    return {
+        'ok': all(pool['usage'] < READY_MAX_POOL_USAGE for pool in pools.values()),
+        'threshold': READY_MAX_POOL_USAGE,
+        'pools': pools
+    }
+
+def check_ingest() -> dict:
+    """Requests esperando un hueco de ingesta (todos los huecos ocupados sin cola es sano)"""
+    stats = get_admission_controller().stats()
+    waiting = stats['waiting'] / stats['slots']
+    return {'ok': waiting < READY_MAX_INGEST_WAITING, 'usage': round(stats['in_flight'] / stats['slots'], 3),
+            'waiting_ratio': round(waiting, 3), 'threshold': READY_MAX_INGEST_WAITING, **stats}
+
+def check_webhooks() -> dict:
+    """Eventos de Stripe en cola en este proceso"""
+    backlog = webhook_backlog()
+    return {'ok': backlog < READY_MAX_WEBHOOK_BACKLOG, 'backlog': backlog,
+            'threshold': READY_MAX_WEBHOOK_BACKLOG}
+
+def check_alert_monitor() -> dict:
+    """Monitor de alertas embebido: vivo y con un escaneo reciente (ok si corre en alert_worker.py)"""
+    status = alert_monitor_status()
+    if status is None:
+        return {'ok': True, 'embedded': False}
+    age = status['last_scan_age']
+    ok = status['alive'] and (age is None or age < READY_MAX_ALERT_SCAN_AGE)
+    return {'ok': ok, 'embedded': True, 'threshold': READY_MAX_ALERT_SCAN_AGE, **status}
+
+def ping(database_url: str) -> dict:
+    """SELECT 1 por un pool propio; falla si no responde o tarda más de READY_MAX_DB_LATENCY"""
+    start = time.perf_counter()
+    try:
+        with get_health_engine(database_url).connect() as conn:
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        return {'ok': False, 'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+                'error': str(e).splitlines()[0][:200]}
+    latency = time.perf_counter() - start
+    return {'ok': latency < READY_MAX_DB_LATENCY, 'latency_ms': round(latency * 1000, 1),
+            'threshold_ms': READY_MAX_DB_LATENCY * 1000}
+
+def check_logging() -> dict:
+    """Cola del logging no bloqueante y registros descartados"""
+    stats = logging_stats()
+    usage = stats['queued'] / max(1, LOG_QUEUE_SIZE)
+    return {'ok': usage < READY_MAX_LOG_QUEUE_USAGE, 'usage': round(usage, 3), **stats}
+
+def readiness(deep: bool = False) -> tuple:
+    """(listo, chequeos); deep agrega réplicas, un ping por shard y la cola de logs"""
+    global _last_ready
+    checks = {
+        'db_pool': check_pools(include_replicas=deep),
+        'ingest': check_ingest(),
+        'webhooks': check_webhooks(),
+        'alert_monitor': check_alert_monitor(),
+        'database': ping(get_database_url())
+    }
+    if deep:
+        for index, url in enumerate(SHARD_URLS):
+            checks[f"shard-{index}"] = ping(url)
+        checks['logging'] = check_logging()
+
+    ready = all(check['ok'] for check in checks.values())
+    with _state_lock:
+        changed = ready != _last_ready
+        _last_ready = ready
+    if changed:
+        failing = sorted(name for name, check in checks.items() if not check['ok'])
+        if ready:
+            logger.info("Worker listo de nuevo")
+        else:
+            logger.warning("Worker saturado: %s", ', '.join(failing))
+    return ready, checks
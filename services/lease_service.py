@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Leases para FungiCloud
+Elección de líder mediante una fila con expiración en la base de datos
+(funciona igual con varios workers de gunicorn y varios nodos)
+"""
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from database import get_db_session
+from models.monitor_lease import MonitorLease
+
+logger = logging.getLogger(__name__)
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+class Lease:
+    def __init__(self, name: str, ttl_seconds: int):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    
+    def acquire(self) -> bool:
+        """Adquiere o renueva el lease; True si este proceso es el líder"""
+        now = _utcnow()
+        with get_db_session() as session:
+            updated = session.query(MonitorLease).filter(
+                MonitorLease.name == self.name,
+                or_(MonitorLease.holder == self.holder, MonitorLease.expires_at < now)
+            ).update(
+                {MonitorLease.holder: self.holder, MonitorLease.expires_at: now + self.ttl},
+                synchronize_session=False
+            )
+            if updated:
+                return True
+            
+            if session.get(MonitorLease, self.name) is not None:
+                return False
+            
+            # Primera vez: crear la fila (otro proceso puede ganar la carrera)
+            try:
+                session.add(MonitorLease(name=self.name, holder=self.holder, expires_at=now + self.ttl))
+                session.flush()
+                return True
+            except IntegrityError:
+                session.rollback()
+                return False
+    
+    def release(self):
+        """Libera el lease si este proceso lo tiene"""
+        try:
+            with get_db_session() as session:
+                session.query(MonitorLease).filter_by(
+                    name=self.name,
+                    holder=self.holder
+                ).update({MonitorLease.expires_at: _utcnow()}, synchronize_session=False)
+        except Exception as e:
+            logger.error(f"Error liberando lease {self.name}: {e}")
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Rebalanceo de Shards para FungiCloud
+Mueve las series de tiempo de un usuario (sync_data, sync_events, archived_segments)
+de su shard actual a otro, sin detener la ingesta:
+
+1. Copia las filas existentes hasta una marca de id por tabla
+2. Reasigna el usuario en shard_assignments (las escrituras nuevas van al destino)
+3. Espera a que expire la caché de asignaciones de los demás procesos
+4. Vuelve a copiar todo hasta la marca final (inserción que ignora lo ya copiado) y
+   borra del origen lo copiado
+
+Las tres tablas tienen clave natural: repetir una copia interrumpida no duplica filas.
+También importa a los shards los datos que quedaron en la base central de antes de
+configurar SYNC_SHARD_URLS.
+"""
+import logging
+import time
+from sqlalchemy import select, delete, func, inspect
+from database import (
+    get_db_session, get_engine, get_shard_session, shard_count, shard_for_user, set_user_shard, insert_ignore,
+    fan_out, SHARD_ASSIGNMENT_TTL
+)
+from models.local_server import LocalServer
+from models.shard_assignment import ShardAssignment
+from models.sync_data import SyncData, SyncEvent, SYNC_DATA_KEY, SYNC_EVENT_KEY
+from models.archived_segment import ArchivedSegment
+
+logger = logging.getLogger(__name__)
+
+REBALANCE_BATCH_SIZE = 5000
+REBALANCE_GRACE_MARGIN = 5  # segundos sumados al TTL de la caché de asignaciones
+CENTRAL = -1  # origen: tablas de series de tiempo en la base central (antes de usar shards)
+
+# Tablas por mover y su clave natural
+TENANT_TABLES = (
+    (SyncData, SYNC_DATA_KEY),
+    (SyncEvent, SYNC_EVENT_KEY),
+    (ArchivedSegment, ('storage_key',))
+)
+
+def current_shard(user_id: int) -> int:
+    """Shard asignado al usuario según la base central (sin caché)"""
+    with get_db_session() as session:
+        shard = session.query(ShardAssignment.shard).filter_by(user_id=user_id).scalar()
+    return shard if shard is not None else user_id % shard_count()
+
+def _tenant_servers(user_id: int) -> list:
+    with get_db_session(readonly=True) as session:
+        return session.execute(select(LocalServer.id).where(LocalServer.user_id == user_id)).scalars().all()
+
+def _session(shard: int, readonly: bool = False):
+    if shard == CENTRAL:
+        return get_db_session(readonly)
+    return get_shard_session(shard, readonly)
+
+def _copy_rows(model, natural_key, server_pks: list, source: int, target: int, after_id: int, until_id: int) -> int:
+    """Copia las filas del usuario con after_id < id <= until_id; devuelve cuántas insertó"""
+    columns = [column for column in model.__table__.columns if column.name != 'id']
+    copied = 0
+    while True:
+        with _session(source, readonly=True) as session:
+            rows = session.execute(
+                select(model.__table__.c.id, *columns)
+                .where(model.server_id.in_(server_pks), model.id > after_id, model.id <= until_id)
+                .order_by(model.id)
+                .limit(REBALANCE_BATCH_SIZE)
+            ).all()
+        if not rows:
+            return copied
+        batch = [{column.name: row[index + 1] for index, column in enumerate(columns)} for row in rows]
+        with get_shard_session(target) as session:
+            copied += insert_ignore(session, model, natural_key, batch)
+            session.commit()
+        after_id = rows[-1].id
+
+def _max_id(model, server_pks: list, shard: int) -> int:
+    with _session(shard, readonly=True) as session:
+        return session.execute(select(func.max(model.id)).where(model.server_id.in_(server_pks))).scalar() or 0
+
+def move_tenant(user_id: int, target: int, grace: float = None) -> dict:
+    """Mueve las series de tiempo de un usuario al shard target"""
+    if not 0 <= target < shard_count():
+        raise ValueError(f"Shard inválido: {target} (hay {shard_count()})")
+    if grace is not None and grace < SHARD_ASSIGNMENT_TTL:
+        # Con menos espera otro proceso puede seguir escribiendo en el origen después del borrado
+        raise ValueError(f"La espera ({grace} s) no puede ser menor que SYNC_SHARD_ASSIGNMENT_TTL ({SHARD_ASSIGNMENT_TTL} s)")
+    source = current_shard(user_id)
+    if source == target:
+        return {'user_id': user_id, 'source': source, 'target': target, 'moved': {}}
+
+    server_pks = _tenant_servers(user_id)
+    moved = {model.__tablename__: 0 for model, _ in TENANT_TABLES}
+    if server_pks:
+        # 1. Copia inicial hasta la marca de cada tabla
+        for model, natural_key in TENANT_TABLES:
+            mark = _max_id(model, server_pks, source)
+            moved[model.__tablename__] += _copy_rows(model, natural_key, server_pks, source, target, 0, mark)
+
+    # 2-3. Reasignar y esperar a que los demás procesos dejen de escribir en el origen
+    set_user_shard(user_id, target)
+    if server_pks:
+        time.sleep(SHARD_ASSIGNMENT_TTL + REBALANCE_GRACE_MARGIN if grace is None else grace)
+
+        # 4. Copiar todo hasta la marca final y borrar lo copiado del origen: una transacción
+        # que obtuvo su id antes de la marca inicial puede haber confirmado después de la copia
+        for model, natural_key in TENANT_TABLES:
+            final_mark = _max_id(model, server_pks, source)
+            moved[model.__tablename__] += _copy_rows(model, natural_key, server_pks, source, target, 0, final_mark)
+            with _session(source) as session:
+                session.execute(delete(model).where(model.server_id.in_(server_pks), model.id <= final_mark))
+                session.commit()
+
+    logger.info(f"Usuario {user_id} movido del shard {source} al {target}: {moved}")
+    return {'user_id': user_id, 'source': source, 'target': target, 'moved': moved}
+
+def import_central(user_id: int) -> dict:
+    """Copia al shard del usuario sus datos de la base central (previos a los shards) y los borra de ella"""
+    target = shard_for_user(user_id)
+    server_pks = _tenant_servers(user_id)
+    moved = {model.__tablename__: 0 for model, _ in TENANT_TABLES}
+    for model, natural_key in TENANT_TABLES:
+        if not server_pks:
+            break
+        mark = _max_id(model, server_pks, CENTRAL)
+        moved[model.__tablename__] = _copy_rows(model, natural_key, server_pks, CENTRAL, target, 0, mark)
+        with _session(CENTRAL) as session:
+            session.execute(delete(model).where(model.server_id.in_(server_pks), model.id <= mark))
+            session.commit()
+    logger.info(f"Usuario {user_id} importado de la base central al shard {target}: {moved}")
+    return {'user_id': user_id, 'source': CENTRAL, 'target': target, 'moved': moved}
+
+def central_tenants() -> list:
+    """Usuarios con series de tiempo todavía en la base central"""
+    if not inspect(get_engine()).has_table(SyncData.__tablename__):
+        return []
+    with get_db_session(readonly=True) as session:
+        return session.execute(select(SyncData.user_id).distinct()).scalars().all()
+
+def shard_stats() -> list:
+    """Usuarios asignados y muestras por shard"""
+    with get_db_session(readonly=True) as session:
+        assigned = dict(session.execute(
+            select(ShardAssignment.shard, func.count(ShardAssignment.user_id)).group_by(ShardAssignment.shard)
+        ).all())
+    samples = fan_out(lambda session: session.execute(select(func.count(SyncData.id))).scalar() or 0)
+    return [
+        {'shard': shard, 'users': assigned.get(shard, 0), 'samples': count}
+        for shard, count in enumerate(samples)
+    ]
+
+def heaviest_tenants(shard: int, limit: int = 10) -> list:
+    """(user_id, muestras) de los usuarios con más datos en un shard"""
+    with get_shard_session(shard, readonly=True) as session:
+        return [tuple(row) for row in session.execute(
+            select(SyncData.user_id, func.count(SyncData.id))
+            .group_by(SyncData.user_id)
+            .order_by(func.count(SyncData.id).desc())
+            .limit(limit)
+        ).all()]
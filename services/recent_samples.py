@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Buffer de Muestras Recientes para FungiCloud
+Ring buffer en memoria (arrays float32 preasignados) con las últimas N muestras
+de cada servidor, para servir el historial reciente del dashboard sin consultar el shard.
+
+Cada worker tiene su propio buffer y no ve los syncs que atienden los demás: cada fila
+guarda el last_sync_at del servidor que ya incorpora, y get() la descarta si la base
+tiene uno más nuevo (otro worker recibió datos desde entonces).
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from models.sync_data import SAMPLE_COLUMNS
+from utils.lazy_import import LazyModule, module_available
+
+logger = logging.getLogger(__name__)
+
+NUMPY_AVAILABLE = module_available('numpy')
+if not NUMPY_AVAILABLE:
+    logger.warning("NumPy no instalado, buffer de muestras recientes deshabilitado")
+np = LazyModule('numpy')  # se importa en el primer cálculo
+
+RECENT_BUFFER_SLOTS = int(os.getenv('RECENT_BUFFER_SLOTS', 96))  # 24 h a 15 min
+RECENT_BUFFER_MAX_SERVERS = int(os.getenv('RECENT_BUFFER_MAX_SERVERS', 10000))
+RECENT_BUFFER_SETTLE_SECONDS = 10  # tras un sync, lo que tarda en llegar su muestra al shard
+BUFFER_METRICS = SAMPLE_COLUMNS
+
+class RecentSamplesBuffer:
+    """Slab de tamaño fijo: max_servers x slots x métricas (memoria acotada)
+
+    Un servidor ocupa una fila solo después de calentarse desde la base de datos;
+    la ingesta agrega muestras a filas ya residentes y se desaloja por LRU.
+    """
+    def __init__(self, slots: int = RECENT_BUFFER_SLOTS, max_servers: int = RECENT_BUFFER_MAX_SERVERS):
+        self.slots = slots
+        self.max_servers = max_servers
+        self.values = None
+        self.timestamps = None
+        self.heads = None
+        self.counts = None
+        self.synced = None
+        self._rows = OrderedDict()  # server_pk -> (fila, user_id), en orden LRU
+        self._free = []
+        self._lock = threading.Lock()
+
+    def _allocate(self):
+        """Reserva el slab (np.zeros: el SO solo asigna las páginas que se usan)"""
+        if self.values is None:
+            self.values = np.zeros((self.max_servers, self.slots, len(BUFFER_METRICS)), dtype=np.float32)
+            self.timestamps = np.zeros((self.max_servers, self.slots), dtype=np.float64)
+            self.heads = np.zeros(self.max_servers, dtype=np.int32)
+            self.counts = np.zeros(self.max_servers, dtype=np.int32)
+            self.synced = np.zeros(self.max_servers, dtype=np.float64)  # last_sync_at incorporado (epoch)
+            self._free = list(range(self.max_servers - 1, -1, -1))
+
+    def memory_bytes(self) -> int:
+        """Memoria máxima del slab"""
+        return self.max_servers * self.slots * (len(BUFFER_METRICS) * 4 + 8) + self.max_servers * 16
+
+    def _write(self, row: int, timestamp: float, values: dict):
+        head = self.heads[row]
+        self.timestamps[row, head] = timestamp
+        self.values[row, head] = [
+            np.nan if values.get(metric) is None else values[metric]
+            for metric in BUFFER_METRICS
+        ]
+        self.heads[row] = (head + 1) % self.slots
+        self.counts[row] = min(self.counts[row] + 1, self.slots)
+
+    def append(self, server_pk: int, timestamp: float, values: dict, synced_at: float):
+        """Agrega una muestra si el servidor ya está residente (no calienta)
+
+        synced_at: last_sync_at escrito por el sync que trae la muestra
+        """
+        with self._lock:
+            entry = self._rows.get(server_pk)
+            if entry is None:
+                return
+            row = entry[0]
+            newest = self.timestamps[row, (self.heads[row] - 1) % self.slots] if self.counts[row] else 0
+            if timestamp < newest:
+                # Muestra fuera de orden: recalentar en la próxima lectura
+                self._evict(server_pk)
+                return
+            self._write(row, timestamp, values)
+            if self.synced[row]:  # 0 = cargada sin asentar: puede faltarle un sync de otro worker
+                self.synced[row] = max(self.synced[row], synced_at)
+            self._rows.move_to_end(server_pk)
+
+    def warm(self, server_pk: int, user_id: int, samples: list, synced_at: float):
+        """Carga las muestras (ordenadas por timestamp ascendente) de un servidor
+
+        synced_at: last_sync_at leído antes de consultar las muestras
+        """
+        with self._lock:
+            self._allocate()
+            if server_pk in self._rows:
+                self._evict(server_pk)
+            if not self._free:
+                oldest = next(iter(self._rows))
+                self._evict(oldest)
+            row = self._free.pop()
+            self.heads[row] = 0
+            self.counts[row] = 0
+            self.synced[row] = synced_at
+            for timestamp, values in samples[-self.slots:]:
+                self._write(row, timestamp, values)
+            self._rows[server_pk] = (row, user_id)
+
+    def invalidate(self, server_pk: int):
+        with self._lock:
+            if server_pk in self._rows:
+                self._evict(server_pk)
+
+    def _evict(self, server_pk: int):
+        row, _ = self._rows.pop(server_pk)
+        self._free.append(row)
+
+    def get(self, server_pk: int, since: float, synced_at: float):
+        """(user_id, muestras desde since) si el servidor está residente y al día con synced_at, o None"""
+        with self._lock:
+            entry = self._rows.get(server_pk)
+            if entry is None:
+                return None
+            row, user_id = entry
+            if self.synced[row] < synced_at:
+                # Otro worker recibió syncs (o un backfill) que esta fila no tiene
+                self._evict(server_pk)
+                return None
+            self._rows.move_to_end(server_pk)
+            count = int(self.counts[row])
+            order = (np.arange(self.heads[row] - count, self.heads[row])) % self.slots
+            timestamps = self.timestamps[row, order]
+            values = self.values[row, order]
+
+        keep = timestamps >= since
+        samples = []
+        for timestamp, row_values in zip(timestamps[keep], values[keep]):
+            sample = {'data_timestamp': datetime.fromtimestamp(timestamp).isoformat()}
+            for metric, value in zip(BUFFER_METRICS, row_values.tolist()):
+                sample[metric] = None if value != value else round(value, 3)
+            samples.append(sample)
+        return user_id, samples
+
+# Instancia global
+_recent_buffer = None
+
+def get_recent_buffer() -> RecentSamplesBuffer:
+    """Obtiene el buffer de muestras recientes"""
+    global _recent_buffer
+    if _recent_buffer is None:
+        _recent_buffer = RecentSamplesBuffer()
+    return _recent_buffer
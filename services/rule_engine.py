@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de Reglas de Alerta para FungiCloud
+Compila las reglas de cada usuario en un índice servidor -> métrica -> reglas, de modo
+que cada muestra solo se compara con las reglas que le aplican. Las ventanas de duración
+("durante 30 minutos") se siguen con el timestamp de las muestras.
+
+Como el detector de anomalías, el motor vive en el líder del monitor de alertas de cada
+shard (services.sample_feed): las ventanas están en memoria, por (regla, servidor), y solo
+se guardan en alert_rule_windows al abrirse, dispararse o cerrarse, en lote por lectura,
+para que un líder nuevo continúe los episodios en curso. Antes de evaluar un lote se
+compara users.alert_rules_version de sus usuarios (una consulta) y se recompilan los que
+cambiaron: una regla modificada desde la API aplica en la lectura siguiente.
+"""
+import logging
+import operator
+import os
+from collections import OrderedDict
+from sqlalchemy import delete, tuple_, update
+from database import get_db_session, insert_ignore
+from models.alert_rule import AlertRule, AlertRuleWindow
+from models import queries
+
+logger = logging.getLogger(__name__)
+
+ALERT_RULES_CACHE_USERS = int(os.getenv('ALERT_RULES_CACHE_USERS', 10000))
+RULE_WINDOWS_WARM_BATCH = 500  # servidores por consulta al cargar ventanas
+
+COMPARATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+class CompiledRule:
+    """Regla lista para evaluar"""
+    __slots__ = ('id', 'server_id', 'name', 'metric', 'operator', 'threshold', 'duration', 'compare')
+
+    def __init__(self, rule: AlertRule):
+        self.id = rule.id
+        self.server_id = rule.server_id
+        self.name = rule.name
+        self.metric = rule.metric
+        self.operator = rule.operator
+        self.threshold = rule.threshold
+        self.duration = (rule.duration_minutes or 0) * 60
+        self.compare = COMPARATORS[rule.operator]
+
+    @property
+    def definition(self) -> tuple:
+        return (self.server_id, self.metric, self.operator, self.threshold, self.duration)
+
+    def matches(self, value: float) -> bool:
+        return self.compare(value, self.threshold)
+
+class RuleIndex:
+    """Reglas de un usuario: {server_pk o None (todos): {métrica: [CompiledRule]}}"""
+    def __init__(self, rules: list, version: int):
+        self.version = version
+        self.by_server = {}
+        self.rules = {}
+        for rule in rules:
+            self.by_server.setdefault(rule.server_id, {}).setdefault(rule.metric, []).append(rule)
+            self.rules[rule.id] = rule
+
+    def matching(self, server_pk: int, metric: str) -> list:
+        return self.by_server.get(server_pk, {}).get(metric, []) + self.by_server.get(None, {}).get(metric, [])
+
+class RuleEngine:
+    """Reglas y ventanas de los servidores de un líder (lo usa solo el hilo del monitor)"""
+    def __init__(self):
+        self._indexes = OrderedDict()  # user_id -> RuleIndex, en orden LRU
+        self._windows = {}  # (rule_id, server_pk) -> [inicio del incumplimiento, ya alertada]
+        self._warmed = set()  # servidores con ventanas ya cargadas de la base
+        self._changes = {}  # (rule_id, server_pk) -> ventana a guardar, o None para borrarla
+
+    def __len__(self):
+        return len(self._windows)
+
+    def refresh(self, user_ids):
+        """Recompila los índices de los usuarios sin cargar o con reglas modificadas"""
+        user_ids = list(set(user_ids))
+        with get_db_session(readonly=True) as session:
+            versions = dict(session.execute(queries.RULES_VERSIONS, {'user_ids': user_ids}).all())
+        stale = {
+            user_id: version or 0 for user_id, version in versions.items()
+            if user_id not in self._indexes or self._indexes[user_id].version != (version or 0)
+        }
+        if stale:
+            with get_db_session(readonly=True) as session:
+                rules = session.query(AlertRule).filter(AlertRule.user_id.in_(stale), AlertRule.enabled.is_(True)).all()
+                compiled = {user_id: [] for user_id in stale}
+                for rule in rules:
+                    compiled[rule.user_id].append(CompiledRule(rule))
+            for user_id, version in stale.items():
+                self._replace(user_id, RuleIndex(compiled[user_id], version))
+        for user_id in user_ids:
+            if user_id in self._indexes:
+                self._indexes.move_to_end(user_id)
+
+    def _replace(self, user_id: int, index: RuleIndex):
+        previous = self._indexes.get(user_id)
+        if previous is not None:
+            # Las reglas borradas o con otra condición empiezan de cero
+            self._drop_rules(rule_id for rule_id, rule in previous.rules.items()
+                             if rule_id not in index.rules or index.rules[rule_id].definition != rule.definition)
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        if len(self._indexes) > ALERT_RULES_CACHE_USERS:
+            _, evicted = self._indexes.popitem(last=False)
+            self._evict(evicted)
+
+    def _drop_rules(self, rule_ids):
+        rule_ids = set(rule_ids)
+        if not rule_ids:
+            return
+        # También se borran de la base: un flush previo pudo reescribir una fila que la API ya había borrado
+        keys = {key for key in self._windows if key[0] in rule_ids} | {key for key in self._changes if key[0] in rule_ids}
+        for key in keys:
+            self._windows.pop(key, None)
+            self._changes[key] = None
+
+    def _evict(self, index: RuleIndex):
+        """Al volver, el usuario se recompila y sus servidores recargan las ventanas guardadas"""
+        evicted = [key for key in self._windows if key[0] in index.rules]
+        if any(key in self._changes for key in evicted):
+            self.flush()
+        for key in evicted:
+            self._windows.pop(key, None)
+            self._warmed.discard(key[1])
+
+    def warm(self, server_pks):
+        """Carga de alert_rule_windows los episodios en curso de servidores nuevos para este líder"""
+        missing = [server_pk for server_pk in set(server_pks) if server_pk not in self._warmed]
+        for start in range(0, len(missing), RULE_WINDOWS_WARM_BATCH):
+            chunk = missing[start:start + RULE_WINDOWS_WARM_BATCH]
+            with get_db_session(readonly=True) as session:
+                for window in session.query(AlertRuleWindow).filter(AlertRuleWindow.server_id.in_(chunk)):
+                    self._windows.setdefault((window.rule_id, window.server_id), [window.started_at, window.alerted])
+            self._warmed.update(chunk)
+
+    def evaluate(self, user_id: int, server_pk: int, timestamp: float, values: dict) -> list:
+        """Reglas disparadas por una muestra (solo se evalúan las de su servidor y métricas)"""
+        index = self._indexes.get(user_id)
+        if index is None or not index.rules:
+            return []
+
+        fired = []
+        for metric, value in values.items():
+            if value is None:
+                continue
+            value = float(value)
+            for rule in index.matching(server_pk, metric):
+                if self._check(rule, server_pk, timestamp, value):
+                    fired.append({
+                        'rule_id': rule.id,
+                        'name': rule.name,
+                        'metric': metric,
+                        'operator': rule.operator,
+                        'threshold': rule.threshold,
+                        'duration_minutes': rule.duration // 60,
+                        'value': value
+                    })
+        return fired
+
+    def _check(self, rule: CompiledRule, server_pk: int, timestamp: float, value: float) -> bool:
+        """Abre, cierra o dispara la ventana; True cuando la condición se sostuvo lo suficiente"""
+        key = (rule.id, server_pk)
+        window = self._windows.get(key)
+        if not rule.matches(value):
+            if window is not None:
+                # La condición se cortó: se rearma
+                del self._windows[key]
+                self._changes[key] = None
+            return False
+        if window is None:
+            window = self._windows[key] = [timestamp, False]
+            self._changes[key] = window
+        if window[1] or timestamp - window[0] < rule.duration:
+            return False
+        window[1] = True  # una alerta por episodio
+        self._changes[key] = window
+        return True
+
+    def flush(self) -> int:
+        """Guarda en una transacción las ventanas abiertas, disparadas o cerradas desde el último flush"""
+        if not self._changes:
+            return 0
+        rows = [
+            {'rule_id': rule_id, 'server_id': server_pk, 'started_at': window[0], 'alerted': window[1]}
+            for (rule_id, server_pk), window in self._changes.items() if window is not None
+        ]
+        closed = [key for key, window in self._changes.items() if window is None]
+        try:
+            with get_db_session() as session:
+                if closed:
+                    session.execute(delete(AlertRuleWindow).where(
+                        tuple_(AlertRuleWindow.rule_id, AlertRuleWindow.server_id).in_(closed)))
+                if rows:
+                    insert_ignore(session, AlertRuleWindow, ['rule_id', 'server_id'], rows)
+                    session.execute(update(AlertRuleWindow), rows)
+        except Exception as e:
+            logger.error(f"Error guardando ventanas de reglas: {e}")
+            return 0
+        count = len(self._changes)
+        self._changes = {}
+        return count
+
+    def reset(self):
+        """Descarta el estado en memoria (el liderazgo pasó a otro proceso)"""
+        self._indexes = OrderedDict()
+        self._windows = {}
+        self._warmed = set()
+        self._changes = {}
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura incremental de muestras para FungiCloud
+El líder del monitor de alertas de cada shard es el único dueño del estado en memoria de
+sus servidores (EWMA de anomalías y ventanas de reglas). Los syncs caen en cualquier worker,
+así que el líder lee las muestras nuevas de sync_data por received_at, en cada shard de series
+de tiempo, cada SAMPLE_FEED_INTERVAL segundos: la ingesta no hace ese trabajo ni abre otra sesión.
+
+Cada lectura repite los últimos SAMPLE_FEED_OVERLAP segundos (transacciones que confirman
+tarde) y descarta por servidor las muestras con timestamp no posterior al último entregado.
+Al ganar el liderazgo se empieza por las muestras que lleguen desde ese momento.
+"""
+import logging
+import os
+from datetime import timedelta
+from sqlalchemy import select, func
+from database import get_shard_session, shard_count
+from models.sync_data import SyncData
+from services.anomaly_service import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FEED_INTERVAL = float(os.getenv('SAMPLE_FEED_INTERVAL', 30))  # segundos entre lecturas
+SAMPLE_FEED_OVERLAP = float(os.getenv('SAMPLE_FEED_OVERLAP', 60))  # segundos releídos en cada lectura
+SAMPLE_FEED_BATCH = int(os.getenv('SAMPLE_FEED_BATCH', 20000))  # filas por shard y lectura
+
+class Sample:
+    """Muestra nueva de un servidor"""
+    __slots__ = ('server_pk', 'user_id', 'timestamp', 'values')
+
+    def __init__(self, server_pk: int, user_id: int, timestamp: float, values: dict):
+        self.server_pk = server_pk
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.values = values
+
+class SampleFeed:
+    """Muestras nuevas de los servidores con id % shard_count == shard_index"""
+    def __init__(self, metrics, shard_index: int = 0, shard_count: int = 1):
+        self.metrics = tuple(metrics)
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self._cursors = None  # received_at más reciente leído en cada shard de datos
+        self._delivered = {}  # server_pk -> timestamp (epoch) de la última muestra entregada
+
+    def reset(self):
+        self._cursors = None
+        self._delivered = {}
+
+    def poll(self) -> list:
+        """Muestras llegadas desde la lectura anterior, en orden de llegada"""
+        if self._cursors is None:
+            # Lo ya llegado lo procesó el líder anterior: solo se marca como entregado
+            self._cursors = [self._latest(shard) for shard in range(shard_count())]
+            for shard in range(shard_count()):
+                self._read(shard)
+            return []
+        samples = []
+        for shard in range(shard_count()):
+            samples.extend(self._read(shard))
+        return samples
+
+    def _owned(self, query):
+        if self.shard_count > 1:
+            query = query.where(SyncData.server_id % self.shard_count == self.shard_index)
+        return query
+
+    def _latest(self, shard: int):
+        with get_shard_session(shard, readonly=True) as session:
+            return session.execute(self._owned(select(func.max(SyncData.received_at)))).scalar()
+
+    def _read(self, shard: int) -> list:
+        cursor = self._cursors[shard]
+        query = select(
+            SyncData.server_id, SyncData.user_id, SyncData.data_timestamp, SyncData.received_at,
+            *(SyncData.__table__.c[metric] for metric in self.metrics)
+        )
+        if cursor is not None:
+            query = query.where(SyncData.received_at >= cursor - timedelta(seconds=SAMPLE_FEED_OVERLAP))
+        query = self._owned(query).order_by(SyncData.received_at).limit(SAMPLE_FEED_BATCH)
+        with get_shard_session(shard, readonly=True) as session:
+            rows = session.execute(query).all()
+        if len(rows) == SAMPLE_FEED_BATCH:
+            logger.warning("Lectura de muestras truncada en el shard %s (%s filas)", shard, SAMPLE_FEED_BATCH)
+        # Un lote de backfill llega con el mismo received_at: en orden de timestamp dentro de él
+        rows.sort(key=lambda row: (row.received_at, row.data_timestamp))
+
+        samples = []
+        for row in rows:
+            timestamp = epoch_seconds(row.data_timestamp)
+            if timestamp <= self._delivered.get(row.server_id, float('-inf')):
+                continue  # releída por el solapamiento, o anterior a la última (backfill)
+            self._delivered[row.server_id] = timestamp
+            samples.append(Sample(row.server_id, row.user_id, timestamp,
+                                  {metric: row[index + 4] for index, metric in enumerate(self.metrics)}))
+        if rows and (cursor is None or rows[-1].received_at > cursor):
+            self._cursors[shard] = rows[-1].received_at
+        return samples
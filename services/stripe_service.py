@@ -3,16 +3,20 @@
 Servicio Stripe para FungiCloud (copia de raspServerNative)
 """
 import os
+import hmac
+import json
+import time
+import hashlib
+import importlib
 import logging
+import threading
 from typing import Dict, Any
+from utils.lazy_import import LazyModule, module_available
 
 logger = logging.getLogger(__name__)
 
-try:
-    import stripe
-    STRIPE_AVAILABLE = True
-except ImportError:
-    STRIPE_AVAILABLE = False
+STRIPE_AVAILABLE = module_available('stripe')
+if not STRIPE_AVAILABLE:
     logger.warning("Stripe no instalado")
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
@@ -22,24 +26,173 @@ PLAN_PRICE_IDS = {
     'expert': os.getenv('STRIPE_EXPERT_PRICE_ID', '')
 }
 
-if STRIPE_AVAILABLE and STRIPE_SECRET_KEY:
-    stripe.api_key = STRIPE_SECRET_KEY
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')  # ej: http://localhost:12111 (stripe-mock)
+WEBHOOK_TOLERANCE = int(os.getenv('STRIPE_WEBHOOK_TOLERANCE', 300))  # segundos
+
+# Cliente HTTP: conexiones keep-alive compartidas y timeouts cortos
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 3))  # segundos
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 10))  # segundos
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', 1))
+STRIPE_HTTP_POOL_SIZE = int(os.getenv('STRIPE_HTTP_POOL_SIZE', 10))
+
+# Circuit breaker: tras N fallos seguidos se deja de llamar a Stripe durante el cooldown
+STRIPE_BREAKER_FAILURES = int(os.getenv('STRIPE_BREAKER_FAILURES', 5))
+STRIPE_BREAKER_COOLDOWN = float(os.getenv('STRIPE_BREAKER_COOLDOWN', 30))  # segundos
+
+def _configure_http_client(stripe):
+    """Configura el SDK con un pool de conexiones keep-alive y timeouts"""
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        logger.warning("requests no instalado, Stripe usará su cliente HTTP por defecto")
+        return
+    
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_HTTP_POOL_SIZE)
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    stripe.default_http_client = stripe.http_client.RequestsClient(
+        timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT),
+        session=http_session
+    )
+    stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+
+def _configure_stripe(stripe):
+    """Configura el SDK al importarlo (primer uso, no al arrancar el worker)"""
+    # stripe 7.x deja stripe.checkout en None hasta importar el subpaquete
+    importlib.import_module('stripe.checkout')
+    if STRIPE_SECRET_KEY:
+        stripe.api_key = STRIPE_SECRET_KEY
+    if STRIPE_API_BASE:
+        stripe.api_base = STRIPE_API_BASE
+    _configure_http_client(stripe)
+
+# El SDK tarda ~0.3 s en importarse: se carga en la primera llamada a Stripe
+stripe = LazyModule('stripe', on_load=_configure_stripe)
+
+class CircuitBreaker:
+    """Circuit breaker simple (closed -> open -> half-open)"""
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                return 'half-open'
+            return 'open'
+    
+    def allow(self) -> bool:
+        """Indica si se puede llamar; en half-open deja pasar una sola prueba"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"Circuit breaker de Stripe abierto tras {self.failures} fallos")
+                self.opened_at = time.monotonic()
+
+_breaker = CircuitBreaker(STRIPE_BREAKER_FAILURES, STRIPE_BREAKER_COOLDOWN)
+
+def get_stripe_breaker() -> CircuitBreaker:
+    return _breaker
+
+def _is_service_failure(error: Exception) -> bool:
+    """Errores que indican que Stripe no está disponible (no errores de la petición)"""
+    if STRIPE_AVAILABLE and isinstance(error, stripe.error.StripeError):
+        status = error.http_status
+        return status is None or status >= 500 or status == 429
+    return True
+
+def plan_for_price(price_id: str):
+    """Plan correspondiente a un price_id de Stripe, o None"""
+    for plan_type, plan_price_id in PLAN_PRICE_IDS.items():
+        if plan_price_id and plan_price_id == price_id:
+            return plan_type
+    return None
+
+def sign_webhook_payload(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """Genera una cabecera Stripe-Signature (para pruebas con un Stripe local)"""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    signed = f"{timestamp}.".encode('utf-8') + payload
+    signature = hmac.new(secret.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def _verify_signature(payload: bytes, sig_header: str, secret: str):
+    """Verifica la firma de un webhook con el esquema de Stripe (t=...,v1=...)"""
+    pairs = [item.split('=', 1) for item in sig_header.split(',') if '=' in item]
+    timestamp = int(next((value for key, value in pairs if key == 't'), 0))
+    if abs(time.time() - timestamp) > WEBHOOK_TOLERANCE:
+        raise ValueError('Timestamp de firma fuera de tolerancia')
+    signatures = [value for key, value in pairs if key == 'v1']
+    expected = sign_webhook_payload(payload, secret, timestamp).split('v1=', 1)[1]
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise ValueError('Firma de webhook inválida')
 
 class StripeService:
-    def create_customer(self, email: str, user_id: int) -> Dict[str, Any]:
+    def _call(self, operation: str, fn, *args, **kwargs) -> Dict[str, Any]:
+        """Ejecuta una llamada a Stripe a través del circuit breaker"""
+        if not _breaker.allow():
+            logger.warning(f"Stripe no disponible (circuit breaker abierto): {operation}")
+            return {'success': False, 'message': 'Stripe no disponible temporalmente', 'unavailable': True}
         try:
-            customer = stripe.Customer.create(email=email, metadata={'user_id': str(user_id)})
-            return {'success': True, 'customer_id': customer.id}
+            result = fn(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Error Stripe: {e}")
-            return {'success': False, 'message': str(e)}
+            unavailable = _is_service_failure(e)
+            if unavailable:
+                _breaker.record_failure()
+            else:
+                _breaker.record_success()
+            logger.error(f"Error Stripe ({operation}): {e}")
+            return {'success': False, 'message': str(e), 'error': e, 'unavailable': unavailable}
+        _breaker.record_success()
+        return result
+    
+    def create_customer(self, email: str, user_id: int, request_key: str) -> Dict[str, Any]:
+        """Crea el cliente; request_key (guardado en user_billing) hace idempotentes los reintentos"""
+        def create():
+            # Requests concurrentes del mismo intento obtienen el mismo cliente; un intento
+            # nuevo (clave rotada) no choca con una clave vieja de Stripe
+            customer = stripe.Customer.create(
+                email=email,
+                metadata={'user_id': str(user_id)},
+                idempotency_key=f"fungicloud-customer-{user_id}-{request_key}"
+            )
+            return {'success': True, 'customer_id': customer.id}
+        result = self._call('create_customer', create)
+        if not result['success'] and STRIPE_AVAILABLE and isinstance(result.get('error'), stripe.error.IdempotencyError):
+            result['rotate_key'] = True
+        return result
     
     def create_checkout_session(self, customer_id: str, plan_type: str, user_id: int, success_url: str, cancel_url: str) -> Dict[str, Any]:
-        try:
-            price_id = PLAN_PRICE_IDS.get(plan_type)
-            if not price_id:
-                return {'success': False, 'message': 'Plan inválido'}
-            
+        price_id = PLAN_PRICE_IDS.get(plan_type)
+        if not price_id:
+            return {'success': False, 'message': 'Plan inválido'}
+        
+        def create():
             session = stripe.checkout.Session.create(
                 customer=customer_id,
                 payment_method_types=['card'],
@@ -50,25 +203,28 @@ class StripeService:
                 metadata={'user_id': str(user_id), 'plan_type': plan_type}
             )
             return {'success': True, 'checkout_url': session.url, 'session_id': session.id}
-        except Exception as e:
-            logger.error(f"Error checkout: {e}")
-            return {'success': False, 'message': str(e)}
+        return self._call('create_checkout_session', create)
     
     def cancel_subscription(self, subscription_id: str, immediately: bool = False) -> Dict[str, Any]:
-        try:
+        def cancel():
             if immediately:
                 stripe.Subscription.delete(subscription_id)
             else:
                 stripe.Subscription.modify(subscription_id, cancel_at_period_end=True)
             return {'success': True}
-        except Exception as e:
-            logger.error(f"Error cancelar: {e}")
-            return {'success': False, 'message': str(e)}
+        return self._call('cancel_subscription', cancel)
     
     def verify_webhook(self, payload: bytes, sig_header: str) -> Dict[str, Any]:
+        """Verifica la firma y devuelve el evento como dict plano"""
         try:
             webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET', '')
-            event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
+            if not webhook_secret:
+                return {'success': False, 'message': 'STRIPE_WEBHOOK_SECRET no configurado'}
+            if STRIPE_AVAILABLE:
+                stripe.WebhookSignature.verify_header(payload.decode('utf-8'), sig_header, webhook_secret, WEBHOOK_TOLERANCE)
+            else:
+                _verify_signature(payload, sig_header, webhook_secret)
+            event = json.loads(payload)
             return {'success': True, 'event': event}
         except Exception as e:
             logger.error(f"Error webhook: {e}")
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Uso para FungiCloud
+Mantiene contadores por usuario (servidores registrados/online) en la misma
+transacción que los cambios de servidores, y una caché corta del estado de billing
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from models.billing import UserUsage
+from models.local_server import LocalServer
+from models import queries
+from database import write_marker
+
+logger = logging.getLogger(__name__)
+
+# La caché es por proceso: otro worker puede servir un plan viejo hasta STATUS_CACHE_TTL
+# tras un cambio (el worker que escribe invalida la suya en el commit, y el cliente que
+# acaba de escribir se salta la caché con su marca X-Last-Write)
+STATUS_CACHE_TTL = float(os.getenv('USAGE_CACHE_TTL', 3))  # segundos
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv('USAGE_CACHE_MAX_ENTRIES', 10000))
+
+_status_cache = OrderedDict()  # user_id -> (expira_monotónico, datos, etag), en orden LRU
+_cache_lock = threading.Lock()
+
+def adjust_usage(session, user_id: int, registered: int = 0, online: int = 0):
+    """Aplica deltas a los contadores del usuario dentro de la transacción actual"""
+    updated = session.execute(queries.ADJUST_USAGE, {
+        'usage_user_id': user_id,
+        'registered_delta': registered,
+        'online_delta': online
+    }).rowcount
+    
+    if not updated:
+        # Sin resumen todavía: calcularlo desde local_servers (ya incluye los cambios pendientes)
+        session.flush()
+        recompute_usage(session, user_id)
+    
+    session.info.setdefault('usage_invalidations', set()).add(user_id)
+
+def recompute_usage(session, user_id: int) -> UserUsage:
+    """Recalcula el resumen de un usuario desde local_servers"""
+    registered, online = session.query(
+        func.count(LocalServer.id),
+        func.count(LocalServer.id).filter(LocalServer.status == 'online')
+    ).filter(LocalServer.user_id == user_id).one()
+    
+    usage = session.get(UserUsage, user_id)
+    if usage is None:
+        usage = UserUsage(user_id=user_id)
+        session.add(usage)
+    usage.servers_registered = registered
+    usage.servers_online = online
+    session.info.setdefault('usage_invalidations', set()).add(user_id)
+    return usage
+
+def rebuild_all_usage(session, user_ids):
+    """Reconstruye los resúmenes de todos los usuarios (corrige desvíos al arrancar)"""
+    counts = {
+        user_id: (registered, online)
+        for user_id, registered, online in session.query(
+            LocalServer.user_id,
+            func.count(LocalServer.id),
+            func.count(LocalServer.id).filter(LocalServer.status == 'online')
+        ).group_by(LocalServer.user_id)
+    }
+    existing = {usage.user_id: usage for usage in session.query(UserUsage)}
+    
+    for user_id in user_ids:
+        registered, online = counts.get(user_id, (0, 0))
+        usage = existing.get(user_id)
+        if usage is None:
+            session.add(UserUsage(user_id=user_id, servers_registered=registered, servers_online=online))
+        elif (usage.servers_registered, usage.servers_online) != (registered, online):
+            logger.info(f"Uso corregido para usuario {user_id}: {registered} servidores, {online} online")
+            usage.servers_registered = registered
+            usage.servers_online = online
+    invalidate_status()
+
+def get_cached_status(user_id: int):
+    """(estado de billing, etag) cacheados del usuario, o None"""
+    written_at = write_marker()
+    if written_at and time.time() - written_at <= STATUS_CACHE_TTL:
+        return None  # el cliente acaba de escribir (quizás en otro worker)
+    with _cache_lock:
+        entry = _status_cache.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _status_cache[user_id]
+            return None
+        _status_cache.move_to_end(user_id)
+        return entry[1], entry[2]
+
+def cache_status(user_id: int, data: dict, etag: str = None):
+    with _cache_lock:
+        _status_cache[user_id] = (time.monotonic() + STATUS_CACHE_TTL, data, etag)
+        _status_cache.move_to_end(user_id)
+        while len(_status_cache) > STATUS_CACHE_MAX_ENTRIES:
+            _status_cache.popitem(last=False)
+
+def invalidate_status(user_id: int = None):
+    """Invalida la caché de un usuario (o toda si user_id es None)"""
+    with _cache_lock:
+        if user_id is None:
+            _status_cache.clear()
+        else:
+            _status_cache.pop(user_id, None)
+
+def mark_billing_changed(session, user_id: int):
+    """Invalida la caché del usuario cuando la transacción haga commit"""
+    session.info.setdefault('usage_invalidations', set()).add(user_id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('usage_invalidations', ()):
+        invalidate_status(user_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop('usage_invalidations', None)
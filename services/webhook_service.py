@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio de Webhooks de Stripe para FungiCloud
+Persiste los eventos verificados (idempotente por stripe_event_id) y los aplica
+a UserBilling en segundo plano, en orden por cliente.
+
+Un intento reclama el evento (status = processing, claimed_at); un reclamo más viejo que
+STALE_PROCESSING_MINUTES se considera abandonado por un proceso caído y se reencola. Los
+fallos se reintentan con backoff desde un hilo planificador, sin bloquear la partición.
+"""
+import heapq
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from database import get_db_session
+from models.billing import UserBilling, BillingEvent, StripeWebhookEvent
+from services.stripe_service import plan_for_price
+from services.usage_service import mark_billing_changed
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_WORKERS = int(os.getenv('STRIPE_WEBHOOK_WORKERS', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('STRIPE_WEBHOOK_MAX_ATTEMPTS', 5))
+WEBHOOK_RETRY_MAX_DELAY = float(os.getenv('STRIPE_WEBHOOK_RETRY_MAX_DELAY', 30))  # segundos
+STALE_PROCESSING_MINUTES = 5
+SWEEP_INTERVAL = 60  # segundos entre barridos de eventos abandonados
+
+# Eventos que fijan el estado de la suscripción: uno más viejo que el último aplicado se ignora
+STATE_EVENTS = (
+    'checkout.session.completed',
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted'
+)
+
+# Estado de suscripción de Stripe -> plan_status local
+SUBSCRIPTION_STATUS = {
+    'active': 'active',
+    'trialing': 'active',
+    'past_due': 'suspended',
+    'unpaid': 'suspended',
+    'incomplete': 'suspended',
+    'incomplete_expired': 'cancelled',
+    'canceled': 'cancelled'
+}
+
+def _from_epoch(value):
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value else None
+
+def _as_utc(value: datetime) -> datetime:
+    """SQLite devuelve los DateTime(timezone=True) sin zona: se guardan en UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _event_customer(event: dict):
+    """ID de cliente de Stripe asociado al evento"""
+    obj = event.get('data', {}).get('object', {})
+    if obj.get('object') == 'customer':
+        return obj.get('id')
+    customer = obj.get('customer')
+    if isinstance(customer, dict):
+        return customer.get('id')
+    return customer
+
+class WebhookProcessor:
+    def __init__(self, worker_count: int = WEBHOOK_WORKERS):
+        self.worker_count = max(1, worker_count)
+        self.queues = [queue.Queue() for _ in range(self.worker_count)]
+        self.threads = []
+        self.running = False
+        self._lock = threading.Lock()
+        self._delayed = []  # heap de (epoch del reintento, record_id, customer_id)
+        self._delayed_cond = threading.Condition()
+
+    def start(self):
+        """Inicia el pool de workers y reencola los eventos pendientes"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for index, work_queue in enumerate(self.queues):
+                thread = threading.Thread(target=self._worker_loop, args=(work_queue,), daemon=True,
+                                          name=f"stripe-webhook-{index}")
+                thread.start()
+                self.threads.append(thread)
+            thread = threading.Thread(target=self._retry_loop, daemon=True, name='stripe-webhook-retry')
+            thread.start()
+            self.threads.append(thread)
+        self._requeue_pending()
+        logger.info(f"Procesador de webhooks iniciado ({self.worker_count} workers)")
+
+    def stop(self):
+        """Detiene los workers (los eventos pendientes quedan en la base de datos)"""
+        self.running = False
+        with self._delayed_cond:
+            self._delayed_cond.notify_all()
+        for work_queue in self.queues:
+            work_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=10)
+        self.threads = []
+
+    def backlog(self) -> int:
+        """Eventos en cola en este proceso"""
+        return sum(work_queue.qsize() for work_queue in self.queues)
+
+    def ingest(self, event: dict) -> bool:
+        """Persiste un evento verificado; False si ya se había recibido"""
+        customer_id = _event_customer(event)
+        with get_db_session() as session:
+            record = StripeWebhookEvent(
+                stripe_event_id=event['id'],
+                event_type=event.get('type', 'unknown'),
+                stripe_customer_id=customer_id,
+                payload=event,
+                stripe_created_at=_from_epoch(event.get('created'))
+            )
+            session.add(record)
+            try:
+                session.flush()
+            except IntegrityError:
+                session.rollback()
+                logger.info(f"Webhook duplicado ignorado: {event['id']}")
+                return False
+            record_id = record.id
+
+        self._enqueue(record_id, customer_id)
+        return True
+
+    def _enqueue(self, record_id: int, customer_id: str):
+        """Encola en la partición del cliente para preservar su orden"""
+        partition = zlib.crc32(customer_id.encode('utf-8')) % self.worker_count if customer_id else 0
+        self.queues[partition].put(record_id)
+
+    def _schedule(self, record_id: int, customer_id: str, due: float):
+        """Encola el evento cuando llegue `due` (epoch), sin ocupar un worker mientras tanto"""
+        with self._delayed_cond:
+            heapq.heappush(self._delayed, (due, record_id, customer_id))
+            self._delayed_cond.notify()
+
+    def _retry_loop(self):
+        """Encola los reintentos vencidos y barre periódicamente los eventos abandonados"""
+        next_sweep = time.monotonic() + SWEEP_INTERVAL
+        while self.running:
+            due = []
+            with self._delayed_cond:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    due.append(heapq.heappop(self._delayed))
+                if not due:
+                    wait = next_sweep - time.monotonic()
+                    if self._delayed:
+                        wait = min(wait, self._delayed[0][0] - now)
+                    self._delayed_cond.wait(max(0.0, wait))
+            for _, record_id, customer_id in due:
+                self._enqueue(record_id, customer_id)
+            if self.running and time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + SWEEP_INTERVAL
+                try:
+                    self._requeue_pending(sweep=True)
+                except Exception as e:
+                    logger.error(f"Error barriendo webhooks pendientes: {e}")
+
+    def _requeue_pending(self, sweep: bool = False):
+        """Reencola eventos pendientes y reclamos abandonados
+
+        Al arrancar toma todos los pendientes; en un barrido (sweep) solo los que llevan
+        más de STALE_PROCESSING_MINUTES vencidos, los demás son de otro proceso vivo.
+        """
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(minutes=STALE_PROCESSING_MINUTES)
+        with get_db_session() as session:
+            # Abandonado = reclamado hace más de STALE (nunca por received_at: otro
+            # worker puede estar aplicando un evento viejo en este momento)
+            session.query(StripeWebhookEvent).filter(
+                StripeWebhookEvent.status == 'processing',
+                or_(
+                    StripeWebhookEvent.claimed_at < stale,
+                    and_(StripeWebhookEvent.claimed_at.is_(None), StripeWebhookEvent.received_at < stale)
+                )
+            ).update({
+                StripeWebhookEvent.status: 'pending',
+                StripeWebhookEvent.claimed_at: None
+            }, synchronize_session=False)
+            query = session.query(
+                StripeWebhookEvent.id,
+                StripeWebhookEvent.stripe_customer_id,
+                StripeWebhookEvent.next_attempt_at
+            ).filter(StripeWebhookEvent.status == 'pending')
+            if sweep:
+                query = query.filter(
+                    StripeWebhookEvent.received_at < stale,
+                    or_(StripeWebhookEvent.next_attempt_at.is_(None), StripeWebhookEvent.next_attempt_at < stale)
+                )
+            pending = query.order_by(StripeWebhookEvent.stripe_created_at, StripeWebhookEvent.id).all()
+
+        for record_id, customer_id, next_attempt_at in pending:
+            if next_attempt_at is not None and _as_utc(next_attempt_at) > now:
+                self._schedule(record_id, customer_id, _as_utc(next_attempt_at).timestamp())
+            else:
+                self._enqueue(record_id, customer_id)
+        if pending:
+            logger.info(f"Webhooks pendientes reencolados: {len(pending)}")
+
+    def _worker_loop(self, work_queue: queue.Queue):
+        while self.running:
+            record_id = work_queue.get()
+            if record_id is None:
+                break
+            try:
+                self.process(record_id)
+            except Exception as e:
+                logger.error(f"Error procesando webhook {record_id}: {e}")
+
+    def process(self, record_id: int):
+        """Aplica un evento persistido; si falla, programa un reintento con backoff"""
+        now = datetime.now(timezone.utc)
+        # Reclamar el evento: evita que otro proceso lo aplique en paralelo
+        with get_db_session() as session:
+            claimed = session.query(StripeWebhookEvent).filter(
+                StripeWebhookEvent.id == record_id,
+                StripeWebhookEvent.status == 'pending',
+                or_(StripeWebhookEvent.next_attempt_at.is_(None), StripeWebhookEvent.next_attempt_at <= now)
+            ).update({
+                StripeWebhookEvent.status: 'processing',
+                StripeWebhookEvent.attempts: StripeWebhookEvent.attempts + 1,
+                StripeWebhookEvent.claimed_at: now
+            }, synchronize_session=False)
+        if not claimed:
+            return
+
+        try:
+            with get_db_session() as session:
+                record = session.get(StripeWebhookEvent, record_id)
+                applied = self._apply(session, record)
+                record.status = 'processed' if applied else 'ignored'
+                record.processed_at = datetime.now(timezone.utc)
+                record.claimed_at = None
+                record.next_attempt_at = None
+                record.last_error = None
+        except Exception as e:
+            with get_db_session() as session:
+                record = session.get(StripeWebhookEvent, record_id)
+                # Un fallo durante el apagado no consume el evento: queda pendiente para el próximo arranque
+                retry = not self.running or record.attempts < WEBHOOK_MAX_ATTEMPTS
+                due = None
+                if retry and self.running:
+                    due = datetime.now(timezone.utc) + timedelta(seconds=min(2 ** record.attempts, WEBHOOK_RETRY_MAX_DELAY))
+                record.status = 'pending' if retry else 'failed'
+                record.claimed_at = None
+                record.next_attempt_at = due
+                record.last_error = str(e)
+                attempts, customer_id = record.attempts, record.stripe_customer_id
+            logger.error(f"Error aplicando webhook {record_id} (intento {attempts}): {e}")
+            if due is not None:
+                self._schedule(record_id, customer_id, due.timestamp())
+
+    def _apply(self, session, record: StripeWebhookEvent) -> bool:
+        """Aplica el evento a UserBilling; False si no aplica o está obsoleto"""
+        event = record.payload
+        event_type = record.event_type
+        obj = event.get('data', {}).get('object', {})
+
+        if event_type in STATE_EVENTS and self._is_stale(session, record):
+            logger.info(f"Webhook obsoleto ignorado: {record.stripe_event_id}")
+            return False
+
+        billing = self._find_billing(session, record, obj)
+        if billing is None:
+            logger.warning(f"Webhook sin usuario asociado: {record.stripe_event_id} ({event_type})")
+            return False
+
+        metadata = {'stripe_event_id': record.stripe_event_id}
+
+        if event_type == 'checkout.session.completed':
+            plan_type = obj.get('metadata', {}).get('plan_type')
+            billing.stripe_customer_id = obj.get('customer') or billing.stripe_customer_id
+            billing.stripe_subscription_id = obj.get('subscription') or billing.stripe_subscription_id
+            if plan_type:
+                billing.plan_type = plan_type
+            billing.plan_status = 'active'
+            metadata['plan_type'] = billing.plan_type
+            billing_event_type = 'subscription_created'
+
+        elif event_type in ('customer.subscription.created', 'customer.subscription.updated'):
+            old_plan = billing.plan_type
+            items = obj.get('items', {}).get('data', [])
+            plan_type = plan_for_price(items[0].get('price', {}).get('id')) if items else None
+            if plan_type:
+                billing.plan_type = plan_type
+            billing.stripe_subscription_id = obj.get('id')
+            billing.plan_status = SUBSCRIPTION_STATUS.get(obj.get('status'), billing.plan_status)
+            if obj.get('cancel_at_period_end') and billing.plan_status == 'active':
+                billing.plan_status = 'cancelling'
+            billing.current_period_start = _from_epoch(obj.get('current_period_start'))
+            billing.current_period_end = _from_epoch(obj.get('current_period_end'))
+            metadata.update({'plan_type': billing.plan_type, 'status': obj.get('status')})
+            billing_event_type = 'plan_changed' if old_plan != billing.plan_type else 'subscription_updated'
+
+        elif event_type == 'customer.subscription.deleted':
+            billing.plan_type = 'free'
+            billing.plan_status = 'cancelled'
+            billing.stripe_subscription_id = None
+            billing_event_type = 'subscription_cancelled'
+
+        elif event_type == 'customer.deleted':
+            # El próximo checkout crea un cliente nuevo, con una idempotency key nueva
+            billing.stripe_customer_id = None
+            billing.customer_request_key = None
+            billing_event_type = 'customer_deleted'
+
+        elif event_type == 'invoice.payment_succeeded':
+            metadata.update({'amount_paid': obj.get('amount_paid'), 'currency': obj.get('currency')})
+            billing_event_type = 'payment_succeeded'
+
+        elif event_type == 'invoice.payment_failed':
+            metadata.update({'amount_due': obj.get('amount_due'), 'currency': obj.get('currency')})
+            billing_event_type = 'payment_failed'
+
+        else:
+            return False
+
+        session.add(BillingEvent(
+            user_id=billing.user_id,
+            event_type=billing_event_type,
+            event_metadata=metadata
+        ))
+        mark_billing_changed(session, billing.user_id)
+        return True
+
+    def _is_stale(self, session, record: StripeWebhookEvent) -> bool:
+        """Indica si ya se aplicó un evento de estado más reciente del mismo cliente"""
+        if not record.stripe_customer_id or record.stripe_created_at is None:
+            return False
+        newer = session.query(StripeWebhookEvent.id).filter(
+            StripeWebhookEvent.stripe_customer_id == record.stripe_customer_id,
+            StripeWebhookEvent.stripe_created_at > record.stripe_created_at,
+            StripeWebhookEvent.event_type.in_(STATE_EVENTS),
+            StripeWebhookEvent.status == 'processed'
+        ).first()
+        return newer is not None
+
+    def _find_billing(self, session, record: StripeWebhookEvent, obj: dict):
+        """Busca el UserBilling por cliente de Stripe o por metadata.user_id"""
+        if record.stripe_customer_id:
+            billing = session.query(UserBilling).filter_by(stripe_customer_id=record.stripe_customer_id).first()
+            if billing:
+                return billing
+        user_id = obj.get('metadata', {}).get('user_id')
+        if user_id and str(user_id).isdigit():
+            return session.query(UserBilling).filter_by(user_id=int(user_id)).first()
+        return None
+
+# Instancia global
+_webhook_processor = None
+_processor_lock = threading.Lock()
+
+def get_webhook_processor() -> WebhookProcessor:
+    """Obtiene (e inicia) el procesador de webhooks"""
+    global _webhook_processor
+    with _processor_lock:
+        if _webhook_processor is None:
+            _webhook_processor = WebhookProcessor()
+    if not _webhook_processor.running:
+        _webhook_processor.start()
+    return _webhook_processor
+
+def webhook_backlog() -> int:
+    """Eventos en cola en este proceso (0 si el procesador no se inició)"""
+    processor = _webhook_processor
+    return processor.backlog() if processor is not None else 0
@@ -56,6 +56,6 @@ echo ======================================
 echo.
 echo Comandos útiles:
 echo   Desarrollo:  python app.py
-echo   Producción:  gunicorn -w 4 -b 0.0.0.0:5000 app:app
+echo   Producción:  gunicorn -c gunicorn.conf.py
 echo.
 pause
@@ -44,5 +44,5 @@ echo "✅ FungiCloud listo para ejecutar"
 echo "======================================"
 echo -e "\nComandos útiles:"
 echo "  Desarrollo:  python app.py"
-echo "  Producción:  gunicorn -w 4 -b 0.0.0.0:5000 app:app"
+echo "  Producción:  gunicorn -c gunicorn.conf.py"
 echo ""
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures de pruebas de FungiCloud
+Todo corre en local: una base central SQLite y dos shards SQLite para las series de
+tiempo (SYNC_SHARD_URLS), y Stripe reemplazado por tests/stripe_stub.py. Las variables
+se fijan antes de importar la app porque los módulos leen su configuración al importarse.
+
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+TEST_DIR = tempfile.mkdtemp(prefix='fungicloud-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{TEST_DIR}/central.db",
+    'SYNC_SHARD_URLS': f"sqlite:///{TEST_DIR}/shard0.db,sqlite:///{TEST_DIR}/shard1.db",
+    'DATABASE_REPLICA_URLS': '',
+    'SECRET_KEY': 'test-secret-key-with-enough-length-for-hs256',
+    'JWT_SECRET_KEY': 'test-secret-key-with-enough-length-for-hs256',
+    'ALERT_MONITOR_EMBEDDED': 'false',
+    'STRIPE_SECRET_KEY': 'sk_test_local',
+    'STRIPE_WEBHOOK_SECRET': 'whsec_test_local',
+    'STRIPE_STARTER_PRICE_ID': 'price_starter',
+    'STRIPE_ADVANCE_PRICE_ID': 'price_advance',
+    'STRIPE_EXPERT_PRICE_ID': 'price_expert',
+    'STRIPE_WEBHOOK_RETRY_MAX_DELAY': '0.2',
+    'SYNC_DEVICE_RATE': '1000',
+    'SYNC_DEVICE_BURST': '1000',
+    'SYNC_GLOBAL_RATE': '10000',
+    'SYNC_GLOBAL_BURST': '10000',
+    'LOG_LEVEL': 'WARNING'
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    from database import init_database
+    init_database()
+    return flask_app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def user(client):
+    """Usuario nuevo: {'id', 'email', 'headers'}"""
+    email = f"test-{uuid.uuid4().hex[:10]}@fungicloud.local"
+    response = client.post('/api/auth/register', json={'email': email, 'password': 'test-password'})
+    assert response.status_code == 201, response.get_json()
+    body = response.get_json()
+    return {
+        'id': body['user']['id'],
+        'email': email,
+        'headers': {'Authorization': f"Bearer {body['token']}"}
+    }
+
+@pytest.fixture
+def admin(user):
+    """Usuario con token de administrador"""
+    from routes.auth_routes import create_token
+    token = create_token(user['id'], user['email'], is_admin=True)
+    return {**user, 'headers': {'Authorization': f"Bearer {token}"}}
+
+@pytest.fixture
+def server(client, user):
+    """Servidor local registrado del usuario: {'pk', 'server_id', **user}"""
+    server_id = f"srv-{uuid.uuid4().hex[:10]}"
+    response = client.post('/api/sync/register', json={'server_id': server_id}, headers=user['headers'])
+    assert response.status_code == 200, response.get_json()
+    return {**user, 'pk': response.get_json()['server']['id'], 'server_id': server_id}
+
+def wait_for(predicate, timeout: float = 5.0, interval: float = 0.02):
+    """Espera a que predicate() sea verdadero (procesamiento en segundo plano)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(interval)
+    raise AssertionError("Condición no alcanzada a tiempo")
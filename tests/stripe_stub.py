@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Stripe local para pruebas
+Arma eventos con la forma de los de Stripe y los entrega firmados (Stripe-Signature)
+al endpoint de webhooks, como lo haría Stripe o `stripe listen --forward-to`. StripeApi
+reemplaza las llamadas salientes del SDK, con latencia y caídas controladas por la prueba.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from services.stripe_service import sign_webhook_payload
+
+WEBHOOK_PATH = '/api/billing/webhooks/stripe'
+
+class LocalStripe:
+    def __init__(self, client, secret: str = None):
+        self.client = client
+        self.secret = secret or os.environ['STRIPE_WEBHOOK_SECRET']
+
+    def event(self, event_type: str, obj: dict, created: int = None, event_id: str = None) -> dict:
+        return {
+            'id': event_id or f"evt_{uuid.uuid4().hex[:24]}",
+            'object': 'event',
+            'type': event_type,
+            'created': created if created is not None else int(time.time()),
+            'data': {'object': obj}
+        }
+
+    def subscription(self, customer_id: str, price_id: str, status: str = 'active', **fields) -> dict:
+        return {
+            'object': 'subscription',
+            'id': fields.pop('id', f"sub_{uuid.uuid4().hex[:14]}"),
+            'customer': customer_id,
+            'status': status,
+            'items': {'data': [{'price': {'id': price_id}}]},
+            **fields
+        }
+
+    def send(self, event: dict, secret: str = None):
+        """POST firmado al webhook; devuelve la respuesta de Flask"""
+        payload = json.dumps(event).encode('utf-8')
+        signature = sign_webhook_payload(payload, secret or self.secret)
+        return self.client.post(WEBHOOK_PATH, data=payload, headers={
+            'Stripe-Signature': signature,
+            'Content-Type': 'application/json'
+        })
+
+class StripeApi:
+    """API de Stripe local: responde las llamadas del SDK que hace StripeService
+
+    Con `gate` sin activar cada llamada espera (un Stripe lento) hasta `gate.set()`;
+    con `down` falla como un Stripe caído (error de conexión).
+    """
+    def __init__(self, monkeypatch):
+        import stripe
+        import stripe.checkout
+        self.gate = threading.Event()
+        self.gate.set()
+        self.down = False
+        self.calls = []
+        self._waiting = threading.Condition()
+        self._blocked = 0
+        self._error = stripe.error.APIConnectionError
+        monkeypatch.setattr(stripe.Customer, 'create', self._endpoint(
+            'customer.create', lambda **params: SimpleNamespace(id=f"cus_{uuid.uuid4().hex[:14]}")))
+        monkeypatch.setattr(stripe.checkout.Session, 'create', self._endpoint(
+            'checkout.session.create', lambda **params: SimpleNamespace(
+                id=f"cs_{uuid.uuid4().hex[:14]}", url='https://checkout.local/session')))
+        monkeypatch.setattr(stripe.Subscription, 'delete', self._endpoint(
+            'subscription.delete', lambda subscription_id, **params: SimpleNamespace(id=subscription_id)))
+        monkeypatch.setattr(stripe.Subscription, 'modify', self._endpoint(
+            'subscription.modify', lambda subscription_id, **params: SimpleNamespace(id=subscription_id)))
+
+    def _endpoint(self, name: str, respond):
+        def call(*args, **params):
+            self.calls.append(name)
+            if self.down:
+                raise self._error("Stripe no responde")
+            with self._waiting:
+                self._blocked += 1
+                self._waiting.notify_all()
+            try:
+                self.gate.wait(10)
+            finally:
+                with self._waiting:
+                    self._blocked -= 1
+            return respond(*args, **params)
+        return call
+
+    def wait_blocked(self, count: int = 1, timeout: float = 5.0) -> bool:
+        """Espera a que count llamadas estén detenidas en `gate`"""
+        with self._waiting:
+            return self._waiting.wait_for(lambda: self._blocked >= count, timeout)
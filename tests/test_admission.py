@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Token buckets de la ingesta: clave del usuario autenticado y fichas devueltas al rechazar"""
+import pytest
+from services import admission_service
+from services.admission_service import AdmissionController
+from utils.rate_limit import TokenBucket
+
+@pytest.fixture
+def controller(monkeypatch):
+    """Un request por dispositivo (la reposición tarda más que el test)"""
+    monkeypatch.setattr(admission_service, 'SYNC_DEVICE_RATE', 0.001)
+    monkeypatch.setattr(admission_service, 'SYNC_DEVICE_BURST', 1)
+    fresh = AdmissionController()
+    monkeypatch.setattr(admission_service, '_admission_controller', fresh)
+    return fresh
+
+def _sync(client, server_id: str, headers: dict):
+    return client.post('/api/sync/data', json={'server_id': server_id, 'avg_temperature': 21.0}, headers=headers)
+
+def test_forged_server_id_does_not_drain_the_owners_bucket(client, server, controller):
+    forged = {'Authorization': 'Bearer no-es-un-token'}
+    assert _sync(client, server['server_id'], forged).status_code == 401
+    assert _sync(client, server['server_id'], forged).status_code == 429  # limitado por IP
+
+    assert _sync(client, server['server_id'], server['headers']).status_code == 200
+    assert _sync(client, server['server_id'], server['headers']).status_code == 429
+
+def test_other_user_with_the_same_server_id_has_its_own_bucket(client, server, controller):
+    other = client.post('/api/auth/register', json={'email': f"admission-{server['server_id']}@fungicloud.local",
+                                                    'password': 'test-password'}).get_json()
+    other_headers = {'Authorization': f"Bearer {other['token']}"}
+    assert _sync(client, server['server_id'], other_headers).status_code == 404  # no es suyo
+    assert _sync(client, server['server_id'], server['headers']).status_code == 200
+
+def test_global_or_slot_rejection_keeps_the_device_token(client, server, controller, monkeypatch):
+    global_bucket = controller.global_bucket
+    controller.global_bucket = TokenBucket(0.001, 1)
+    controller.global_bucket.tokens = 0  # límite global agotado
+    assert controller.admit('user:1:srv') > 0
+    assert controller.device_buckets['user:1:srv'].tokens == pytest.approx(1, abs=0.01)
+    controller.global_bucket = global_bucket
+
+    acquire_slot = controller.acquire_slot
+    monkeypatch.setattr(controller, 'acquire_slot', lambda: False)  # pool saturado
+    assert _sync(client, server['server_id'], server['headers']).status_code == 429
+    monkeypatch.setattr(controller, 'acquire_slot', acquire_slot)
+    assert _sync(client, server['server_id'], server['headers']).status_code == 200
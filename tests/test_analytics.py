@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Ventana de /api/admin/analytics/fleet"""
+from datetime import datetime, timedelta, timezone
+from services.analytics_service import ANALYTICS_MAX_DAYS
+
+def _fleet(client, admin, **params):
+    return client.get('/api/admin/analytics/fleet', query_string=params, headers=admin['headers'])
+
+def test_aware_start_with_naive_end(client, admin):
+    start = (datetime.now(timezone.utc) - timedelta(hours=2)).isoformat()
+    end = datetime.now().isoformat()
+    response = _fleet(client, admin, start=start, end=end)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['analytics']['samples'] >= 0
+
+def test_window_is_capped(client, admin):
+    assert _fleet(client, admin, hours=(ANALYTICS_MAX_DAYS + 1) * 24).status_code == 400
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=ANALYTICS_MAX_DAYS, hours=1)
+    assert _fleet(client, admin, start=start.isoformat(), end=end.isoformat()).status_code == 400
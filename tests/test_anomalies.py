@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Detector de anomalías en memoria del líder del monitor de alertas"""
+from datetime import datetime, timedelta
+import pytest
+from database import get_db_session
+from models.local_server import LocalServer
+from models.sync_data import MetricBaseline
+from services import anomaly_service
+from services.alert_service import AlertService
+
+METRIC = 'avg_temperature'
+
+@pytest.fixture
+def leader(monkeypatch):
+    """Monitor de alertas que ya ganó el lease; los emails quedan en sent"""
+    monkeypatch.setattr(anomaly_service, 'ANOMALY_WARMUP_SAMPLES', 3)
+    service = AlertService()
+    service.is_leader = True
+    service.sent = []
+    monkeypatch.setattr(service, 'send_sensor_alert',
+                        lambda to_email, server_name, anomalies: service.sent.append((server_name, anomalies)))
+    service._scan_samples()  # primera lectura: fija el cursor
+    return service
+
+def _sync(client, server, minutes_ago: int, value: float):
+    timestamp = (datetime.now() - timedelta(minutes=minutes_ago)).isoformat()
+    response = client.post('/api/sync/data', json={'server_id': server['server_id'], 'timestamp': timestamp, METRIC: value},
+                           headers=server['headers'])
+    assert response.status_code == 200
+
+def _baseline(server_pk: int):
+    with get_db_session(readonly=True) as session:
+        baseline = session.query(MetricBaseline).filter_by(server_id=server_pk, metric=METRIC).first()
+        return baseline.samples if baseline else None
+
+def _server_name(server_pk: int) -> str:
+    with get_db_session(readonly=True) as session:
+        return session.get(LocalServer, server_pk).name
+
+def test_ingest_does_not_touch_the_detector(client, server, leader):
+    for step, value in enumerate((20.0, 20.2, 19.8)):
+        _sync(client, server, 60 - step * 15, value)
+    assert _baseline(server['pk']) is None  # ni lecturas ni escrituras de estado en la ingesta
+
+    leader._scan_samples()
+    assert leader.detector._states[server['pk']][METRIC].samples == 3
+
+def test_leader_alerts_once_and_ignores_reread_samples(client, server, leader):
+    for step, value in enumerate((20.0, 20.2, 19.8, 20.1, 19.9)):
+        _sync(client, server, 120 - step * 15, value)
+    leader._scan_samples()
+    _sync(client, server, 30, 45.0)
+    leader._scan_samples()
+    leader._scan_samples()  # el solapamiento relee las mismas filas
+
+    state = leader.detector._states[server['pk']][METRIC]
+    assert state.samples == 6
+    alerts = [anomalies for name, anomalies in leader.sent if name == _server_name(server['pk'])]
+    assert len(alerts) == 1 and alerts[0][0]['metric'] == METRIC
+
+def test_checkpoint_warms_the_next_leader(client, server, leader):
+    for step, value in enumerate((20.0, 21.0, 22.0, 21.5)):
+        _sync(client, server, 60 - step * 15, value)
+    leader._scan_samples()
+    assert leader.detector.checkpoint() >= 1
+    assert _baseline(server['pk']) == 4
+
+    # Más muestras y un segundo checkpoint: la fila existente se actualiza
+    _sync(client, server, 0, 21.0)
+    leader._scan_samples()
+    leader.detector.checkpoint()
+    assert _baseline(server['pk']) == 5
+
+    successor = AlertService()
+    successor.detector.warm([server['pk']])
+    state = successor.detector._states[server['pk']][METRIC]
+    expected = leader.detector._states[server['pk']][METRIC]
+    assert (state.samples, state.mean) == (expected.samples, pytest.approx(expected.mean))
+
+def test_lost_lease_drops_owned_state(client, server, leader):
+    _sync(client, server, 15, 20.0)
+    leader._scan_samples()
+    assert len(leader.detector) >= 1
+    leader._drop_owned_state()
+    assert len(leader.detector) == 0
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Backfill con el ritmo agotado: corta sin esperar y se reanuda con resume_token"""
+import time
+from datetime import datetime, timedelta
+import pytest
+from services import backfill_service
+from services.admission_service import get_admission_controller
+from utils.rate_limit import TokenBucket
+
+BATCH = 10
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """Bucket de una sola ráfaga de dos lotes y reposición lenta; dormir sería un error"""
+    slow = TokenBucket(rate=BATCH / 5, capacity=2 * BATCH)
+    monkeypatch.setattr(backfill_service, 'BACKFILL_BATCH_SIZE', BATCH)
+    monkeypatch.setattr(backfill_service, '_backfill_bucket', slow)
+    monkeypatch.setattr(backfill_service.time, 'sleep', lambda seconds: pytest.fail("el backfill no debe dormir"))
+    return slow
+
+def _samples(count: int) -> list:
+    start = datetime.now() - timedelta(days=1)
+    return [{'timestamp': (start + timedelta(minutes=15 * i)).isoformat(), 'avg_temperature': 20 + i % 5}
+            for i in range(count)]
+
+def _backfill(client, server, samples, resume_token=None):
+    body = {'server_id': server['server_id'], 'samples': samples, 'resume_token': resume_token}
+    return client.post('/api/sync/backfill', json=body, headers=server['headers'])
+
+def test_exhausted_rate_returns_immediately_with_resume_token(client, server, bucket):
+    samples = _samples(5 * BATCH)
+    started = time.monotonic()
+    response = _backfill(client, server, samples)
+    elapsed = time.monotonic() - started
+
+    body = response.get_json()
+    assert response.status_code == 202
+    assert elapsed < backfill_service.BACKFILL_MAX_REQUEST_SECONDS / 4
+    assert body['inserted'] == 2 * BATCH and body['complete'] is False
+    assert int(response.headers['Retry-After']) >= 1 and body['resume_token']
+    assert get_admission_controller().stats()['in_flight'] == 0
+
+    # Sin fichas todavía: nada insertado, 429 con el mismo punto de reanudación
+    retry = _backfill(client, server, samples, body['resume_token'])
+    assert retry.status_code == 429 and retry.get_json()['skipped'] == 2 * BATCH
+
+    bucket.capacity = bucket.tokens = 4 * BATCH  # ritmo repuesto
+    resumed = _backfill(client, server, samples, body['resume_token']).get_json()
+    assert resumed['complete'] is True
+    assert resumed['inserted'] == 3 * BATCH and resumed['duplicates'] == 0
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Flujos de checkout y cancelación con Stripe reemplazado por un stub en proceso"""
+import threading
+import time
+import uuid
+import pytest
+from database import get_db_session, get_engine, pool_usage
+from models.billing import UserBilling, BillingEvent
+from services import stripe_service
+from services.stripe_service import CircuitBreaker, StripeService
+from tests.conftest import wait_for
+from tests.stripe_stub import LocalStripe, StripeApi
+
+def _billing(user_id: int) -> UserBilling:
+    with get_db_session(readonly=True) as session:
+        billing = session.query(UserBilling).filter_by(user_id=user_id).one()
+        session.expunge(billing)
+        return billing
+
+@pytest.fixture
+def stripe_calls(monkeypatch):
+    """Registra las llamadas a Stripe; outcomes es la cola de resultados de create_customer"""
+    calls = {'create_customer': [], 'outcomes': []}
+
+    def create_customer(self, email, user_id, request_key):
+        calls['create_customer'].append(request_key)
+        if calls['outcomes']:
+            return calls['outcomes'].pop(0)
+        return {'success': True, 'customer_id': f"cus_{uuid.uuid4().hex[:14]}"}
+
+    def create_checkout_session(self, customer_id, plan_type, user_id, success_url, cancel_url):
+        return {'success': True, 'checkout_url': f"https://checkout.local/{customer_id}", 'session_id': 'cs_test'}
+
+    monkeypatch.setattr(StripeService, 'create_customer', create_customer)
+    monkeypatch.setattr(StripeService, 'create_checkout_session', create_checkout_session)
+    return calls
+
+@pytest.fixture
+def stripe_api(monkeypatch):
+    """SDK de Stripe local y un circuit breaker nuevo (el global se comparte entre pruebas)"""
+    monkeypatch.setattr(stripe_service, '_breaker', CircuitBreaker(failure_threshold=2, cooldown=60))
+    api = StripeApi(monkeypatch)
+    yield api
+    api.gate.set()
+
+def _subscribe(user_id: int) -> str:
+    subscription_id = f"sub_{uuid.uuid4().hex[:14]}"
+    with get_db_session() as session:
+        billing = session.query(UserBilling).filter_by(user_id=user_id).one()
+        billing.stripe_subscription_id = subscription_id
+        billing.plan_type = 'advance'
+    return subscription_id
+
+def _connections_in_use() -> int:
+    assert hasattr(get_engine().pool, 'checkedout')  # pool que cuenta sus conexiones prestadas
+    return sum(pool['in_use'] for pool in pool_usage().values())
+
+def test_slow_stripe_holds_no_connections(app, user, stripe_api):
+    _subscribe(user['id'])
+    stripe_api.gate.clear()  # Stripe deja de responder hasta gate.set()
+    requests = [
+        ('/api/billing/checkout/create', {'plan_type': 'starter'}),
+        ('/api/billing/subscription/cancel', {'immediately': False}),
+        ('/api/billing/checkout/create', {'plan_type': 'expert'})
+    ]
+    responses = []
+
+    def call(path, body):
+        responses.append(app.test_client().post(path, json=body, headers=user['headers']).status_code)
+
+    threads = [threading.Thread(target=call, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    assert stripe_api.wait_blocked(len(requests))
+    assert _connections_in_use() == 0  # tres requests esperando a Stripe, ninguna con conexión
+
+    stripe_api.gate.set()
+    for thread in threads:
+        thread.join(10)
+    assert sorted(responses) == [200, 200, 200]
+    assert _billing(user['id']).plan_status == 'cancelling'
+
+def test_open_breaker_fails_fast(client, user, stripe_api):
+    _subscribe(user['id'])
+    stripe_api.down = True
+    for _ in range(2):
+        response = client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+        assert response.status_code == 503
+    assert stripe_service.get_stripe_breaker().state == 'open'
+
+    calls = len(stripe_api.calls)
+    started = time.monotonic()
+    checkout = client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    cancel = client.post('/api/billing/subscription/cancel', json={'immediately': True}, headers=user['headers'])
+    assert checkout.status_code == 503 and cancel.status_code == 503
+    assert len(stripe_api.calls) == calls  # no se llamó a Stripe
+    assert time.monotonic() - started < 1
+    assert _billing(user['id']).plan_type == 'advance'
+
+def test_customer_retries_reuse_the_attempt_key(client, user, stripe_calls):
+    stripe_calls['outcomes'].append({'success': False, 'message': 'timeout', 'unavailable': True})
+    failed = client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    assert failed.status_code == 503
+    ok = client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    assert ok.status_code == 200
+
+    first_key, retry_key = stripe_calls['create_customer']
+    assert first_key == retry_key
+    billing = _billing(user['id'])
+    assert billing.stripe_customer_id and billing.customer_request_key is None
+
+def test_deleted_customer_gets_a_new_key(client, user, stripe_calls):
+    client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    customer_id = _billing(user['id']).stripe_customer_id
+
+    stripe = LocalStripe(client)
+    event = stripe.event('customer.deleted', {'object': 'customer', 'id': customer_id})
+    stripe.send(event)
+    wait_for(lambda: _billing(user['id']).stripe_customer_id is None)
+
+    client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    first_key, second_key = stripe_calls['create_customer']
+    assert first_key != second_key
+    assert _billing(user['id']).stripe_customer_id != customer_id
+
+def test_rejected_key_is_rotated(client, user, stripe_calls):
+    stripe_calls['outcomes'].append({'success': False, 'message': 'Keys for idempotent requests...', 'rotate_key': True})
+    client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    client.post('/api/billing/checkout/create', json={'plan_type': 'starter'}, headers=user['headers'])
+    first_key, second_key = stripe_calls['create_customer']
+    assert first_key != second_key
+
+def test_cancel_does_not_touch_a_subscription_that_changed(client, user, monkeypatch):
+    with get_db_session() as session:
+        billing = session.query(UserBilling).filter_by(user_id=user['id']).one()
+        billing.stripe_subscription_id = f"sub_{uuid.uuid4().hex[:14]}"
+        billing.plan_type = 'advance'
+    replacement = f"sub_{uuid.uuid4().hex[:14]}"
+
+    def cancel_subscription(self, subscription_id, immediately=False):
+        # Un webhook cambia la suscripción mientras se espera a Stripe
+        with get_db_session() as session:
+            session.query(UserBilling).filter_by(user_id=user['id']).update(
+                {UserBilling.stripe_subscription_id: replacement})
+        return {'success': True}
+
+    monkeypatch.setattr(StripeService, 'cancel_subscription', cancel_subscription)
+    response = client.post('/api/billing/subscription/cancel', json={'immediately': True}, headers=user['headers'])
+
+    assert response.status_code == 409
+    billing = _billing(user['id'])
+    assert billing.stripe_subscription_id == replacement and billing.plan_type == 'advance'
+    with get_db_session(readonly=True) as session:
+        assert session.query(BillingEvent).filter_by(user_id=user['id'], event_type='subscription_cancelled').count() == 0
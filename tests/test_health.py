@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Chequeo de ingesta de /ready"""
+from services import health_service
+from services.admission_service import get_admission_controller
+
+def _ingest(monkeypatch, in_flight: int, waiting: int) -> dict:
+    controller = get_admission_controller()
+    monkeypatch.setattr(controller, 'in_flight', in_flight)
+    monkeypatch.setattr(controller, 'waiting', waiting)
+    return health_service.check_ingest()
+
+def test_busy_worker_without_queue_is_ready(monkeypatch):
+    slots = get_admission_controller().db_slots
+    check = _ingest(monkeypatch, slots, 0)
+    assert check['ok'] and check['usage'] == 1.0
+
+def test_queued_ingest_is_not_ready(monkeypatch):
+    slots = get_admission_controller().db_slots
+    check = _ingest(monkeypatch, slots, slots)
+    assert not check['ok']
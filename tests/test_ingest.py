@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Idempotencia de /api/sync/data y de insert_ignore"""
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+import database
+from database import Base, _run_migrations, get_shard_session, insert_ignore, shard_for_user
+from models.sync_data import SyncData, SYNC_DATA_KEY
+
+def _sync(client, server, **fields):
+    response = client.post('/api/sync/data', json={'server_id': server['server_id'], 'avg_temperature': 21.0, **fields},
+                           headers=server['headers'])
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def _samples(server) -> int:
+    with get_shard_session(shard_for_user(server['id']), readonly=True) as session:
+        return session.query(SyncData).filter_by(server_id=server['pk']).count()
+
+def test_retry_without_timestamp_is_a_duplicate(client, server):
+    assert _sync(client, server)['duplicate'] is False
+    assert _sync(client, server)['duplicate'] is True
+    assert _samples(server) == 1
+
+def test_retry_with_timestamp_is_a_duplicate(client, server):
+    timestamp = (datetime.now() - timedelta(hours=1)).isoformat()
+    assert _sync(client, server, timestamp=timestamp)['duplicate'] is False
+    assert _sync(client, server, timestamp=timestamp)['duplicate'] is True
+
+def test_insert_ignore_without_on_conflict(server, monkeypatch):
+    monkeypatch.setattr(database, 'ON_CONFLICT_DIALECTS', ())
+    now = datetime.now().replace(microsecond=0)
+    row = {'server_id': server['pk'], 'user_id': server['id'], 'data_timestamp': now}
+    with get_shard_session(shard_for_user(server['id'])) as session:
+        assert insert_ignore(session, SyncData, SYNC_DATA_KEY, row) == 1
+        later = {**row, 'data_timestamp': now + timedelta(minutes=15)}
+        assert insert_ignore(session, SyncData, SYNC_DATA_KEY, [row, later]) == 1
+    assert _samples(server) == 2
+
+def test_migration_removes_duplicates_before_the_unique_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    table = Base.metadata.tables['sync_data']
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_sync_data_server_timestamp"))
+        conn.execute(text("CREATE INDEX ix_sync_data_server_timestamp ON sync_data (server_id, data_timestamp)"))
+    moment = datetime(2026, 1, 1, 10, 15)
+    with Session(engine) as session:
+        session.add_all(SyncData(server_id=1, user_id=1, data_timestamp=moment) for _ in range(3))
+        session.add(SyncData(server_id=1, user_id=1, data_timestamp=moment + timedelta(minutes=15)))
+        session.commit()
+
+    _run_migrations(engine, [table])
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM sync_data")).scalar() == 2
+    indexes = {index['name']: index for index in inspect(engine).get_indexes('sync_data')}
+    assert indexes['uq_sync_data_server_timestamp']['unique']
+    assert 'ix_sync_data_server_timestamp' not in indexes
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Registros encolados por el logging no bloqueante"""
+import logging
+import queue
+from utils.logging_config import NonBlockingQueueHandler
+
+def test_message_is_merged_before_queueing():
+    log_queue = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue)
+    state = {'status': 'online'}
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, "Servidor %s en estado %s", ('srv-1', state), None)
+    handler.emit(record)
+    state['status'] = 'offline'  # el hilo de la request sigue usando el objeto
+
+    queued = log_queue.get_nowait()
+    assert queued.getMessage() == "Servidor srv-1 en estado {'status': 'online'}"
+    assert queued.args is None
+    assert record.args == ('srv-1', state)  # otros handlers reciben el registro intacto
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Precarga en el master de gunicorn de las dependencias que la app importa en su primer uso"""
+from utils.lazy_import import LazyModule, preload_modules
+
+def test_preload_imports_every_lazy_module(app):
+    from services.analytics_service import np as analytics_np
+    from services.stripe_service import stripe
+    extra = LazyModule('colorsys')
+    missing = LazyModule('modulo_que_no_existe')
+
+    loaded = preload_modules('bcrypt')
+
+    assert analytics_np.loaded and stripe.loaded and extra.loaded
+    assert not missing.loaded and 'bcrypt' in loaded
+    assert stripe.api_key  # on_load configuró el cliente
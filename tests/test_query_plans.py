@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Regresión de planes de las consultas calientes
+Captura el SQL real que emiten los endpoints, lo pasa por EXPLAIN y comprueba que use el
+índice previsto sin recorrer la tabla completa (SQLite: EXPLAIN QUERY PLAN; PostgreSQL: EXPLAIN)
+"""
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from database import Base, _run_migrations, get_db_session, get_shard_session, shard_for_user
+from models.billing import BillingEvent
+from models.sync_data import SyncData
+from services.analytics_service import load_window
+from services.sample_feed import SampleFeed
+
+@contextmanager
+def captured():
+    """(engine, sql, parámetros) de cada sentencia ejecutada dentro del bloque"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((conn.engine, statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+
+def explain(engine, statement: str, parameters) -> str:
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            return '\n'.join(row[-1] for row in rows)
+        return '\n'.join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN {statement}", parameters))
+
+def assert_plan(statements, pattern: str, table: str, index: str):
+    """El SELECT que coincide con pattern usa index (también para ordenar) y no recorre table entera"""
+    matches = [(engine, sql, params) for engine, sql, params in statements
+               if sql.lstrip().upper().startswith('SELECT') and re.search(pattern, sql, re.S)]
+    assert matches, f"No se ejecutó ninguna consulta {pattern!r}"
+    for engine, sql, params in matches:
+        plan = explain(engine, sql, params)
+        full_scan = re.search(rf"^\s*SCAN {table}\b(?! USING)|Seq Scan on {table}\b", plan, re.M)
+        assert not full_scan, f"Recorrido completo de {table}:\n{plan}\n{sql}"
+        assert index in plan, f"No usa {index}:\n{plan}\n{sql}"
+        assert 'TEMP B-TREE' not in plan, f"Ordena fuera del índice:\n{plan}\n{sql}"
+
+@pytest.fixture
+def history(server):
+    """Dos servidores con un mes de muestras cada 15 min, con estadísticas del planificador"""
+    start = datetime.now() - timedelta(days=30)
+    shard = shard_for_user(server['id'])
+    with get_shard_session(shard) as session:
+        for server_pk in (server['pk'], server['pk'] + 100000):
+            session.add_all(
+                SyncData(server_id=server_pk, user_id=server['id'], data_timestamp=start + timedelta(minutes=15 * i),
+                         avg_temperature=21.0, avg_humidity=85.0)
+                for i in range(30 * 96)
+            )
+        session.execute(text('ANALYZE'))
+    with get_db_session() as session:
+        session.add_all(BillingEvent(user_id=server['id'], event_type='payment_succeeded') for _ in range(50))
+        session.execute(text('ANALYZE'))
+    return server
+
+def test_history_uses_server_timestamp_index(client, history):
+    start = (datetime.now() - timedelta(days=2)).isoformat()
+    with captured() as statements:
+        response = client.get(f"/api/sync/servers/{history['pk']}/history", query_string={'start': start},
+                              headers=history['headers'])
+    assert response.status_code == 200
+    assert_plan(statements, r'FROM sync_data\b.*ORDER BY sync_data\.data_timestamp', 'sync_data',
+                'uq_sync_data_server_timestamp')
+
+def test_recent_samples_use_server_timestamp_index(client, history):
+    with captured() as statements:
+        response = client.get(f"/api/sync/servers/{history['pk']}/recent", headers=history['headers'])
+    assert response.status_code == 200
+    assert_plan(statements, r'FROM sync_data\b.*ORDER BY sync_data\.data_timestamp DESC', 'sync_data',
+                'uq_sync_data_server_timestamp')
+
+def test_dashboard_recent_syncs_use_received_at_index(client, admin, history):
+    with captured() as statements:
+        response = client.get('/api/admin/dashboard', headers=admin['headers'])
+    assert response.status_code == 200
+    assert_plan(statements, r'FROM sync_data\b.*ORDER BY sync_data\.received_at DESC', 'sync_data',
+                'ix_sync_data_received_at')
+
+def test_fleet_window_uses_timestamp_index(history):
+    end = datetime.now()
+    with captured() as statements:
+        load_window(end - timedelta(hours=2), end)
+    assert_plan(statements, r'FROM sync_data\b.*data_timestamp >=', 'sync_data', 'ix_sync_data_timestamp_brin')
+
+def test_billing_events_use_user_created_index(client, history):
+    with captured() as statements:
+        response = client.get('/api/billing/events', headers=history['headers'])
+    assert response.status_code == 200
+    assert_plan(statements, r'FROM billing_events\b.*ORDER BY billing_events\.created_at DESC', 'billing_events',
+                'ix_billing_events_user_created')
+
+def test_migration_drops_superseded_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    tables = [Base.metadata.tables[name] for name in ('users', 'local_servers', 'sync_data', 'sync_events', 'billing_events')]
+    Base.metadata.create_all(engine, tables=tables)
+    old = {
+        'ix_sync_data_server_id': 'sync_data (server_id)',
+        'ix_sync_data_data_timestamp': 'sync_data (data_timestamp)',
+        'ix_sync_events_server_id': 'sync_events (server_id)',
+        'ix_billing_events_user_id': 'billing_events (user_id)'
+    }
+    with engine.begin() as conn:
+        for name, target in old.items():
+            conn.execute(text(f"CREATE INDEX {name} ON {target}"))
+
+    _run_migrations(engine, tables)
+
+    remaining = {index['name'] for name in ('sync_data', 'sync_events', 'billing_events')
+                 for index in inspect(engine).get_indexes(name)}
+    assert not remaining & set(old)
+
+def test_sample_feed_uses_received_at_index(history):
+    feed = SampleFeed(('avg_temperature',), shard_index=1, shard_count=2)
+    feed.poll()
+    with captured() as statements:
+        feed.poll()
+    assert_plan(statements, r'FROM sync_data\b.*ORDER BY sync_data\.received_at', 'sync_data',
+                'ix_sync_data_received_at')
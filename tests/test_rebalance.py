@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Mover un usuario entre los dos shards SQLite sin perder ni duplicar filas"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+from database import Base, _run_migrations, get_shard_session
+from models.sync_data import SyncData, SyncEvent
+from services import rebalance_service
+from services.rebalance_service import current_shard, move_tenant
+
+def _count(model, shard: int, server_pk: int) -> int:
+    with get_shard_session(shard, readonly=True) as session:
+        return session.query(model).filter_by(server_id=server_pk).count()
+
+def _sample(server, moment: datetime, **fields) -> dict:
+    return {'server_id': server['pk'], 'user_id': server['id'], 'data_timestamp': moment, **fields}
+
+@pytest.fixture
+def no_grace(monkeypatch):
+    monkeypatch.setattr(rebalance_service, 'SHARD_ASSIGNMENT_TTL', 0)
+
+def test_grace_shorter_than_the_assignment_ttl_is_rejected(server):
+    other = 1 - current_shard(server['id'])
+    with pytest.raises(ValueError):
+        move_tenant(server['id'], other, grace=rebalance_service.SHARD_ASSIGNMENT_TTL / 2)
+    assert current_shard(server['id']) != other
+
+def test_move_copies_late_commits_below_the_mark(client, server, no_grace, monkeypatch):
+    for minutes in (0, 15):
+        timestamp = (datetime.now() - timedelta(hours=1, minutes=minutes)).isoformat()
+        response = client.post('/api/sync/data', json={'server_id': server['server_id'], 'timestamp': timestamp},
+                               headers=server['headers'])
+        assert response.status_code == 200
+    source = current_shard(server['id'])
+    target = 1 - source
+    base = datetime.now().replace(microsecond=0) - timedelta(days=1)
+
+    # Deja un hueco de ids bajo la marca inicial, como una transacción que aún no confirmó
+    with get_shard_session(source) as session:
+        top = session.execute(select(func.max(SyncData.id))).scalar()
+        session.add(SyncData(id=top + 10, **_sample(server, base)))
+        session.commit()
+
+    set_user_shard = rebalance_service.set_user_shard
+
+    def late_commit(user_id, shard):
+        with get_shard_session(source) as session:
+            session.add(SyncData(id=top + 5, **_sample(server, base + timedelta(minutes=15))))
+            session.commit()
+        set_user_shard(user_id, shard)
+
+    monkeypatch.setattr(rebalance_service, 'set_user_shard', late_commit)
+    result = move_tenant(server['id'], target, grace=0)
+
+    assert result['moved'] == {'sync_data': 4, 'sync_events': 2, 'archived_segments': 0}
+    assert current_shard(server['id']) == target
+    assert _count(SyncData, target, server['pk']) == 4 and _count(SyncData, source, server['pk']) == 0
+    assert _count(SyncEvent, target, server['pk']) == 2 and _count(SyncEvent, source, server['pk']) == 0
+
+def test_repeated_copy_does_not_duplicate_events(server, no_grace):
+    source = current_shard(server['id'])
+    target = 1 - source
+    with get_shard_session(source) as session:
+        session.add_all(SyncEvent(server_id=server['pk'], event_type='sync_success') for _ in range(3))
+        session.commit()
+        mark = session.execute(select(func.max(SyncEvent.id))).scalar()
+
+    # Copia interrumpida antes de borrar el origen, luego el movimiento completo
+    key = rebalance_service.SYNC_EVENT_KEY
+    assert rebalance_service._copy_rows(SyncEvent, key, [server['pk']], source, target, 0, mark) == 3
+    move_tenant(server['id'], target, grace=0)
+
+    assert _count(SyncEvent, target, server['pk']) == 3
+    assert _count(SyncEvent, source, server['pk']) == 0
+
+def test_migration_keys_existing_events(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE sync_events (id INTEGER PRIMARY KEY, server_id INTEGER NOT NULL, "
+            "event_type VARCHAR(100) NOT NULL, message TEXT, event_metadata JSON, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO sync_events (server_id, event_type) VALUES (1, 'sync_success'), (1, 'sync_success')"))
+
+    _run_migrations(engine, [Base.metadata.tables['sync_events']])
+
+    with engine.connect() as conn:
+        keys = conn.execute(text("SELECT event_key FROM sync_events")).scalars().all()
+    assert len(set(keys)) == 2 and all(keys)
+    indexes = {index['name']: index for index in inspect(engine).get_indexes('sync_events')}
+    assert indexes['uq_sync_events_server_key']['unique']
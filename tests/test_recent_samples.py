@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Buffer de muestras recientes por worker: no sirve datos que otro worker ya superó"""
+from datetime import datetime, timedelta
+import pytest
+from services import recent_samples
+from services.recent_samples import RecentSamplesBuffer
+
+def _sync(client, server, temperature: float, **fields):
+    payload = {'server_id': server['server_id'], 'avg_temperature': temperature, **fields}
+    response = client.post('/api/sync/data', json=payload, headers=server['headers'])
+    assert response.status_code == 200, response.get_json()
+
+def _recent(client, server) -> dict:
+    response = client.get(f"/api/sync/servers/{server['pk']}/recent", headers=server['headers'])
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+@pytest.fixture
+def buffer(monkeypatch):
+    """Buffer propio de este worker, con la ventana de asentamiento desactivada"""
+    worker_buffer = RecentSamplesBuffer(slots=8, max_servers=4)
+    monkeypatch.setattr(recent_samples, '_recent_buffer', worker_buffer)
+    monkeypatch.setattr('routes.sync_routes.RECENT_BUFFER_SETTLE_SECONDS', 0)
+    return worker_buffer
+
+def test_sync_on_another_worker_invalidates_the_buffer(client, server, buffer):
+    _sync(client, server, 20.0, timestamp=(datetime.now() - timedelta(minutes=30)).isoformat())
+    assert _recent(client, server)['source'] == 'database'
+    assert _recent(client, server)['source'] == 'memory'
+
+    # Otro worker recibe un sync: la base avanza last_sync_at y este buffer no ve la muestra
+    buffer.append = lambda *args: None
+    _sync(client, server, 23.0)
+    del buffer.append
+
+    body = _recent(client, server)
+    assert body['source'] == 'database'
+    assert [sample['avg_temperature'] for sample in body['samples']] == [20.0, 23.0]
+
+def test_sync_on_this_worker_keeps_serving_from_memory(client, server, buffer):
+    _sync(client, server, 20.0, timestamp=(datetime.now() - timedelta(minutes=30)).isoformat())
+    _recent(client, server)
+    _sync(client, server, 21.5)
+
+    body = _recent(client, server)
+    assert body['source'] == 'memory'
+    assert body['samples'][-1]['avg_temperature'] == 21.5
+
+def test_other_users_server_is_not_found(client, server, buffer):
+    _sync(client, server, 20.0)
+    _recent(client, server)
+    other = client.post('/api/auth/register', json={'email': f"other-{server['server_id']}@fungicloud.local",
+                                                    'password': 'test-password'}).get_json()
+    response = client.get(f"/api/sync/servers/{server['pk']}/recent",
+                          headers={'Authorization': f"Bearer {other['token']}"})
+    assert response.status_code == 404
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Reglas de umbral evaluadas por el líder del monitor, y cola de emails acotada"""
+import threading
+from datetime import datetime, timedelta
+import pytest
+from database import get_db_session
+from models.alert_rule import AlertRuleWindow
+from models.user import User
+from services import alert_service
+from services.alert_service import AlertService
+
+@pytest.fixture
+def rule(client, server):
+    body = {'name': 'Humedad baja', 'server_id': server['pk'], 'metric': 'avg_humidity',
+            'operator': '<', 'threshold': 80, 'duration_minutes': 30}
+    response = client.post('/api/alerts/rules', json=body, headers=server['headers'])
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['rule']
+
+def _leader(monkeypatch) -> AlertService:
+    """Monitor de alertas que ya ganó el lease; las alertas de reglas quedan en fired"""
+    service = AlertService()
+    service.is_leader = True
+    service.fired = []
+    monkeypatch.setattr(service, 'send_rule_alert',
+                        lambda to_email, server_name, triggered: service.fired.extend(triggered))
+    service._scan_samples()  # primera lectura: fija el cursor
+    return service
+
+@pytest.fixture
+def leader(monkeypatch):
+    return _leader(monkeypatch)
+
+def _sync(client, server, minutes_ago: int, humidity: float):
+    timestamp = (datetime.now() - timedelta(minutes=minutes_ago)).isoformat()
+    response = client.post('/api/sync/data', json={'server_id': server['server_id'], 'timestamp': timestamp,
+                                                   'avg_humidity': humidity}, headers=server['headers'])
+    assert response.status_code == 200
+
+def _window(rule_id: int, server_pk: int):
+    with get_db_session(readonly=True) as session:
+        window = session.query(AlertRuleWindow).filter_by(rule_id=rule_id, server_id=server_pk).first()
+        return (window.started_at, window.alerted) if window else None
+
+def test_duration_window_alerts_once_per_episode(client, server, rule, leader):
+    for minutes_ago in (60, 45):
+        _sync(client, server, minutes_ago, 70.0)
+    assert _window(rule['id'], server['pk']) is None  # la ingesta no evalúa reglas
+    leader._scan_samples()
+    started_at, alerted = _window(rule['id'], server['pk'])
+    assert not alerted and leader.fired == []
+
+    for minutes_ago in (30, 15, 0):
+        _sync(client, server, minutes_ago, 70.0)
+    leader._scan_samples()
+    assert [triggered['rule_id'] for triggered in leader.fired] == [rule['id']]
+    assert _window(rule['id'], server['pk']) == (started_at, True)
+
+    # La condición se corta y se rearma
+    _sync(client, server, -15, 85.0)
+    leader._scan_samples()
+    assert _window(rule['id'], server['pk']) is None and len(leader.rules) == 0
+
+def test_next_leader_continues_the_episode(client, server, rule, leader, monkeypatch):
+    for minutes_ago in (60, 45):
+        _sync(client, server, minutes_ago, 70.0)
+    leader._scan_samples()
+    leader._drop_owned_state()  # lease perdido
+
+    successor = _leader(monkeypatch)
+    _sync(client, server, 30, 70.0)
+    successor._scan_samples()
+    assert [triggered['rule_id'] for triggered in successor.fired] == [rule['id']]
+
+def test_rule_change_applies_on_the_next_scan(client, server, rule, leader):
+    for minutes_ago in (60, 45):
+        _sync(client, server, minutes_ago, 70.0)
+    leader._scan_samples()
+    before = _window(rule['id'], server['pk'])
+
+    response = client.put(f"/api/alerts/rules/{rule['id']}", json={'threshold': 75}, headers=server['headers'])
+    assert response.status_code == 200
+    assert _window(rule['id'], server['pk']) is None
+    with get_db_session(readonly=True) as session:
+        assert session.get(User, server['id']).alert_rules_version == 2  # creación y modificación
+
+    # El episodio empieza de nuevo con la regla modificada: a los 30 min del primero no alerta
+    _sync(client, server, 30, 70.0)
+    leader._scan_samples()
+    assert leader.fired == []
+    started_at, alerted = _window(rule['id'], server['pk'])
+    assert started_at > before[0] and not alerted
+    assert leader.rules._indexes[server['id']].rules[rule['id']].threshold == 75
+
+    response = client.delete(f"/api/alerts/rules/{rule['id']}", headers=server['headers'])
+    assert response.status_code == 200
+    for minutes_ago in (15, 0):
+        _sync(client, server, minutes_ago, 70.0)
+    leader._scan_samples()
+    assert leader.fired == [] and len(leader.rules) == 0
+
+def test_email_queue_is_bounded(monkeypatch):
+    monkeypatch.setattr(alert_service, 'ALERT_EMAIL_WORKERS', 1)
+    monkeypatch.setattr(alert_service, 'ALERT_EMAIL_QUEUE_SIZE', 2)
+    service = AlertService()
+    release = threading.Event()
+    sent = []
+
+    def slow_send(to_email, subject, body):
+        release.wait(5)
+        sent.append(to_email)
+
+    monkeypatch.setattr(service, '_send_email', slow_send)
+    before = threading.active_count()
+    for index in range(6):
+        service.send_rule_alert(f"user{index}@fungicloud.local", 'Granja', [])
+    assert threading.active_count() - before <= 1
+    assert service.emails_dropped >= 3
+
+    release.set()
+    service._outbox.join()
+    assert len(sent) == 6 - service.emails_dropped
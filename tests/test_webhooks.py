@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Pipeline de webhooks de Stripe contra el Stripe local (tests/stripe_stub.py)"""
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from database import get_db_session
+from models.billing import UserBilling, BillingEvent, StripeWebhookEvent
+from services import webhook_service
+from services.webhook_service import WebhookProcessor, get_webhook_processor
+from tests.conftest import wait_for
+from tests.stripe_stub import LocalStripe
+
+@pytest.fixture
+def stripe(client):
+    return LocalStripe(client)
+
+@pytest.fixture
+def customer(user):
+    """Usuario con cliente de Stripe asignado"""
+    customer_id = f"cus_{uuid.uuid4().hex[:14]}"
+    with get_db_session() as session:
+        billing = session.query(UserBilling).filter_by(user_id=user['id']).one()
+        billing.stripe_customer_id = customer_id
+    return {**user, 'customer_id': customer_id}
+
+def _status(stripe_event_id: str):
+    with get_db_session(readonly=True) as session:
+        record = session.query(StripeWebhookEvent).filter_by(stripe_event_id=stripe_event_id).first()
+        return record.status if record else None
+
+def _billing(user_id: int) -> UserBilling:
+    with get_db_session(readonly=True) as session:
+        billing = session.query(UserBilling).filter_by(user_id=user_id).one()
+        session.expunge(billing)
+        return billing
+
+def _billing_events(user_id: int) -> list:
+    with get_db_session(readonly=True) as session:
+        return [event.event_type for event in session.query(BillingEvent).filter_by(user_id=user_id)]
+
+def test_invalid_signature_is_rejected(stripe, customer):
+    event = stripe.event('invoice.payment_succeeded', {'customer': customer['customer_id']})
+    response = stripe.send(event, secret='whsec_otro')
+    assert response.status_code == 400
+    assert _status(event['id']) is None
+
+def test_event_is_applied_once(stripe, customer):
+    event = stripe.event('customer.subscription.updated',
+                         stripe.subscription(customer['customer_id'], 'price_advance'))
+    first = stripe.send(event)
+    second = stripe.send(event)
+    assert first.status_code == 200 and first.get_json()['duplicate'] is False
+    assert second.status_code == 200 and second.get_json()['duplicate'] is True
+
+    wait_for(lambda: _status(event['id']) == 'processed')
+    assert _billing(customer['id']).plan_type == 'advance'
+    assert _billing_events(customer['id']).count('plan_changed') == 1
+
+def test_older_state_event_is_ignored(stripe, customer):
+    now = int(time.time())
+    newer = stripe.event('customer.subscription.updated',
+                         stripe.subscription(customer['customer_id'], 'price_expert'), created=now)
+    older = stripe.event('customer.subscription.updated',
+                         stripe.subscription(customer['customer_id'], 'price_starter'), created=now - 60)
+    stripe.send(newer)
+    wait_for(lambda: _status(newer['id']) == 'processed')
+    stripe.send(older)
+    wait_for(lambda: _status(older['id']) == 'ignored')
+    assert _billing(customer['id']).plan_type == 'expert'
+
+def test_failed_event_is_retried_without_blocking_its_partition(stripe, customer, monkeypatch):
+    processor = get_webhook_processor()
+    original = WebhookProcessor._apply
+    failures = []
+
+    def flaky(self, session, record):
+        if record.event_type == 'invoice.payment_failed' and not failures:
+            failures.append(record.id)
+            raise RuntimeError("fallo transitorio")
+        return original(self, session, record)
+
+    monkeypatch.setattr(WebhookProcessor, '_apply', flaky)
+    failing = stripe.event('invoice.payment_failed', {'customer': customer['customer_id'], 'amount_due': 500})
+    following = stripe.event('invoice.payment_succeeded', {'customer': customer['customer_id'], 'amount_paid': 500})
+    stripe.send(failing)
+    wait_for(lambda: failures)
+    stripe.send(following)
+
+    # El siguiente evento del mismo cliente no espera al backoff del que falló
+    wait_for(lambda: _status(following['id']) == 'processed')
+    wait_for(lambda: _status(failing['id']) == 'processed')
+    assert processor.running
+
+def test_failure_during_shutdown_stays_pending(stripe, customer, monkeypatch):
+    processor = WebhookProcessor(worker_count=1)  # sin iniciar: running = False, como al apagarse
+    event = stripe.event('invoice.payment_succeeded', {'customer': customer['customer_id']})
+    with get_db_session() as session:
+        record = StripeWebhookEvent(stripe_event_id=event['id'], event_type=event['type'],
+                                    stripe_customer_id=customer['customer_id'], payload=event,
+                                    attempts=webhook_service.WEBHOOK_MAX_ATTEMPTS)
+        session.add(record)
+        session.flush()
+        record_id = record.id
+
+    def broken(self, session, record):
+        raise RuntimeError("pool cerrado")
+
+    monkeypatch.setattr(WebhookProcessor, '_apply', broken)
+    processor.process(record_id)
+    assert _status(event['id']) == 'pending'
+
+def test_requeue_only_takes_abandoned_claims(stripe, customer, monkeypatch):
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(hours=1)
+    live = stripe.event('invoice.payment_succeeded', {'customer': customer['customer_id']})
+    abandoned = stripe.event('invoice.payment_succeeded', {'customer': customer['customer_id']})
+    with get_db_session() as session:
+        for event, claimed_at in ((live, now), (abandoned, old)):
+            session.add(StripeWebhookEvent(stripe_event_id=event['id'], event_type=event['type'],
+                                           stripe_customer_id=customer['customer_id'], payload=event,
+                                           status='processing', attempts=1,
+                                           received_at=old, claimed_at=claimed_at))
+
+    processor = WebhookProcessor(worker_count=1)
+    enqueued = []
+    monkeypatch.setattr(processor, '_enqueue', lambda record_id, customer_id: enqueued.append(record_id))
+    processor._requeue_pending()
+
+    assert _status(live['id']) == 'processing'  # otro worker lo está aplicando
+    assert _status(abandoned['id']) == 'pending'
+    with get_db_session(readonly=True) as session:
+        abandoned_id = session.query(StripeWebhookEvent.id).filter_by(stripe_event_id=abandoned['id']).scalar()
+    assert abandoned_id in enqueued
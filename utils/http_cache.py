@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+GET condicionales (ETag / If-None-Match) para FungiCloud
+El ETag se deriva de versiones baratas de obtener (updated_at, contadores) para poder
+responder 304 sin serializar el payload
+"""
+import hashlib
+import json
+from datetime import datetime
+from flask import request, Response
+
+PRIVATE_CACHE_CONTROL = 'private, no-cache'  # el cliente guarda la respuesta pero siempre revalida
+
+def _part(value) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def make_etag(*parts) -> str:
+    """ETag corto a partir de las versiones que determinan la respuesta"""
+    return hashlib.blake2b('|'.join(_part(part) for part in parts).encode('utf-8'), digest_size=12).hexdigest()
+
+def is_not_modified(etag: str) -> bool:
+    """Indica si el cliente ya tiene esta versión (If-None-Match)"""
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified(etag: str, cache_control: str = PRIVATE_CACHE_CONTROL) -> Response:
+    """Respuesta 304 vacía"""
+    response = Response(status=304)
+    return with_etag(response, etag, cache_control)
+
+def with_etag(response, etag: str, cache_control: str = PRIVATE_CACHE_CONTROL):
+    """Agrega ETag y Cache-Control a una respuesta"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def precomputed_json(payload: dict):
+    """(cuerpo JSON, ETag) de un payload estático, calculados una sola vez"""
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return body, hashlib.blake2b(body.encode('utf-8'), digest_size=12).hexdigest()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Respuestas JSON en streaming para FungiCloud
+Los listados con ?stream=1 se leen por lotes (yield_per) y se serializan fila a fila en
+un arreglo JSON enviado por chunks, opcionalmente comprimido con gzip al vuelo: la memoria
+por request no crece con el tamaño del listado.
+"""
+import json
+import logging
+import os
+import zlib
+from flask import request, Response, stream_with_context
+from sqlalchemy import tuple_
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))  # filas por lote leído de la base
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes de JSON acumulados antes de enviar un chunk
+STREAM_GZIP_LEVEL = 6
+
+def wants_stream(args) -> bool:
+    """Indica si el cliente pidió el listado completo en streaming (?stream=1)"""
+    return args.get('stream', '').lower() in ('1', 'true')
+
+def iter_rows(query, keys, after=None):
+    """Todas las filas de query ordenadas por keys (desde el cursor si hay), leídas por lotes"""
+    if after is not None:
+        query = query.filter(tuple_(*keys) > tuple_(*after))
+    return query.order_by(*keys).yield_per(STREAM_BATCH_SIZE)
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+def _json_chunks(key: str, rows, serialize, extra: dict):
+    """{"success":true, ...extra, key: [...], "count": n} en chunks de ~STREAM_CHUNK_SIZE bytes"""
+    parts = [_dumps({"success": True, **extra})[:-1], f',"{key}":[']
+    size = 0
+    count = 0
+    try:
+        for row in rows:
+            item = _dumps(serialize(row))
+            parts.append(',' + item if count else item)
+            count += 1
+            size += len(item)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(parts).encode('utf-8')
+                parts = []
+                size = 0
+    except Exception as e:
+        # Los headers ya se enviaron: el cliente recibe un JSON truncado
+        logger.error(f"Error en listado en streaming ({key}): {e}")
+        raise
+    parts.append(f'],"count":{count}}}')
+    yield ''.join(parts).encode('utf-8')
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(STREAM_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_json_array(key: str, rows, serialize, **extra) -> Response:
+    """Respuesta en streaming con las filas serializadas en el arreglo key
+
+    La sesión de la request sigue abierta mientras se envía el cuerpo (stream_with_context
+    retrasa el teardown hasta el último chunk).
+    """
+    chunks = _json_chunks(key, rows, serialize, extra)
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        chunks = _gzipped(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype='application/json', headers=headers)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Importación diferida de dependencias pesadas (stripe, numpy)
+El módulo se importa en el primer acceso a un atributo, no al importar la app. Con
+preload_app de gunicorn el master los carga todos antes del fork (preload_modules):
+importarlos en cada worker después del fork duplicaría el trabajo y la memoria.
+"""
+import importlib
+import importlib.util
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lazy_modules = []  # todos los LazyModule creados, para preload_modules
+
+def module_available(name: str) -> bool:
+    """Indica si el módulo está instalado sin importarlo"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+class LazyModule:
+    """Proxy de un módulo que se importa (y configura con on_load) en el primer uso"""
+    def __init__(self, name: str, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+        _lazy_modules.append(self)
+
+    def load(self):
+        """Importa el módulo si aún no se hizo y lo devuelve"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load is not None:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+def preload_modules(*names: str) -> list:
+    """Importa ya los LazyModule registrados y los módulos names que estén instalados"""
+    loaded = []
+    for lazy in _lazy_modules:
+        if not lazy.loaded and module_available(lazy._name):
+            lazy.load()
+            loaded.append(lazy._name)
+    for name in names:
+        if module_available(name):
+            importlib.import_module(name)
+            loaded.append(name)
+    if loaded:
+        logger.info(f"Módulos precargados antes del fork: {', '.join(sorted(set(loaded)))}")
+    return loaded
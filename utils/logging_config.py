@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Logging no bloqueante para FungiCloud
+Los hilos de las requests solo encolan el registro (QueueHandler); un hilo escritor
+(QueueListener) lo formatea y lo escribe. Los mensajes repetidos por debajo de WARNING
+se limitan por plantilla (LOG_RATE_LIMIT por LOG_RATE_WINDOW segundos), por eso los
+logs de rutas calientes usan argumentos estilo % en lugar de f-strings:
+
+    logger.info("Datos sincronizados de servidor %s", server_id)
+
+Con LOG_FORMAT=json cada línea es un objeto JSON con request_id y server_id.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from flask import g, request, has_request_context
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # text | json
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # registros en espera; si se llena se descartan
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 20))  # registros por plantilla y ventana (0 = sin límite)
+LOG_RATE_WINDOW = float(os.getenv('LOG_RATE_WINDOW', 1))  # segundos
+LOG_RATE_MAX_TEMPLATES = 10000
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+class RequestContextFilter(logging.Filter):
+    """Agrega request_id y server_id de la request en curso (se ejecuta en el hilo que loguea)"""
+    def filter(self, record) -> bool:
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.server_id = g.get('server_id')
+        else:
+            record.request_id = None
+            record.server_id = None
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Deja pasar hasta limit registros por (logger, plantilla) y ventana; WARNING o más pasan siempre
+
+    El primer registro de una ventana nueva lleva en `suppressed` cuántos se descartaron.
+    """
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counters = {}  # (logger, plantilla) -> [inicio de ventana, emitidos, descartados]
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        if not self.limit or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                if len(self._counters) >= LOG_RATE_MAX_TEMPLATES:
+                    self._counters.clear()  # mensajes sin plantilla (f-strings): no crecer sin límite
+                counter = self._counters[key] = [now, 0, 0]
+            elif now - counter[0] >= self.window:
+                if counter[2]:
+                    record.suppressed = counter[2]
+                counter[:] = [now, 0, 0]
+            if counter[1] >= self.limit:
+                counter[2] += 1
+                return False
+            counter[1] += 1
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro"""
+    def format(self, record) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'server_id': getattr(record, 'server_id', None),
+            'thread': record.threadName
+        }
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Encola el mensaje ya armado pero sin formatear y sin bloquear si la cola está llena"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # El mensaje y la traza se resuelven aquí: los args pueden ser objetos mutables o no
+        # seguros entre hilos, y exc_info no se puede pasar a otro hilo. El formato (hora,
+        # JSON) sigue en el hilo escritor. Copia: otros handlers reciben el registro intacto.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Estado global del pipeline
+_handler = None
+_listener = None
+_config_lock = threading.Lock()
+
+def _output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+def _start_listener():
+    """Crea la cola y el hilo escritor (también en cada proceso hijo tras un fork)"""
+    global _listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, _output_handler(), respect_handler_level=True)
+    _listener.start()
+
+def configure_logging(level: str = LOG_LEVEL):
+    """Instala el pipeline de logging en el logger raíz (idempotente)"""
+    global _handler
+    with _config_lock:
+        if _handler is not None:
+            return
+        _handler = NonBlockingQueueHandler(None)
+        _handler.addFilter(RateLimitFilter())
+        _handler.addFilter(RequestContextFilter())
+        _start_listener()
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Vacía la cola y detiene el hilo escritor"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def logging_stats() -> dict:
+    """Registros en cola y descartados por cola llena"""
+    if _handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
+
+def _after_fork_in_child():
+    # El hilo escritor no sobrevive al fork: cola y listener nuevos para el hijo
+    if _handler is not None:
+        _start_listener()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def init_request_logging(app):
+    """Asigna un request_id a cada request (o respeta X-Request-ID) y lo devuelve en la respuesta"""
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex[:16]
+
+    @app.after_request
+    def echo_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Paginación por cursor (keyset) para FungiCloud
+Cada página continúa después de la última fila de la anterior (WHERE (k1, k2) > (...))
+en lugar de usar OFFSET, así el costo por página no crece con el tamaño de la tabla
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from sqlalchemy import tuple_
+
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 50))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 200))
+
+class CursorError(ValueError):
+    """Cursor mal formado o de otro listado"""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+def encode_cursor(values) -> str:
+    """Cursor opaco (base64 de JSON) con los valores de las claves de orden"""
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Valores del cursor; CursorError si no corresponde a size claves"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(values, list) or len(values) != size:
+            raise CursorError("Cursor inválido")
+        return [_decode_value(value) for value in values]
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorError("Cursor inválido") from e
+
+def page_args(args, key_count: int, default: int = PAGE_SIZE_DEFAULT):
+    """(valores del cursor o None, tamaño de página) a partir de ?cursor= y ?limit=
+
+    Se valida antes de abrir la sesión: un cursor inválido lanza CursorError.
+    """
+    limit = min(max(args.get('limit', default, type=int), 1), PAGE_SIZE_MAX)
+    cursor = args.get('cursor')
+    return (decode_cursor(cursor, key_count) if cursor else None), limit
+
+def paginate(query, keys, after=None, limit: int = PAGE_SIZE_DEFAULT, descending: bool = False, key_of=None):
+    """Aplica una página keyset a query y devuelve (filas, next_cursor)
+
+    keys son columnas no nulas cuya combinación es única (la última suele ser el id);
+    key_of extrae sus valores de una fila si la fila no es la entidad misma.
+    """
+    if after is not None:
+        position = tuple_(*keys)
+        query = query.filter(position < tuple_(*after) if descending else position > tuple_(*after))
+
+    query = query.order_by(*(key.desc() if descending else key.asc() for key in keys))
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = key_of(last) if key_of else [getattr(last, key.key) for key in keys]
+        next_cursor = encode_cursor(values)
+    return rows, next_cursor
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Limitación de tasa para FungiCloud
+Token bucket: acumula `rate` fichas por segundo hasta `capacity` y cada operación
+consume las suyas, lo que permite ráfagas cortas pero fija el ritmo sostenido
+"""
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Consume las fichas y devuelve 0, o devuelve los segundos a esperar (sin consumir)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return (min(tokens, self.capacity) - self.tokens) / self.rate
+
+    def refund(self, tokens: float = 1):
+        """Devuelve fichas consumidas por una operación que al final no se hizo"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
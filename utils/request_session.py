@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Unidad de trabajo por request para FungiCloud
+La autenticación y el handler comparten una sola sesión por request: se abre en el
+primer uso, se confirma una vez en after_request (solo si hubo escrituras y la
+respuesta no es un error) y se cierra en el teardown. Las requests de solo lectura
+no hacen commit.
+
+Los handlers que llaman a servicios externos (Stripe) siguen usando get_db_session
+para no retener la conexión durante la llamada.
+
+Read-your-writes entre workers: tras una escritura la respuesta lleva el instante en
+X-Last-Write (header y cookie); el cliente lo reenvía y cualquier worker manda sus
+lecturas a la primaria durante DATABASE_READ_YOUR_WRITES_WINDOW.
+"""
+import logging
+import math
+import time
+from contextlib import contextmanager
+from flask import g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from database import (get_session, mark_write, set_write_marker, reset_write_marker, write_marker,
+                      READ_YOUR_WRITES_WINDOW)
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+WRITES_KEY = 'request_writes'
+REQUEST_KEY = 'request_consistency_key'  # solo presente en sesiones de request
+WRITE_MARKER_HEADER = 'X-Last-Write'
+WRITE_MARKER_COOKIE = 'fc_last_write'
+
+@event.listens_for(OrmSession, 'after_flush')
+def _flagged_flush(session, flush_context):
+    session.info[WRITES_KEY] = True
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def _flagged_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info[WRITES_KEY] = True
+
+@event.listens_for(OrmSession, 'after_commit')
+def _cleared_on_commit(session):
+    # También los commits explícitos del handler cuentan para read-your-writes
+    if session.info.pop(WRITES_KEY, None) and REQUEST_KEY in session.info:
+        mark_write(session.info[REQUEST_KEY])
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _cleared_on_rollback(session):
+    session.info.pop(WRITES_KEY, None)
+
+def _sessions() -> dict:
+    """{readonly: sesión} abiertas en la request actual"""
+    sessions = g.get('db_sessions')
+    if sessions is None:
+        sessions = g.db_sessions = {}
+    return sessions
+
+@contextmanager
+def request_session(readonly: bool = False, consistency_key=None):
+    """Sesión compartida por la request actual (misma semántica de readonly que get_db_session)
+
+    Una lectura reutiliza la sesión de escritura si ya está abierta (ve sus propios
+    cambios). El commit lo hace after_request; un commit explícito dentro del bloque
+    solo hace falta cuando algo posterior depende de los datos ya confirmados.
+    """
+    sessions = _sessions()
+    session = sessions.get(False) if readonly else None
+    if session is None:
+        session = sessions.get(readonly)
+    if session is None:
+        session = sessions[readonly] = get_session(readonly, consistency_key, scoped=False)
+        session.info[REQUEST_KEY] = consistency_key
+    try:
+        yield session
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error en transacción de base de datos: {e}")
+        raise
+
+def _has_writes(session) -> bool:
+    return bool(session.new or session.dirty or session.deleted or session.info.get(WRITES_KEY))
+
+def current_user(user_id: int):
+    """Usuario autenticado, cargado una sola vez por request con la sesión compartida"""
+    user = g.get('current_user')
+    if user is None or user.id != user_id:
+        with request_session(readonly=True, consistency_key=user_id) as session:
+            user = g.current_user = session.get(User, user_id)
+    return user
+
+def _client_write_marker():
+    """Última escritura que el cliente dice haber hecho (nunca en el futuro), o 0"""
+    raw = request.headers.get(WRITE_MARKER_HEADER) or request.cookies.get(WRITE_MARKER_COOKIE)
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, min(value, time.time())) if math.isfinite(value) else 0.0
+
+def load_write_marker():
+    """before_request: las lecturas de esta request respetan las escrituras previas del cliente"""
+    g.write_marker_in = _client_write_marker()
+    g.write_marker_token = set_write_marker(g.write_marker_in)
+
+def _attach_write_marker(response):
+    marker = write_marker()
+    if not marker or marker == g.get('write_marker_in'):
+        return response
+    value = f"{marker:.3f}"
+    response.headers[WRITE_MARKER_HEADER] = value
+    response.set_cookie(WRITE_MARKER_COOKIE, value, max_age=int(math.ceil(READ_YOUR_WRITES_WINDOW)),
+                        httponly=True, samesite='Lax')
+    return response
+
+def commit_request_session(response):
+    """after_request: confirma la sesión de escritura si la request escribió algo"""
+    session = g.get('db_sessions', {}).get(False)
+    if session is None or response.status_code >= 400 or not _has_writes(session):
+        return _attach_write_marker(response)
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error confirmando la transacción de la request: {e}")
+        response = jsonify({"success": False, "error": "Error interno del servidor"})
+        response.status_code = 500
+    return _attach_write_marker(response)
+
+def close_request_session(exc=None):
+    """teardown_request: devuelve las conexiones al pool (lo no confirmado se descarta)"""
+    token = g.pop('write_marker_token', None)
+    if token is not None:
+        try:
+            reset_write_marker(token)
+        except ValueError:
+            set_write_marker(None)  # teardown en otro contexto (respuestas en streaming)
+    sessions = g.pop('db_sessions', None)
+    if not sessions:
+        return
+    for session in sessions.values():
+        try:
+            session.close()
+        except Exception as e:
+            logger.error(f"Error cerrando la sesión de la request: {e}")
+
+def init_request_sessions(app):
+    """Registra la unidad de trabajo por request en la app"""
+    app.before_request(load_write_marker)
+    app.after_request(commit_request_session)
+    app.teardown_request(close_request_session)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Validación declarativa de payloads para FungiCloud
+Un Schema se declara una vez (campo -> tipo y límites) y se compila a una lista de
+funciones de conversión, una por campo: validar una muestra es recorrer esa lista,
+sin introspección por request. Los campos ausentes quedan en None (o su default), y
+cualquier valor mal formado rechaza la muestra con un error por campo.
+"""
+import math
+from datetime import datetime
+
+class ValidationError(ValueError):
+    """Payload inválido; errors es {campo: mensaje}"""
+    def __init__(self, errors: dict):
+        super().__init__("Payload inválido")
+        self.errors = errors
+
+class _Invalid(Exception):
+    pass
+
+def parse_timestamp(value) -> datetime:
+    """Timestamp ISO 8601 o epoch en segundos, como hora local naive"""
+    if isinstance(value, bool):
+        raise ValueError("timestamp inválido")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+    raise ValueError("timestamp inválido")
+
+class Field:
+    """Tipo de un campo; compile() devuelve la función que convierte un valor presente"""
+    def __init__(self, required: bool = False, default=None):
+        self.required = required
+        self.default = default
+
+    def compile(self):
+        raise NotImplementedError
+
+def _range_message(kind: str, low, high) -> str:
+    if low is not None and high is not None:
+        return f"debe ser {kind} entre {low} y {high}"
+    if low is not None:
+        return f"debe ser {kind} >= {low}"
+    if high is not None:
+        return f"debe ser {kind} <= {high}"
+    return f"debe ser {kind}"
+
+class Float(Field):
+    """Número finito (int, float o texto numérico) en [min, max]"""
+    kind = 'un número'
+
+    def __init__(self, min: float = None, max: float = None, **kwargs):
+        super().__init__(**kwargs)
+        self.min = min
+        self.max = max
+
+    def compile(self):
+        low = -math.inf if self.min is None else self.min
+        high = math.inf if self.max is None else self.max
+        message = _range_message(self.kind, self.min, self.max)
+
+        def convert(value):
+            kind = type(value)
+            if kind is float or kind is int:
+                number = float(value)
+            elif kind is str:
+                try:
+                    number = float(value)
+                except ValueError:
+                    raise _Invalid(message)
+            else:
+                raise _Invalid(message)  # bool, listas, objetos
+            if not low <= number <= high:  # también descarta NaN
+                raise _Invalid(message)
+            return number
+        return convert
+
+class Integer(Float):
+    """Entero (acepta 3.0 y "3") en [min, max]"""
+    kind = 'un entero'
+
+    def compile(self):
+        as_float = super().compile()
+        low = -math.inf if self.min is None else self.min
+        high = math.inf if self.max is None else self.max
+        message = _range_message(self.kind, self.min, self.max)
+
+        def convert(value):
+            if type(value) is int and low <= value <= high:
+                return value
+            number = as_float(value)
+            if not number.is_integer():
+                raise _Invalid(message)
+            return int(number)
+        return convert
+
+class String(Field):
+    """Texto no vacío de hasta max_length caracteres"""
+    def __init__(self, max_length: int = 255, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+
+    def compile(self):
+        max_length = self.max_length
+        message = f"debe ser texto de 1 a {max_length} caracteres"
+
+        def convert(value):
+            if type(value) is not str or not 0 < len(value) <= max_length:
+                raise _Invalid(message)
+            return value
+        return convert
+
+class Timestamp(Field):
+    """ISO 8601 o epoch en segundos (hora local naive)"""
+    def compile(self):
+        def convert(value):
+            try:
+                return parse_timestamp(value)
+            except (TypeError, ValueError, OverflowError, OSError):
+                raise _Invalid("timestamp inválido (ISO 8601 o epoch)")
+        return convert
+
+class Schema:
+    """Conjunto de campos compilado una sola vez; los campos desconocidos se ignoran"""
+    def __init__(self, fields: dict):
+        self.fields = dict(fields)
+        self._steps = tuple(
+            (name, field.compile(), field.required, field.default)
+            for name, field in self.fields.items()
+        )
+
+    def extend(self, fields: dict) -> 'Schema':
+        """Schema nuevo con campos agregados o reemplazados"""
+        return Schema({**self.fields, **fields})
+
+    def check(self, payload):
+        """(datos convertidos, {campo: error}); datos es None si hay errores"""
+        if not isinstance(payload, dict):
+            return None, {'_': "debe ser un objeto JSON"}
+        data = {}
+        errors = None
+        for name, convert, required, default in self._steps:
+            value = payload.get(name)
+            if value is None:
+                if required:
+                    errors = errors or {}
+                    errors[name] = "requerido"
+                data[name] = default
+                continue
+            try:
+                data[name] = convert(value)
+            except _Invalid as e:
+                errors = errors or {}
+                errors[name] = str(e)
+        return (None, errors) if errors else (data, None)
+
+    def validate(self, payload) -> dict:
+        """Datos convertidos; ValidationError con los errores por campo"""
+        data, errors = self.check(payload)
+        if errors:
+            raise ValidationError(errors)
+        return data
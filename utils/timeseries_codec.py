@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Codificación de series de tiempo para segmentos archivados
+Timestamps con delta-of-delta y floats con XOR del valor anterior (esquema tipo Gorilla),
+en bloques independientes comprimidos con zlib y un índice por bloque en la cabecera
+
+Formato del segmento:
+    MAGIC | longitud de cabecera (uint32) | cabecera JSON | bloques
+La cabecera lista las columnas y, por bloque, su rango de tiempo y posición en el archivo,
+de modo que leer un rango solo decodifica los bloques que lo tocan.
+"""
+import json
+import math
+import struct
+import zlib
+
+MAGIC = b'FCS1'
+PREAMBLE = struct.Struct('>4sI')
+BLOCK_SIZE = 512  # muestras por bloque
+
+class BitWriter:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._bits += nbits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buffer.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            return bytes(self._buffer) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self._buffer)
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self._value = int.from_bytes(data, 'big')
+        self._total = len(data) * 8
+        self._pos = 0
+
+    def read(self, nbits: int) -> int:
+        self._pos += nbits
+        if self._pos > self._total:
+            raise ValueError("Fin inesperado del bloque")
+        return (self._value >> (self._total - self._pos)) & ((1 << nbits) - 1)
+
+# Buckets de delta-of-delta: (prefijo, bits del prefijo, bits del valor)
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b11110, 5, 32), (0b11111, 5, 64))
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+def encode_timestamps(timestamps: list) -> bytes:
+    """Timestamps enteros (µs desde epoch) ordenados, con delta-of-delta"""
+    writer = BitWriter()
+    previous = timestamps[0]
+    writer.write(previous, 64)
+    previous_delta = 0
+    for timestamp in timestamps[1:]:
+        delta = timestamp - previous
+        dod = _zigzag(delta - previous_delta)
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+                if dod < (1 << value_bits):
+                    writer.write(prefix, prefix_bits)
+                    writer.write(dod, value_bits)
+                    break
+        previous, previous_delta = timestamp, delta
+    return writer.getvalue()
+
+def decode_timestamps(data: bytes, count: int) -> list:
+    reader = BitReader(data)
+    timestamps = [reader.read(64)]
+    previous_delta = 0
+    for _ in range(count - 1):
+        if reader.read(1) == 0:
+            dod = 0
+        else:
+            ones = 1
+            while ones < 5 and reader.read(1) == 1:
+                ones += 1
+            dod = reader.read(_DOD_BUCKETS[ones - 1][2])
+        previous_delta += _unzigzag(dod)
+        timestamps.append(timestamps[-1] + previous_delta)
+    return timestamps
+
+def _float_bits(value) -> int:
+    return struct.unpack('>Q', struct.pack('>d', math.nan if value is None else float(value)))[0]
+
+def encode_floats(values: list) -> bytes:
+    """Floats (None -> NaN) con XOR respecto al valor anterior"""
+    writer = BitWriter()
+    previous = _float_bits(values[0])
+    writer.write(previous, 64)
+    previous_leading, previous_trailing = -1, -1
+    for value in values[1:]:
+        bits = _float_bits(value)
+        xor = bits ^ previous
+        if xor == 0:
+            writer.write(0, 1)
+        else:
+            leading = min(64 - xor.bit_length(), 31)
+            trailing = (xor & -xor).bit_length() - 1
+            if previous_leading >= 0 and leading >= previous_leading and trailing >= previous_trailing:
+                # Los bits significativos caben en la ventana anterior
+                writer.write(0b10, 2)
+                writer.write(xor >> previous_trailing, 64 - previous_leading - previous_trailing)
+            else:
+                meaningful = 64 - leading - trailing
+                writer.write(0b11, 2)
+                writer.write(leading, 5)
+                writer.write(meaningful - 1, 6)
+                writer.write(xor >> trailing, meaningful)
+                previous_leading, previous_trailing = leading, trailing
+        previous = bits
+    return writer.getvalue()
+
+def decode_floats(data: bytes, count: int) -> list:
+    reader = BitReader(data)
+    previous = reader.read(64)
+    bits_list = [previous]
+    previous_leading, previous_trailing = -1, -1
+    for _ in range(count - 1):
+        if reader.read(1) == 1:
+            if reader.read(1) == 0:
+                meaningful = 64 - previous_leading - previous_trailing
+                previous ^= reader.read(meaningful) << previous_trailing
+            else:
+                previous_leading = reader.read(5)
+                meaningful = reader.read(6) + 1
+                previous_trailing = 64 - previous_leading - meaningful
+                previous ^= reader.read(meaningful) << previous_trailing
+        bits_list.append(previous)
+    values = []
+    for bits in bits_list:
+        value = struct.unpack('>d', struct.pack('>Q', bits))[0]
+        values.append(None if value != value else value)
+    return values
+
+def _encode_block(timestamps: list, columns: dict) -> bytes:
+    streams = [encode_timestamps(timestamps)] + [encode_floats(values) for values in columns.values()]
+    body = b''.join(struct.pack('>I', len(stream)) + stream for stream in streams)
+    return zlib.compress(body, 6)
+
+def _decode_block(data: bytes, count: int, names: list):
+    body = zlib.decompress(data)
+    streams = []
+    offset = 0
+    while offset < len(body):
+        (length,) = struct.unpack_from('>I', body, offset)
+        offset += 4
+        streams.append(body[offset:offset + length])
+        offset += length
+    timestamps = decode_timestamps(streams[0], count)
+    columns = {name: decode_floats(stream, count) for name, stream in zip(names, streams[1:])}
+    return timestamps, columns
+
+def encode_segment(timestamps: list, columns: dict, metadata: dict = None) -> bytes:
+    """Segmento con las muestras (timestamps enteros ordenados) y sus columnas"""
+    names = list(columns)
+    blocks = []
+    index = []
+    offset = 0
+    for start in range(0, len(timestamps), BLOCK_SIZE):
+        end = start + BLOCK_SIZE
+        block = _encode_block(timestamps[start:end], {name: columns[name][start:end] for name in names})
+        index.append({
+            'start': timestamps[start],
+            'end': timestamps[min(end, len(timestamps)) - 1],
+            'count': min(end, len(timestamps)) - start,
+            'offset': offset,
+            'length': len(block)
+        })
+        blocks.append(block)
+        offset += len(block)
+
+    header = json.dumps({
+        'columns': names,
+        'count': len(timestamps),
+        'blocks': index,
+        'metadata': metadata or {}
+    }, separators=(',', ':')).encode('utf-8')
+    return PREAMBLE.pack(MAGIC, len(header)) + header + b''.join(blocks)
+
+def read_header(read_range) -> tuple:
+    """(cabecera, posición de los bloques) usando read_range(offset, length) del almacenamiento"""
+    magic, header_length = PREAMBLE.unpack(read_range(0, PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError("Segmento inválido")
+    header = json.loads(read_range(PREAMBLE.size, header_length))
+    return header, PREAMBLE.size + header_length
+
+def read_segment(read_range, start: int = None, end: int = None, header=None):
+    """Genera (timestamp, {columna: valor}) en [start, end), leyendo solo los bloques necesarios"""
+    if header is None:
+        header = read_header(read_range)
+    header, base = header
+    names = header['columns']
+    for block in header['blocks']:
+        if (start is not None and block['end'] < start) or (end is not None and block['start'] >= end):
+            continue
+        timestamps, columns = _decode_block(read_range(base + block['offset'], block['length']), block['count'], names)
+        for position, timestamp in enumerate(timestamps):
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                yield timestamp, {name: columns[name][position] for name in names}